@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+
+import argparse
+import glob
+import json
+import logging
+import os
+import random
+import re
+import signal
+import statistics
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+DEFAULT_SAMPLES = 64
+# Per-input timeout passed to the harness, in seconds.
+EXEC_TIMEOUT = 100
+# Seconds the probe may take overall, as harness start waits for it.
+DEFAULT_BUDGET = 30
+
+EXECUTED_RE = re.compile(rb"Executed (.+?) in (\d+) ms")
+
+
+def sample_inputs(corpus_dirs: List[str], num_samples: int) -> List[Path]:
+    inputs = []
+    for corpus_dir in corpus_dirs:
+        if not os.path.isdir(corpus_dir):
+            continue
+        for root, _, files in os.walk(corpus_dir):
+            for name in files:
+                if name.startswith(".") or name.endswith(".cov"):
+                    continue
+                inputs.append(Path(root) / name)
+    if len(inputs) > num_samples:
+        inputs = random.sample(inputs, num_samples)
+    return inputs
+
+
+def measure(
+    harness_name: str, core: int, inputs: List[Path], budget: float
+) -> List[int]:
+    """Milliseconds per execution of each input that `reproduce` ran on
+    `core` within `budget` seconds."""
+    cmd = [
+        "taskset",
+        "-c",
+        str(core),
+        "reproduce",
+        harness_name,
+        f"-timeout={EXEC_TIMEOUT}",
+    ]
+    env = os.environ.copy()
+    env["TESTCASE"] = " ".join(str(path) for path in inputs)
+    # In a session of its own, so that the harness dies with it on timeout.
+    proc = subprocess.Popen(
+        cmd,
+        env=env,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        start_new_session=True,
+    )
+    try:
+        _, stderr = proc.communicate(timeout=budget)
+    except subprocess.TimeoutExpired:
+        os.killpg(proc.pid, signal.SIGKILL)
+        _, stderr = proc.communicate()
+    return [int(ms) for _, ms in EXECUTED_RE.findall(stderr)]
+
+
+def percentile(samples: List[float], q: float) -> float:
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+def calibrate(
+    harness_name: str,
+    cores: List[int],
+    corpus_dirs: List[str],
+    num_samples: int,
+    workdir: str,
+    budget: float = DEFAULT_BUDGET,
+) -> Optional[Dict]:
+    """Run a sample of the corpus split across `cores` in parallel and
+    summarize the per-exec latency. A one-byte input stands in for an empty
+    corpus. Whatever ran within `budget` seconds is counted."""
+    inputs = sample_inputs(corpus_dirs, num_samples)
+    if not inputs:
+        os.makedirs(workdir, exist_ok=True)
+        fallback = Path(workdir) / "calibration_input"
+        fallback.write_text("A")
+        inputs = [fallback]
+    # Every input of a run pays for the harness start once, so each core
+    # gets at least two.
+    cores = cores[: max(1, len(inputs) // 2)]
+    shards = [inputs[i :: len(cores)] for i in range(len(cores))]
+    with ThreadPoolExecutor(len(cores)) as executor:
+        results = executor.map(
+            measure,
+            [harness_name] * len(cores),
+            cores,
+            shards,
+            [budget] * len(cores),
+        )
+        samples = [ms for result in results for ms in result]
+    if not samples:
+        return None
+    return summarize(samples, len(samples))
+
+
+def summarize(samples: List[float], num_execs: int) -> Dict:
+    median = statistics.median(samples)
+    return {
+        # What UniAFL sizes its batches by.
+        "ms_per_exec": int(median),
+        "median_ms": median,
+        "p95_ms": percentile(samples, 0.95),
+        "max_ms": max(samples),
+        "samples": num_execs,
+        "time": time.time(),
+    }
+
+
+def read_exec_counts(stats_dir: str) -> Dict[str, int]:
+    """Executions so far of every UniAFL worker, from the counters it dumps."""
+    counts = {}
+    for path in glob.glob(os.path.join(stats_dir, "worker_*.json")):
+        try:
+            with open(path) as f:
+                counts[os.path.basename(path)] = json.load(f)["execs"]
+        except (OSError, ValueError, KeyError):
+            continue
+    return counts
+
+
+class CounterCalibrator:
+    """Mean per-exec latency from UniAFL's own exec counters: the wall time of
+    the workers between two reads over the executions they made meanwhile, so
+    the fuzzer's overheads are included. Counters give no per-exec latencies,
+    hence no percentiles. Unlike a probe, this takes no cores away from the
+    fuzzer and is not skewed by competing with it."""
+
+    def __init__(self, stats_dir: str) -> None:
+        self.stats_dir = stats_dir
+        self.__counts = read_exec_counts(stats_dir)
+        self.__read_at = time.monotonic()
+
+    def calibrate(self) -> Optional[Dict]:
+        counts = read_exec_counts(self.stats_dir)
+        now = time.monotonic()
+        elapsed_ms = (now - self.__read_at) * 1000
+        num_workers = 0
+        num_execs = 0
+        for worker, execs in counts.items():
+            # A worker restarted with UniAFL has its counter reset.
+            delta = execs - self.__counts.get(worker, execs)
+            if delta > 0:
+                num_workers += 1
+                num_execs += delta
+        self.__counts, self.__read_at = counts, now
+        if not num_execs:
+            return None
+        mean = elapsed_ms * num_workers / num_execs
+        return {
+            "ms_per_exec": int(mean),
+            "mean_ms": mean,
+            "samples": num_execs,
+            "time": time.time(),
+        }
+
+
+def write_calibration(output: str, calibration: Dict) -> None:
+    tmp = f"{output}.tmp.{os.getpid()}"
+    with open(tmp, "wt") as f:
+        json.dump(calibration, f)
+    os.replace(tmp, output)
+
+
+def write_result(args, calibration: Optional[Dict]) -> None:
+    if calibration is None:
+        logging.warning(f"[ExecCalibrator][{args.harness_name}] No execution measured")
+        return
+    write_calibration(args.output, calibration)
+    if "mean_ms" in calibration:
+        latency = f"mean {calibration['mean_ms']:.2f} ms"
+    else:
+        latency = (
+            f"median {calibration['median_ms']} ms, p95 {calibration['p95_ms']} ms"
+        )
+    logging.info(
+        f"[ExecCalibrator][{args.harness_name}] {calibration['samples']} execs: "
+        f"{latency}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Measure the per-exec latency of a harness, once on a corpus "
+        "sample or periodically from UniAFL's exec counters"
+    )
+    parser.add_argument("--harness-name", dest="harness_name", required=True)
+    parser.add_argument(
+        "--cores",
+        type=lambda s: [int(core) for core in s.split(",")],
+        default=[],
+        help="Comma-separated cores to run the sample on (must have without "
+        "--interval)",
+    )
+    parser.add_argument(
+        "--corpus-dir",
+        dest="corpus_dir",
+        action="append",
+        default=[],
+        help="Directory to sample inputs from, repeatable (default: none)",
+    )
+    parser.add_argument("--workdir", required=True)
+    parser.add_argument(
+        "--output", required=True, help="Path to the calibration JSON (must have)"
+    )
+    parser.add_argument(
+        "--samples",
+        type=int,
+        default=DEFAULT_SAMPLES,
+        help=f"Number of inputs to run (default: {DEFAULT_SAMPLES})",
+    )
+    parser.add_argument(
+        "--budget",
+        type=float,
+        default=DEFAULT_BUDGET,
+        help=f"Seconds the sample may run for (default: {DEFAULT_BUDGET})",
+    )
+    parser.add_argument(
+        "--interval",
+        type=int,
+        default=0,
+        help="Seconds between re-calibrations from --stats-dir "
+        "(default: 0, probe once)",
+    )
+    parser.add_argument(
+        "--stats-dir",
+        dest="stats_dir",
+        default=None,
+        help="Directory of UniAFL's per-worker exec counters (must have with "
+        "--interval)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    if args.interval <= 0:
+        if not args.cores:
+            parser.error("--cores is required to probe")
+        write_result(
+            args,
+            calibrate(
+                args.harness_name,
+                args.cores,
+                args.corpus_dir,
+                args.samples,
+                args.workdir,
+                args.budget,
+            ),
+        )
+        return
+    if args.stats_dir is None:
+        parser.error("--stats-dir is required with --interval")
+    calibrator = CounterCalibrator(args.stats_dir)
+    while True:
+        time.sleep(args.interval)
+        write_result(args, calibrator.calibrate())
+
+
+if __name__ == "__main__":
+    main()
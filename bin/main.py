@@ -2,12 +2,17 @@
 
 import asyncio
 import glob
+import hashlib
 import json
 import logging
 import os
 import shlex
 import sys
+import threading
 import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 import yaml
@@ -17,6 +22,13 @@ from redis import Redis
 
 sys.path.insert(0, "/usr/local/bin/symbolizer")
 from llvm_symbolizer import LLVMSymbolizer
+from llvm_symbolizer_pool import LLVMSymbolizerPool
+from seed_share import SeedShare
+from source_index import SourceIndex, source_dirs
+
+# The line function index is built next to the fuzzers, on at most this many
+# cores.
+LINE_FUNCTION_INDEX_MAX_NCPU = 4
 
 
 def dict_to_json(data):
@@ -37,6 +49,58 @@ def get_seed_share_dir():
     return os.getenv("SEED_SHARE_DIR", "/seed_share_dir")
 
 
+def _extract_seeds(corpus, members, dst, max_len):
+    written, duplicated, skipped = 0, 0, 0
+    with zipfile.ZipFile(corpus) as zf:
+        for info in members:
+            if info.file_size > max_len:
+                skipped += 1
+                continue
+            try:
+                with zf.open(info) as f:
+                    # The header may lie about the size.
+                    data = f.read(max_len + 1)
+            except (zipfile.BadZipFile, zlib.error) as e:
+                logging.warning(f"Skip broken seed {info.filename} in {corpus}: {e}")
+                skipped += 1
+                continue
+            if len(data) > max_len:
+                skipped += 1
+                continue
+            try:
+                with open(dst / hashlib.sha1(data).hexdigest(), "xb") as f:
+                    f.write(data)
+                written += 1
+            except FileExistsError:
+                duplicated += 1
+    return written, duplicated, skipped
+
+
+def extract_seed_corpus(corpus, dst, max_len, num_workers):
+    """Stream the members of the `corpus` zip into `dst`, named by the SHA-1
+    of their content like libFuzzer names corpus files, so that exact
+    duplicates (also of seeds already in `dst`) are dropped. Members over
+    `max_len` bytes are skipped. Returns the number of written, duplicated and
+    skipped seeds.
+
+    Members are decompressed by `num_workers` threads, each with its own
+    handle on the zip.
+    """
+    with zipfile.ZipFile(corpus) as zf:
+        members = [info for info in zf.infolist() if not info.is_dir()]
+    num_workers = max(1, min(num_workers, len(members)))
+    with ThreadPoolExecutor(num_workers) as executor:
+        counts = executor.map(
+            _extract_seeds,
+            [corpus] * num_workers,
+            [members[i::num_workers] for i in range(num_workers)],
+            [Path(dst)] * num_workers,
+            [max_len] * num_workers,
+        )
+        written, duplicated, skipped = map(sum, zip(*counts))
+    return written, duplicated, skipped
+
+
 class FuzzerOpt:
     def __init__(self, harness_name):
         self.harness_name = harness_name
@@ -82,6 +146,7 @@ class UniAFL(Module):
 
     def _init(self) -> None:
         self.redis_url = {}
+        self.coverage_map_path = {}
         self.fuzzer_opts = {}
         self.port = 22222
         self.tests_without_harness = [self._async_test_once]
@@ -101,6 +166,32 @@ class UniAFL(Module):
         self.redis_url[harness.name] = url
         return url
 
+    def use_coverage_map_file(self) -> bool:
+        # The JVM coverage agent only talks to Redis.
+        return (
+            self.crs.cp.language != "jvm"
+            and os.environ.get("COVERAGE_MAP_BACKEND") == "file"
+        )
+
+    def prepare_coverage_map_storage(self, harness, workdir):
+        if self.use_coverage_map_file():
+            self.redis_url[harness.name] = ""
+            self.coverage_map_path[harness.name] = str(workdir / "coverage_map")
+        else:
+            self.run_redis(harness)
+
+    def coverage_map_ready_path(self, harness) -> Path:
+        return Path(f"/executor/{harness.name}") / "coverage_map.ready"
+
+    def coverage_map_failed_path(self, harness) -> Path:
+        return Path(f"/executor/{harness.name}") / "coverage_map.failed"
+
+    def line_function_index_path(self) -> str | None:
+        if self.crs.cp.language == "jvm":
+            return None
+        crs_data_dir = os.environ.get("CRS_DATA_DIR", "/artifacts/crs-data")
+        return f"{crs_data_dir}/line_function_index.db"
+
     async def __async_get_fuzzer_opt(self, harness_name):
         if harness_name in self.fuzzer_opts:
             return self.fuzzer_opts[harness_name]
@@ -108,11 +199,46 @@ class UniAFL(Module):
         self.fuzzer_opts[harness_name] = ret
         return ret
 
+    async def async_get_max_len(self, harness_name) -> int:
+        fuzzer_opt = await self.__async_get_fuzzer_opt(harness_name)
+        return fuzzer_opt.get_max_len()
+
     async def __async_prepare_executor_all(self):
         tasks = []
         for harness in self.crs.target_harnesses:
             tasks.append(self.__async_prepare_executor(harness))
+        if self.crs.cp.language == "jvm":
+            tasks.append(asyncio.to_thread(self.__build_source_indexes))
         await asyncio.gather(*tasks)
+        # One index serves every harness of the target, and fuzzing does not
+        # wait for it either.
+        threading.Thread(
+            target=asyncio.run,
+            args=(self.__async_build_line_function_index(),),
+            daemon=True,
+        ).start()
+
+    def __build_source_indexes(self):
+        # Stored once here, so that every JvmSymbolizer only loads them.
+        for dir in source_dirs():
+            SourceIndex(dir)
+
+    async def __async_build_line_function_index(self):
+        index_path = self.line_function_index_path()
+        if index_path is None or os.environ.get("CREATE_CONF") != None:
+            return
+        if not any(
+            (Path("/coverage-out") / Path(harness.bin_path).name).exists()
+            for harness in self.crs.target_harnesses
+        ):
+            return
+        # A few niced workers, as it runs alongside the fuzzers.
+        ncpu = max(1, min(LINE_FUNCTION_INDEX_MAX_NCPU, self.crs.config.ncpu // 4))
+        cmd = ["nice", "-n", "19", "line_function_index.py"]
+        cmd += ["--index", index_path, "--ncpu", str(ncpu)]
+        ret = await util.async_run_cmd(cmd)
+        if ret.returncode != 0:
+            self.log(f"Failed to build the line function index:{ret}")
 
     async def __async_prepare_executor(self, harness):
         workdir = Path(f"/executor/{harness.name}")
@@ -122,6 +248,9 @@ class UniAFL(Module):
         os.system(f"chmod -R a+w '{workdir}'; chmod -R +t '{workdir}'")
         fuzzer_opt = await self.__async_get_fuzzer_opt(harness.name)
         max_len = fuzzer_opt.get_max_len()
+        self.prepare_coverage_map_storage(harness, workdir)
+        self.coverage_map_ready_path(harness).unlink(missing_ok=True)
+        self.coverage_map_failed_path(harness).unlink(missing_ok=True)
         config = {
             "project_src_dir": self.crs.cp.cp_src_path,
             "harness_src_path": harness.src_path,
@@ -132,11 +261,17 @@ class UniAFL(Module):
             "pov_dir": Path(os.environ.get("POV_DIR", "/artifacts/povs")),
             "workdir": dummy_dir / "workdir",
             "language": self.crs.cp.language,
-            "redis_url": self.run_redis(harness),
+            "redis_url": self.redis_url[harness.name],
             "ms_per_exec": 0,
             "max_len": max_len,
             "allow_timeout_bug": fuzzer_opt.is_timeout_bug_allowed(),
+            "coverage_map_ready_path": self.coverage_map_ready_path(harness),
+            "coverage_map_failed_path": self.coverage_map_failed_path(harness),
         }
+        if harness.name in self.coverage_map_path:
+            config["coverage_map_path"] = self.coverage_map_path[harness.name]
+        if self.line_function_index_path():
+            config["line_function_index_path"] = self.line_function_index_path()
         for core_id in range(self.crs.config.ncpu):
             name = f"{harness.name}_executor_{core_id}"
             config["harness_name"] = name
@@ -144,10 +279,32 @@ class UniAFL(Module):
             config["core_ids"] = [core_id]
             config_path = workdir / f"config_{core_id}"
             config_path.write_text(dict_to_json(config))
-        await self.__async_prepare_coverage(harness)
+        # Fuzzing does not wait for the coverage map: symbolizers hold the raw
+        # coverage back until the readiness marker shows up.
+        threading.Thread(
+            target=asyncio.run,
+            args=(self.__async_prepare_coverage(harness),),
+            daemon=True,
+        ).start()
 
     async def __async_prepare_coverage(self, harness):
         self.log(f"Prepare coverage map for {harness.name}")
+        failed = True
+        try:
+            failed = not await self.__async_build_coverage_map(harness)
+        finally:
+            # Either marker releases the queued coverage; the failure one lets
+            # the symbolizers report that the map is missing or partial.
+            if failed:
+                self.coverage_map_failed_path(harness).touch()
+                self.log(f"Failed to build the coverage map for {harness.name}")
+            else:
+                self.coverage_map_ready_path(harness).touch()
+                self.log(f"Coverage map for {harness.name} is ready")
+
+    async def __async_build_coverage_map(self, harness) -> bool:
+        """Build the coverage map of `harness`. Returns False if it failed;
+        only cfg_analyzer.py reports that through its exit status."""
         if self.crs.cp.language == "jvm":
             redis_url = self.redis_url[harness.name]
             cmd = [
@@ -163,16 +320,24 @@ class UniAFL(Module):
         elif self.crs.cp.language in ["c", "cpp", "c++", "rust", "go"]:
             if os.environ.get("CREATE_CONF") != None:
                 self.log("Skip because create_conf_mod")
-                return
-            redis_url = self.redis_url[harness.name]
+                return True
             cmd = f"cfg_analyzer.py"
             cmd += f" --harness {harness.bin_path}"
-            cmd += f" --redis_url {redis_url}"
+            if harness.name in self.coverage_map_path:
+                cmd += f" --coverage_map {self.coverage_map_path[harness.name]}"
+            else:
+                cmd += f" --redis_url {self.redis_url[harness.name]}"
+            crs_data_dir = os.environ.get("CRS_DATA_DIR", "/artifacts/crs-data")
+            cmd += f" --cache_dir {crs_data_dir}/cfg_cache"
             ncpu = self.crs.config.ncpu // len(self.crs.target_harnesses)
             ncpu = 1 if ncpu < 1 else ncpu
             cmd += f" --ncpu {ncpu}"
             env = os.environ.copy()
-            await util.async_run_cmd(cmd.split(" "), env=env)
+            ret = await util.async_run_cmd(cmd.split(" "), env=env)
+            if ret.returncode != 0:
+                self.log(f"cfg_analyzer failed for {harness.name}:{ret}")
+                return False
+        return True
 
     def is_log_mode(self) -> bool:
         return os.environ.get("LOG") == "True"
@@ -204,28 +369,116 @@ class UniAFL(Module):
             hrunner.pov_dir,
             "--interval",
             str(600),
+            "--symbolizer-journal",
+            self.symbolizer_journal_path(hrunner),
         ]
+        base_port = os.environ.get("WATCHDOG_PROMETHEUS_PORT")
+        if base_port:
+            # One port per harness, as each harness runs its own watchdog.
+            harnesses = [harness.name for harness in self.crs.target_harnesses]
+            port = int(base_port) + harnesses.index(hrunner.harness.name)
+            watchdog_cmd += ["--prometheus-port", str(port)]
         return await util.async_run_cmd(watchdog_cmd)
 
+    def seed_share_workdir(self, hrunner: HarnessRunner) -> Path:
+        # Shares the dedup index with the initial import in AnyHR.
+        return hrunner.get_workdir(f"{self.name}/seed_share_workdir")
+
     async def _async_run_seed_share(self, hrunner: HarnessRunner | None):
         if hrunner == None:
             return
         share_dir = get_seed_share_dir()
+        # New seeds are imported as they appear; the interval is only for the
+        # full rescans that catch missed events.
         cmd = [
             "seed_share.py",
             "--harness-name",
             hrunner.harness.name,
             "--workdir",
-            hrunner.get_workdir(f"{self.name}/seed_share_workdir"),
+            self.seed_share_workdir(hrunner),
             "--share-dir",
             share_dir,
             "--our-dst-dir",
             hrunner.others_corpus_dir,
             "--interval",
-            str(300),
+            str(60),
         ]
         return await util.async_run_cmd(cmd)
 
+    def symbolizer_socket_path(self, hrunner: HarnessRunner) -> Path:
+        return hrunner.get_workdir(f"{self.name}/symbolizer_service") / "socket"
+
+    def symbolizer_journal_path(self, hrunner: HarnessRunner) -> Path:
+        # Next to the coverage it produces, so it survives a restart with it.
+        # The coverage dir is shared by all harnesses, the journal is not.
+        name = hrunner.harness.name
+        return Path(hrunner.uniafl_cov_dir) / f".symbolizer_journal.{name}.db"
+
+    def exec_calibration_path(self, hrunner: HarnessRunner) -> Path:
+        return hrunner.get_workdir(f"{self.name}/exec_calibration") / "result.json"
+
+    def exec_calibrator_cmd(self, hrunner: HarnessRunner, interval: int = 0) -> list:
+        cmd = [
+            "exec_calibrator.py",
+            "--harness-name",
+            hrunner.harness.name,
+            "--workdir",
+            hrunner.get_workdir(f"{self.name}/exec_calibration"),
+            "--output",
+            self.exec_calibration_path(hrunner),
+        ]
+        if interval:
+            # Re-calibrations read UniAFL's exec counters rather than compete
+            # with it for its cores.
+            stats_dir = hrunner.get_workdir(f"{self.name}/workdir") / "stats"
+            return cmd + ["--interval", str(interval), "--stats-dir", stats_dir]
+        return cmd + [
+            "--cores",
+            ",".join(map(str, hrunner.core_ids)),
+            "--corpus-dir",
+            hrunner.others_corpus_dir,
+            "--corpus-dir",
+            hrunner.uniafl_corpus_dir,
+        ]
+
+    async def _async_run_exec_calibrator(self, hrunner: HarnessRunner | None):
+        if hrunner == None:
+            return
+        # UniAFL picks up the new batch size from the result file.
+        return await util.async_run_cmd(self.exec_calibrator_cmd(hrunner, 1800))
+
+    async def _async_run_symbolizer_service(
+        self, hrunner: HarnessRunner | None, config_path: Path
+    ):
+        if hrunner == None:
+            return
+        workdir = hrunner.get_workdir(f"{self.name}/symbolizer_service")
+        coverage_harness = Path("/coverage-out") / Path(hrunner.harness.bin_path).name
+        cmd = [
+            "symbolizer_service.py",
+            "--config",
+            str(config_path),
+            "--socket",
+            str(self.symbolizer_socket_path(hrunner)),
+            "--work_dir",
+            str(workdir),
+            "--workers",
+            str(max(1, len(hrunner.core_ids) // 2)),
+            "--coverage_harness",
+            str(coverage_harness),
+            "--journal",
+            str(self.symbolizer_journal_path(hrunner)),
+            "--cpu_budget",
+            os.environ.get("SYMBOLIZER_CPU_BUDGET", "1.0"),
+            "--ready_marker",
+            str(self.coverage_map_ready_path(hrunner.harness)),
+            "--failed_marker",
+            str(self.coverage_map_failed_path(hrunner.harness)),
+        ]
+        if self.is_log_mode():
+            cmd += ["--log_dir", str(workdir / "log")]
+        return await util.async_run_cmd(cmd)
+
     async def _async_run_cleaner(self, hrunner: HarnessRunner | None):
         if hrunner == None:
             return
@@ -247,6 +500,11 @@ class UniAFL(Module):
             self.logH(hrunner, "Check logfile: " + str(log_file))
         self.logH(hrunner, "Run UniAFL")
 
+        # Executors symbolize locally until the service is listening.
+        symbolizer_service = asyncio.create_task(
+            self._async_run_symbolizer_service(hrunner, config_path)
+        )
+
         # Spawn subprocess directly to get handle for per-harness shutdown
         proc = await asyncio.create_subprocess_exec(
             *[str(c) for c in cmd],
@@ -261,6 +519,7 @@ class UniAFL(Module):
         watchdog = asyncio.create_task(self._async_run_watchdog(hrunner))
         cleaner = asyncio.create_task(self._async_run_cleaner(hrunner))
         seed_share = asyncio.create_task(self._async_run_seed_share(hrunner))
+        exec_calibrator = asyncio.create_task(self._async_run_exec_calibrator(hrunner))
 
         # Wait for process to complete
         out, err = await proc.communicate()
@@ -271,7 +530,13 @@ class UniAFL(Module):
             self.logH(hrunner, f"stderr: {err.decode('utf-8', errors='replace')}")
 
         # Cleanup support tasks
-        for task in [watchdog, seed_share, cleaner]:
+        for task in [
+            watchdog,
+            seed_share,
+            cleaner,
+            symbolizer_service,
+            exec_calibrator,
+        ]:
             if not task.done():
                 task.cancel()
                 try:
@@ -379,7 +644,19 @@ class UniAFL(Module):
             "ms_per_exec": hrunner.ms_per_exec,
             "max_len": max_len,
             "allow_timeout_bug": fuzzer_opt.is_timeout_bug_allowed(),
+            "symbolizer_socket": self.symbolizer_socket_path(hrunner),
+            "coverage_cache_dir": hrunner.get_workdir(f"{self.name}/coverage_cache"),
+            "coverage_map_ready_path": self.coverage_map_ready_path(hrunner.harness),
+            "coverage_map_failed_path": self.coverage_map_failed_path(
+                hrunner.harness
+            ),
+            "symbolizer_journal_path": self.symbolizer_journal_path(hrunner),
+            "exec_calibration_path": self.exec_calibration_path(hrunner),
         }
+        if hrunner.harness.name in self.coverage_map_path:
+            config["coverage_map_path"] = self.coverage_map_path[hrunner.harness.name]
+        if self.line_function_index_path():
+            config["line_function_index_path"] = self.line_function_index_path()
         if UniAFL.DIFF_PATH.exists():
             config["diff_path"] = str(UniAFL.DIFF_PATH)
             process_diff_path = Path("/src/ref.diff.json")
@@ -435,69 +712,50 @@ class AnyHR(HarnessRunner):
         seed_share_dir = Path(get_seed_share_dir())
         if not seed_share_dir.exists():
             return
-        crs_name = os.environ.get("CRS_NAME", "atlantis-multilang-given_fuzzer")
-        loaded = 0
-        for entry in seed_share_dir.iterdir():
-            if entry.is_dir():
-                if entry.name == crs_name:
-                    continue
-                await util.async_cp(entry, dst)
-                self.log(f"Reuse corpus from {entry}")
-                loaded += 1
-            elif entry.is_file() and not entry.name.startswith("."):
-                await util.async_cp(entry, dst / entry.name)
-                loaded += 1
+        share = SeedShare(
+            self.crs.uniafl.seed_share_workdir(self),
+            self.harness.name,
+            seed_share_dir,
+            dst,
+        )
+        loaded = await asyncio.to_thread(share.sync)
         if loaded == 0:
             self.log(f"No reusable corpus found for {self.harness.name}")
+        else:
+            self.log(f"Reuse {loaded} seeds from {seed_share_dir}")
 
     async def __unzip_given_corpus(self, dst):
         corpus = self.harness.get_given_corpus()
         if corpus == None:
             self.log("No given corpus")
             return
-        tmp = f"/tmp/{self.crs.cp.name}_{self.harness.name}_given_corpus"
-        os.makedirs(tmp, exist_ok=True)
-        await util.async_run_cmd(f"unzip -o -d {tmp}/ {corpus}".split(" "))
-        names = {}
-        total = 0
-        for file in glob.glob(f"{tmp}/**/*", recursive=True):
-            file = Path(file)
-            if file.is_dir():
-                continue
-            name = file.name
-            if name in names:
-                n = names[name]
-                names[name] += 1
-                name = f"{name}_duplicated_{n}"
-            else:
-                names[name] = 1
-            file.rename(dst / name)
-            total += 1
-        self.log(f"Extract {total} seed from {corpus} and save into {dst}")
+        max_len = await self.crs.uniafl.async_get_max_len(self.harness.name)
+        try:
+            written, duplicated, skipped = await asyncio.to_thread(
+                extract_seed_corpus, corpus, dst, max_len, len(self.core_ids)
+            )
+        except (zipfile.BadZipFile, OSError) as e:
+            self.log(f"Failed to extract {corpus}: {e}")
+            return
+        self.log(
+            f"Extract {written} seed from {corpus} and save into {dst} "
+            f"({duplicated} duplicated, {skipped} over {max_len} bytes or broken)"
+        )
 
     async def __async_get_ms_per_exec(self):
-        tmp = self.workdir / "tmp"
-        tmp.write_text("A")
-        core = self.core_ids[0]
-        cmd = [
-            "taskset",
-            "-c",
-            str(core),
-            "reproduce",
-            self.harness.name,
-            "-timeout=100",
-        ]
-        key = bytes(f"Executed {tmp} in", "utf-8")
-        ms = 0
-        env = os.environ.copy()
-        env["TESTCASE"] = f"{tmp} {tmp}"
-        for i in range(5):
-            ret = await util.async_run_cmd(cmd, env=env)
-            if key not in ret.stderr:
-                continue
-            ms = int(ret.stderr.split(key)[-1].split(b" ms")[0])
-            break
-        self.log(f"{ms} ms/exec")
+        uniafl = self.crs.uniafl
+        uniafl.exec_calibration_path(self).unlink(missing_ok=True)
+        await util.async_run_cmd(uniafl.exec_calibrator_cmd(self))
+        try:
+            calibration = json.loads(uniafl.exec_calibration_path(self).read_text())
+        except (OSError, ValueError):
+            self.log("Exec speed calibration failed, 0 ms/exec")
+            return 0
+        ms = calibration["ms_per_exec"]
+        self.log(
+            f"{ms} ms/exec (median {calibration['median_ms']} ms, "
+            f"p95 {calibration['p95_ms']} ms over {calibration['samples']} execs)"
+        )
         return ms
 
 
@@ -558,6 +816,8 @@ def create_conf(cp, conf_path, answer_path_if_exist):
         return src
 
     conf = {}
+    # Harnesses built into the same binary share its llvm-symbolizer.
+    pools = {}
 
     async def get_key_addr(harness):
         cmd = f"nm {harness.bin_path} | grep LLVMFuzzerTestOneInput"
@@ -572,8 +832,13 @@ def create_conf(cp, conf_path, answer_path_if_exist):
         key_addr = await get_key_addr(harness)
         if key_addr == None:
             return
-        symbolizer = LLVMSymbolizer(str(harness.bin_path), "/out/llvm-symbolizer")
-        ret = symbolizer.run_llvm_symbolizer_addr(key_addr)
+        bin_path = str(harness.bin_path)
+        if bin_path not in pools:
+            pools[bin_path] = LLVMSymbolizerPool(bin_path, "/out/llvm-symbolizer", 1)
+        symbolizer = LLVMSymbolizer(
+            bin_path, "/out/llvm-symbolizer", pool=pools[bin_path]
+        )
+        ret = await asyncio.to_thread(symbolizer.run_llvm_symbolizer_addr, key_addr)
         conf[name] = normalize_src(ret.src_file)
 
     async def get_dummy_cov(harness, idx):
@@ -615,7 +880,11 @@ def create_conf(cp, conf_path, answer_path_if_exist):
             idx += 1
         await asyncio.gather(*jobs)
 
-    asyncio.run(update_all(cp))
+    try:
+        asyncio.run(update_all(cp))
+    finally:
+        for pool in pools.values():
+            pool.close()
 
     to_yaml = []
     with open(conf_path, "w") as f:
@@ -1,65 +1,300 @@
 #!/usr/bin/env python3
 
+import argparse
+import ctypes
+import errno
+import hashlib
+import logging
 import os
+import select
+import shutil
+import sqlite3
+import struct
 import time
-import subprocess
-import logging
-import argparse
 from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+DEFAULT_MAX_ENTRIES = 1 << 20
+# Seconds to keep collecting events once one arrived, so that a burst of new
+# seeds is imported as one batch.
+BATCH_WINDOW = 0.05
+MAX_BATCH = 1024
+# Files modified more recently may still be being written; a rescan picks
+# them up later. Only applies when polling.
+SETTLE_TIME = 1.0
+
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_TO = 0x80
+_IN_CREATE = 0x100
+_IN_Q_OVERFLOW = 0x4000
+_IN_ISDIR = 0x40000000
+_EVENT = struct.Struct("iIII")
+
+
+class Inotify:
+    """Minimal inotify binding through libc, to avoid a dependency."""
+
+    def __init__(self) -> None:
+        self.__libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.__libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.watches: Dict[int, Path] = {}
+
+    def add_watch(self, path: Path) -> None:
+        mask = _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE
+        wd = self.__libc.inotify_add_watch(self.fd, os.fsencode(path), mask)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f"inotify_add_watch({path}) failed")
+        self.watches[wd] = path
+
+    def read(self, timeout: Optional[float]) -> Optional[List[tuple]]:
+        """(path, mask) of the events within `timeout`, or None if some were
+        lost and everything has to be rescanned."""
+        ready, _, _ = select.select([self.fd], [], [], timeout)
+        if not ready:
+            return []
+        try:
+            buf = os.read(self.fd, 1 << 16)
+        except BlockingIOError:
+            return []
+        events = []
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = _EVENT.unpack_from(buf, offset)
+            offset += _EVENT.size
+            name = buf[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & _IN_Q_OVERFLOW:
+                return None
+            if wd in self.watches and name:
+                events.append((self.watches[wd] / os.fsdecode(name), mask))
+        return events
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+class SeedIndex:
+    """Files already looked at, with their size, mtime and content hash, in a
+    SQLite database that survives restarts. Holds at most `max_entries` files;
+    the ones whose hash was seen longest ago are forgotten first, so a hash
+    stays known as long as any recently seen file has it."""
+
+    def __init__(self, db_path: str, max_entries: int = DEFAULT_MAX_ENTRIES) -> None:
+        self.max_entries = max_entries
+        self.__db = sqlite3.connect(db_path, timeout=60)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, hash TEXT NOT NULL, "
+            "last_seen REAL NOT NULL)"
+        )
+        self.__db.execute("CREATE INDEX IF NOT EXISTS files_hash ON files (hash)")
+        self.__db.execute(
+            "CREATE INDEX IF NOT EXISTS files_last_seen ON files (last_seen)"
+        )
+        self.__db.commit()
+
+    def is_known(self, path: str, st: os.stat_result) -> bool:
+        row = self.__db.execute(
+            "SELECT size, mtime_ns FROM files WHERE path = ?", (path,)
+        ).fetchone()
+        return row is not None and tuple(row) == (st.st_size, st.st_mtime_ns)
 
+    def has_hash(self, digest: str) -> bool:
+        return (
+            self.__db.execute(
+                "SELECT 1 FROM files WHERE hash = ? LIMIT 1", (digest,)
+            ).fetchone()
+            is not None
+        )
 
-def cp(src, dst):
-    return subprocess.run(["cp", str(src), str(dst)], check=False)
+    def touch(self, paths: List[str]) -> None:
+        """Mark known files as seen again, so that they are not forgotten while
+        they are still in the share dir."""
+        now = time.time()
+        with self.__db:
+            self.__db.executemany(
+                "UPDATE files SET last_seen = ? WHERE path = ?",
+                [(now, p) for p in paths],
+            )
+
+    def add(self, entries: List[tuple]) -> None:
+        """Record (path, stat, hash) entries."""
+        now = time.time()
+        with self.__db:
+            self.__db.executemany(
+                "INSERT OR REPLACE INTO files (path, size, mtime_ns, hash, last_seen) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(p, st.st_size, st.st_mtime_ns, h, now) for p, st, h in entries],
+            )
+            (count,) = self.__db.execute("SELECT COUNT(*) FROM files").fetchone()
+            if count > self.max_entries:
+                # Files of a hash go together, by the last time any of them was
+                # seen.
+                self.__db.execute(
+                    "DELETE FROM files WHERE path IN (SELECT path FROM files "
+                    "JOIN (SELECT hash, MAX(last_seen) AS hash_seen FROM files "
+                    "GROUP BY hash) USING (hash) ORDER BY hash_seen, hash LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+
+
+def file_hash(path: Path) -> str:
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def link_or_copy(src: Path, dst: Path) -> None:
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copyfile(src, dst)
 
 
 class SeedShare:
-    def __init__(self, workdir, harness_name, share_dir, our_dst_dir):
+    def __init__(
+        self,
+        workdir,
+        harness_name,
+        share_dir,
+        our_dst_dir,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+    ):
         self.workdir = Path(workdir)
         self.harness_name = harness_name
         self.share_dir = Path(share_dir)
         self.our_dst_dir = Path(our_dst_dir)
-        self.loaded = set()
+        self.crs_name = os.environ.get("CRS_NAME", "atlantis-multilang-given_fuzzer")
+        # Next to our_dst_dir, so that a batch is renamed into it at once.
+        self.staging_dir = self.workdir / "staging"
+        os.makedirs(self.staging_dir, exist_ok=True)
+        self.index = SeedIndex(str(self.workdir / "seed_index.db"), max_entries)
 
     def info(self, msg):
         logging.info(f"[SeedShare][{self.harness_name}] {msg}")
 
-    def sync(self):
-        self.copy_all_others_to_ours()
+    def sync(self) -> int:
+        """Import every new seed of the share dir, both flat files and CRS
+        subdirectories."""
+        return self.import_files(self.scan(), settle=False)
 
-    def copy_all_others_to_ours(self):
-        """Load seeds from share_dir: both flat files and CRS subdirectories"""
+    def scan(self) -> List[Path]:
         if not self.share_dir.exists():
-            return
-        crs_name = os.environ.get("CRS_NAME", "atlantis-multilang-given_fuzzer")
-        for entry in self.share_dir.iterdir():
+            return []
+        files = []
+        for entry in os.scandir(self.share_dir):
             if entry.is_dir():
-                if entry.name == crs_name:
+                if entry.name == self.crs_name:
                     continue  # skip our own subdir
-                self._load_from(entry)
-            else:
+                files += [Path(e.path) for e in os.scandir(entry.path) if e.is_file()]
+            elif entry.is_file():
                 # Flat files from libCRS register-fetch-dir
-                self._load_file(entry)
-
-    def _load_file(self, src_seed):
-        if src_seed in self.loaded or src_seed.name.startswith(".") or src_seed.name.endswith(".cov"):
-            return
-        self.loaded.add(src_seed)
-        dst = self.our_dst_dir / src_seed.name
-        cp(src_seed, dst)
-
-    def _load_from(self, src_dir):
-        if not src_dir.exists():
-            return
-        n = 0
-        for src_seed in src_dir.iterdir():
-            if src_seed in self.loaded or src_seed.name.startswith(".") or src_seed.name.endswith(".cov"):
+                files.append(Path(entry.path))
+        return files
+
+    def source_dirs(self) -> List[Path]:
+        if not self.share_dir.exists():
+            return []
+        return [self.share_dir] + [
+            Path(entry.path)
+            for entry in os.scandir(self.share_dir)
+            if entry.is_dir() and entry.name != self.crs_name
+        ]
+
+    def is_seed(self, path: Path) -> bool:
+        if path.name.startswith(".") or path.name.endswith(".cov"):
+            return False
+        if path.parent == self.share_dir:
+            return True
+        return (
+            path.parent.parent == self.share_dir and path.parent.name != self.crs_name
+        )
+
+    def import_files(self, paths: List[Path], settle: bool = True) -> int:
+        """Import the seeds among `paths` whose content was not imported yet,
+        all of them made visible in our_dst_dir at once."""
+        now = time.time()
+        entries = []
+        known = []
+        staged: Set[str] = set()
+        for path in dict.fromkeys(paths):
+            if not self.is_seed(path):
+                continue
+            try:
+                st = path.stat()
+                if self.index.is_known(str(path), st):
+                    known.append(str(path))
+                    continue
+                if settle and now - st.st_mtime < SETTLE_TIME:
+                    continue
+                digest = file_hash(path)
+                if not self.index.has_hash(digest) and digest not in staged:
+                    link_or_copy(path, self.staging_dir / digest)
+                    staged.add(digest)
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    logging.warning(f"[SeedShare] Failed to import {path}: {e}")
+                continue
+            entries.append((str(path), st, digest))
+        for digest in staged:
+            os.replace(self.staging_dir / digest, self.our_dst_dir / digest)
+        self.index.touch(known)
+        self.index.add(entries)
+        if staged:
+            self.info(f"Imported {len(staged)} seeds")
+        return len(staged)
+
+    def run(self, interval: int) -> None:
+        """Import new seeds as they appear, and rescan everything every
+        `interval` seconds in case an event was missed."""
+        try:
+            inotify = Inotify()
+        except (OSError, AttributeError) as e:
+            self.info(f"inotify unavailable ({e}), polling every {interval}s")
+            while True:
+                self.import_files(self.scan())
+                time.sleep(interval)
+
+        watched: Set[Path] = set()
+        next_scan = 0.0
+        while True:
+            for path in self.source_dirs():
+                if path not in watched:
+                    try:
+                        inotify.add_watch(path)
+                        watched.add(path)
+                        next_scan = 0.0  # catch up on files from before the watch
+                    except OSError as e:
+                        logging.warning(f"[SeedShare] Failed to watch {path}: {e}")
+            if time.monotonic() >= next_scan:
+                self.import_files(self.scan())
+                next_scan = time.monotonic() + interval
+
+            events = inotify.read(max(0.0, next_scan - time.monotonic()))
+            if events is None:
+                next_scan = 0.0
                 continue
-            self.loaded.add(src_seed)
-            dst = self.our_dst_dir / src_seed.name
-            cp(src_seed, dst)
-            n += 1
-        if n:
-            self.info(f"Loaded {n} seeds from {src_dir}")
+            deadline = time.monotonic() + BATCH_WINDOW
+            while events and len(events) < MAX_BATCH:
+                more = inotify.read(max(0.0, deadline - time.monotonic()))
+                if not more:
+                    if more is None:
+                        next_scan = 0.0
+                    break
+                events += more
+            self.import_files(
+                [
+                    path
+                    for path, mask in events
+                    if mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO) and not mask & _IN_ISDIR
+                ],
+                settle=False,
+            )
 
 
 def main():
@@ -69,6 +304,13 @@ def main():
     parser.add_argument("--workdir", dest="workdir", required=True)
     parser.add_argument("--our-dst-dir", dest="our_dst_dir", required=True)
     parser.add_argument("--interval", type=int, required=True)
+    parser.add_argument(
+        "--max-entries",
+        dest="max_entries",
+        type=int,
+        default=DEFAULT_MAX_ENTRIES,
+        help=f"Files the dedup index remembers (default: {DEFAULT_MAX_ENTRIES})",
+    )
     args = parser.parse_args()
     logging.basicConfig(level=logging.INFO)
 
@@ -77,11 +319,9 @@ def main():
         args.harness_name,
         args.share_dir,
         args.our_dst_dir,
+        args.max_entries,
     )
-
-    while True:
-        time.sleep(args.interval)
-        share.sync()
+    share.run(args.interval)
 
 
 if __name__ == "__main__":
@@ -1,50 +1,80 @@
+import hashlib
+import mmap
 import os
-import pickle
-from typing import Dict, List, Set
+from typing import List, Optional, Set, Union
 from urllib.parse import urlparse
 
-from cfg_dataclasses import LineInfo, Node
+import numpy as np
+
+from cfg_dataclasses import LineInfo
+from coverage_map import CoverageMap, as_addr_array
 from redis import Redis
-from utils import is_running_under_pytest
 
 
 class AddrLineMapper:
-    def __init__(self, harness: str, redis_url: str) -> None:
+    def __init__(
+        self,
+        harness: str,
+        redis_url: Optional[str],
+        coverage_map_path: Optional[str] = None,
+    ) -> None:
         self.harness = harness
         self.redis_url = redis_url
+        self.coverage_map_path = coverage_map_path
         for file in [self.harness]:
             if not os.path.exists(file):
                 raise FileNotFoundError(f"{file} not found")
 
-        self.data = self.__load_data_from_redis()
+        # Identifies the loaded map, None if no map was loaded.
+        self.map_id: Optional[bytes] = None
+        if self.coverage_map_path:
+            self.data = self.__load_data_from_file()
+        else:
+            self.data = self.__load_data_from_redis()
+
+    def __load_data_from_file(self) -> Optional[CoverageMap]:
+        # Read-only shared mapping: every per-core symbolizer of the harness
+        # is served from the same page cache pages.
+        try:
+            with open(self.coverage_map_path, "rb") as f:
+                st = os.fstat(f.fileno())
+                if st.st_size == 0:
+                    return None
+                buf = mmap.mmap(f.fileno(), 0, prot=mmap.PROT_READ)
+        except FileNotFoundError:
+            return None
+        self.map_id = (
+            f"{os.path.abspath(self.coverage_map_path)}:{st.st_ino}:"
+            f"{st.st_mtime_ns}:{st.st_size}"
+        ).encode()
+        return CoverageMap(buf)
 
-    def __load_data_from_redis(self) -> Dict[int, Node]:
+    def __load_data_from_redis(self) -> Optional[CoverageMap]:
         parsed_url = urlparse(self.redis_url)
         redis_client = Redis(host=parsed_url.scheme, port=parsed_url.path)
 
         redis_key = f"{self.harness}"
         serialized_data = redis_client.get(redis_key)
         if serialized_data is None:
-            return {}
-        return pickle.loads(serialized_data)
+            return None
+        self.map_id = hashlib.sha256(serialized_data).digest()
+        return CoverageMap(serialized_data)
 
-    def translate(self, addrs: List[int]) -> Set[LineInfo]:
+    def translate(self, addrs: Union[List[int], np.ndarray]) -> Set[LineInfo]:
         line_infos: Set[LineInfo] = set()
+        if self.data is None or len(addrs) == 0:
+            return line_infos
+
+        covered_addrs = np.unique(as_addr_array(addrs))
+        node_ids = self.data.lookup(covered_addrs)
+        node_ids = np.unique(node_ids[node_ids >= 0])
+        reaches_covered = self.data.reaches_any(node_ids, covered_addrs)
 
-        for addr in addrs:
-            try:
-                node = self.data[addr]
-                line_infos.update(node.lines)
-
-                if not node.fallback and not any(
-                    addr in node.reachable_instrumented_addrs for addr in addrs
-                ):
-                    line_infos.update(
-                        node.lines_from_addrs_reachable_wo_instrumentation
-                    )
-            except Exception as e:
-                if is_running_under_pytest():
-                    raise e
-                continue
+        for node_id, reached in zip(node_ids.tolist(), reaches_covered.tolist()):
+            line_infos.update(self.data.lines(node_id))
+            if not reached and not self.data.is_fallback(node_id):
+                line_infos.update(
+                    self.data.lines_from_addrs_reachable_wo_instrumentation(node_id)
+                )
 
         return line_infos
@@ -1,21 +1,41 @@
 #!/usr/bin/env python3
 
 import argparse
+import bisect
+import heapq
+import itertools
 import logging
 import multiprocessing
 import os
-import pickle
 import re
 import subprocess
+import sys
+import tempfile
+import threading
+import time
 import traceback
 from dataclasses import dataclass
-from typing import Dict, List, Set
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from urllib.parse import urlparse
 
 from redis import Redis
 
+from cfg_cache import (
+    CFGCache,
+    FunctionRegion,
+    build_fingerprint,
+    decode_function_data,
+    encode_function_data,
+)
 from cfg_dataclasses import FunctionCFG, LineInfo, Node
+from coverage_map import CoverageMap, serialize_coverage_map
 from llvm_symbolizer import LLVMSymbolizer
+from llvm_symbolizer_pool import (
+    DEFAULT_POOL_SIZE,
+    LLVMSymbolizerPool,
+    LLVMSymbolizerPoolClient,
+    LLVMSymbolizerServer,
+)
 from utils import is_running_under_pytest
 
 # Symbols that indicate SanCov instrumentation in objdump output.
@@ -23,6 +43,111 @@ from utils import is_running_under_pytest
 SANCOV_MARKERS = ["__TMC_END__", "__sancov_cntrs", "__start___sancov_cntrs",
                   "__stop___sancov_cntrs"]
 
+# Number of objdump regions (functions) handed to a worker per task.
+REGION_CHUNK_SIZE = 64
+
+
+def iter_objdump_regions(harness: str) -> Iterator[str]:
+    """Stream `objdump -d` and yield the instrumented function regions.
+
+    Regions are the blank-line separated blocks of the disassembly. Only one
+    region is held in memory at a time, so this stays cheap on large binaries.
+    Raises CalledProcessError once the output is exhausted if objdump failed,
+    as the regions seen so far may then be incomplete.
+    """
+    cmd = ["objdump", "-d", harness]
+    process = subprocess.Popen(
+        cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True
+    )
+    assert process.stdout is not None
+    try:
+        lines: List[str] = []
+        for line in itertools.chain(process.stdout, ["\n"]):
+            if line != "\n":
+                lines.append(line.rstrip("\n"))
+                continue
+            if not lines:
+                continue
+            region = "\n".join(lines)
+            lines = []
+            if any(marker in region for marker in SANCOV_MARKERS):
+                yield region
+        process.stdout.close()
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+
+
+def chunk_regions(regions: Iterator[str], size: int) -> Iterator[List[str]]:
+    chunk: List[str] = []
+    for region in regions:
+        chunk.append(region)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _iter_bits(bits: int) -> Iterator[int]:
+    while bits:
+        low = bits & -bits
+        yield low.bit_length() - 1
+        bits ^= low
+
+
+def _strongly_connected_components(nexts: List[List[int]]) -> Tuple[List[int], int]:
+    """Iterative Tarjan. Returns the component of each node and the number of
+    components; components are numbered in reverse topological order."""
+    num_nodes = len(nexts)
+    order = [-1] * num_nodes
+    low = [0] * num_nodes
+    on_stack = [False] * num_nodes
+    components = [-1] * num_nodes
+    stack: List[int] = []
+    counter = 0
+    num_components = 0
+    for root in range(num_nodes):
+        if order[root] != -1:
+            continue
+        order[root] = low[root] = counter
+        counter += 1
+        stack.append(root)
+        on_stack[root] = True
+        work = [(root, 0)]
+        while work:
+            v, pos = work[-1]
+            if pos < len(nexts[v]):
+                work[-1] = (v, pos + 1)
+                w = nexts[v][pos]
+                if order[w] == -1:
+                    order[w] = low[w] = counter
+                    counter += 1
+                    stack.append(w)
+                    on_stack[w] = True
+                    work.append((w, 0))
+                elif on_stack[w]:
+                    low[v] = min(low[v], order[w])
+                continue
+
+            work.pop()
+            if work:
+                parent = work[-1][0]
+                low[parent] = min(low[parent], low[v])
+            if low[v] == order[v]:
+                while True:
+                    w = stack.pop()
+                    on_stack[w] = False
+                    components[w] = num_components
+                    if w == v:
+                        break
+                num_components += 1
+    return components, num_components
+
 
 @dataclass
 class IntermediateData:
@@ -34,27 +159,23 @@ class IntermediateData:
 
 class CFGWorker:
     def __init__(
-        self, harness: str, llvm_symbolizer_path: str, worker_id: int, num_workers: int
+        self,
+        harness: str,
+        llvm_symbolizer_path: str,
+        cache_dir: Optional[str] = None,
+        pool_socket: Optional[str] = None,
     ) -> None:
         self.harness = harness
         self.llvm_symbolizer_path = llvm_symbolizer_path
-        self.worker_id = worker_id
-        self.num_workers = num_workers
-
-    def __run_objdump(self) -> List[FunctionCFG]:
-        cmd = ["objdump", "-d", self.harness]
-        process = subprocess.Popen(
-            cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        output, _ = process.communicate()
-        regions = output.split("\n\n")
-        regions = regions[self.worker_id :: self.num_workers]
+        # Socket of an LLVMSymbolizerServer shared with the other workers.
+        self.pool_socket = pool_socket
+        self.llvm_symbolizer: Optional[LLVMSymbolizer] = None
+        self.cfg_cache = CFGCache(cache_dir) if cache_dir else None
 
+    def __parse_regions(self, regions: List[str]) -> List[FunctionCFG]:
         data: List[FunctionCFG] = []
 
         for region in regions:
-            if not any(marker in region for marker in SANCOV_MARKERS):
-                continue
             lines = region.split("\n")
             match = re.search(r"<(.*?)>", lines[0])
             if not match:
@@ -238,21 +359,47 @@ class CFGWorker:
             function_cfg.head.prevs == set()
         ), f"{hex(function_cfg.head.addr)} has prevs: {[hex(addr) for addr in function_cfg.head.prevs]}"
 
+    def __symbolize(self, addrs: List[int]) -> List[Optional[LineInfo]]:
+        if self.llvm_symbolizer is None:
+            pool = (
+                LLVMSymbolizerPoolClient(self.pool_socket)
+                if self.pool_socket
+                else None
+            )
+            self.llvm_symbolizer = LLVMSymbolizer(
+                self.harness, self.llvm_symbolizer_path, pool
+            )
+        return [
+            (
+                LineInfo(result.function_name, result.src_file, result.line_number)
+                if not result.error
+                else None
+            )
+            for result in self.llvm_symbolizer.run_llvm_symbolizer_addrs_pipelined(
+                addrs
+            )
+        ]
+
     def __add_line_nums_to_function_by_instruction(
         self,
         function_cfg_list: List[FunctionCFG],
+        lines: Optional[Dict[int, Optional[LineInfo]]] = None,
     ) -> None:
-        llvm_symbolier = LLVMSymbolizer(self.harness, self.llvm_symbolizer_path)
+        basic_blocks: List[Node] = []
+        addrs: List[int] = []
         for function_cfg in function_cfg_list:
             for _, basic_block in function_cfg.nodes.items():
                 for addr in basic_block.addrs:
-                    result = llvm_symbolier.run_llvm_symbolizer_addr(addr)
-                    if result.error:
-                        continue
-                    line_num = result.line_number
-                    basic_block.lines.add(
-                        LineInfo(result.function_name, result.src_file, line_num)
-                    )
+                    basic_blocks.append(basic_block)
+                    addrs.append(addr)
+
+        if lines is None:
+            results = self.__symbolize(addrs)
+        else:
+            results = [lines.get(addr) for addr in addrs]
+        for basic_block, line_info in zip(basic_blocks, results):
+            if line_info is not None:
+                basic_block.lines.add(line_info)
 
     def __create_fallback_data(self, cfg: List[FunctionCFG]) -> Dict[int, Node]:
         data: Dict[int, Node] = {}
@@ -279,103 +426,124 @@ class CFGWorker:
                 node.prevs.remove(addr)
 
     def __simplify_cfg(self, function_cfg: FunctionCFG) -> None:
+        # Each pass keeps a min-heap of candidate nodes ordered by address, so
+        # popping the first node a pass applies to picks the same merge as a
+        # scan of `function_cfg.nodes` from the start would. After a merge only
+        # the touched nodes and their predecessors are re-queued.
+        nodes = function_cfg.nodes
+        simplify_passes = [
+            self.__delete_single_entry_node,
+            self.__delete_one_to_one_nodes,
+            self.__delete_uninstrumented_nodes_nexts_instrumented,
+        ]
+        heaps = [sorted(nodes) for _ in simplify_passes]
+        queued = [set(nodes) for _ in simplify_passes]
         while True:
             modified = False
-            if self.__delete_single_entry_node(function_cfg):
-                modified = True
-                self.__remove_self_loop_in_function_cfg(function_cfg)
-                if is_running_under_pytest():
-                    self.__verify_function_cfg(function_cfg)
-            if self.__delete_one_to_one_nodes(function_cfg):
-                modified = True
-                self.__remove_self_loop_in_function_cfg(function_cfg)
-                if is_running_under_pytest():
-                    self.__verify_function_cfg(function_cfg)
-            if self.__delete_uninstrumented_nodes_nexts_instrumented(function_cfg):
-                modified = True
-                self.__remove_self_loop_in_function_cfg(function_cfg)
-                if is_running_under_pytest():
-                    self.__verify_function_cfg(function_cfg)
+            for simplify_pass, heap, in_heap in zip(simplify_passes, heaps, queued):
+                while heap:
+                    addr = heapq.heappop(heap)
+                    in_heap.discard(addr)
+                    node = nodes.get(addr)
+                    if node is None:
+                        continue
+                    touched = simplify_pass(function_cfg, node)
+                    if touched is None:
+                        continue
+                    modified = True
+                    self.__requeue(function_cfg, touched, heaps, queued)
+                    if is_running_under_pytest():
+                        self.__verify_function_cfg(function_cfg)
+                    break
 
             if not modified:
                 break
 
-    def __delete_single_entry_node(self, function_cfg: FunctionCFG) -> bool:
-        for addr, node in function_cfg.nodes.items():
-            for next_addr in node.nexts:
-                next_block = function_cfg.nodes[next_addr]
-                if len(next_block.prevs) == 1 and all(
-                    next_addr != tail.addr for tail in function_cfg.tail
-                ):
-                    if next_block.lines.issubset(node.lines):
-                        # if is_running_under_pytest():
-                        #     print(
-                        #         f"__delete_single_entry_node {function_cfg.name}: delete {hex(next_addr)}, keep {hex(addr)}, head {hex(function_cfg.head.addr)}, tail {[hex(tail.addr) for tail in function_cfg.tail]}"
-                        #     )
-                        self.__merge_nodes(function_cfg, addr, next_addr, True)
-                        return True
-        return False
-
-    def __delete_one_to_one_nodes(self, function_cfg: FunctionCFG) -> bool:
-        for addr, node in function_cfg.nodes.items():
-            if len(node.nexts) != 1:
-                continue
-            next_addr = next(iter(node.nexts))
+    def __requeue(
+        self,
+        function_cfg: FunctionCFG,
+        touched: Set[int],
+        heaps: List[List[int]],
+        queued: List[Set[int]],
+    ) -> None:
+        nodes = function_cfg.nodes
+        touched_nodes = [nodes[addr] for addr in touched if addr in nodes]
+        for node in touched_nodes:
+            node.nexts.discard(node.addr)
+            node.prevs.discard(node.addr)
+        # A pass applies to a node depending on the node itself and on its
+        # successors, so a change to a node may enable its predecessors.
+        for node in touched_nodes:
+            for addr in itertools.chain((node.addr,), node.prevs):
+                for heap, in_heap in zip(heaps, queued):
+                    if addr not in in_heap:
+                        in_heap.add(addr)
+                        heapq.heappush(heap, addr)
+
+    def __neighbourhood(self, function_cfg: FunctionCFG, addr: int) -> Set[int]:
+        node = function_cfg.nodes[addr]
+        return {addr} | node.prevs | node.nexts
+
+    def __delete_single_entry_node(
+        self, function_cfg: FunctionCFG, node: Node
+    ) -> Optional[Set[int]]:
+        addr = node.addr
+        for next_addr in node.nexts:
             next_block = function_cfg.nodes[next_addr]
-            if len(next_block.prevs) != 1:
-                continue
-            # if is_running_under_pytest():
-            #     delete_addr = next_addr if node.instrumented_addrs else addr
-            #     keep_addr = addr if node.instrumented_addrs else next_addr
-            #     print(
-            #         f"__delete_one_to_one_nodes {function_cfg.name}: delete {hex(delete_addr)}, keep {hex(keep_addr)}, head {hex(function_cfg.head.addr)}, tail {[hex(tail.addr) for tail in function_cfg.tail]}"
-            #     )
-            self.__merge_nodes(
-                function_cfg,
-                addr,
-                next_addr,
-                True if node.instrumented_addrs else False,
-            )
-            return True
-        return False
+            if len(next_block.prevs) == 1 and all(
+                next_addr != tail.addr for tail in function_cfg.tail
+            ):
+                if next_block.lines.issubset(node.lines):
+                    self.__merge_nodes(function_cfg, addr, next_addr, True)
+                    return self.__neighbourhood(function_cfg, addr)
+        return None
+
+    def __delete_one_to_one_nodes(
+        self, function_cfg: FunctionCFG, node: Node
+    ) -> Optional[Set[int]]:
+        addr = node.addr
+        if len(node.nexts) != 1:
+            return None
+        next_addr = next(iter(node.nexts))
+        next_block = function_cfg.nodes[next_addr]
+        if len(next_block.prevs) != 1:
+            return None
+        merge_to_prev = True if node.instrumented_addrs else False
+        self.__merge_nodes(function_cfg, addr, next_addr, merge_to_prev)
+        return self.__neighbourhood(
+            function_cfg, addr if merge_to_prev else next_addr
+        )
 
     def __delete_uninstrumented_nodes_nexts_instrumented(
-        self, function_cfg: FunctionCFG
-    ) -> bool:
-        for addr, node in function_cfg.nodes.items():
-            if addr == function_cfg.head.addr:
-                continue
-            if node.instrumented_addrs or len(node.nexts) == 0:
-                continue
-            nexts_all_instrumented = True
-            for next_addr in node.nexts:
-                next_block = function_cfg.nodes[next_addr]
-                if not next_block.instrumented_addrs:
-                    nexts_all_instrumented = False
-                    break
-            if not nexts_all_instrumented:
-                continue
-
-            # if is_running_under_pytest():
-            #     print(
-            #         f"__delete_one_to_one_nodes {function_cfg.name}: delete {addr}, keep {[hex(addr) for addr in node.nexts]}, head {hex(function_cfg.head.addr)}, tail {[hex(tail.addr) for tail in function_cfg.tail]}"
-            #     )
+        self, function_cfg: FunctionCFG, node: Node
+    ) -> Optional[Set[int]]:
+        addr = node.addr
+        if addr == function_cfg.head.addr:
+            return None
+        if node.instrumented_addrs or len(node.nexts) == 0:
+            return None
+        for next_addr in node.nexts:
+            next_block = function_cfg.nodes[next_addr]
+            if not next_block.instrumented_addrs:
+                return None
 
-            function_cfg.nodes.pop(addr)
+        function_cfg.nodes.pop(addr)
 
-            for next_addr in node.nexts:
-                next_block = function_cfg.nodes[next_addr]
-                next_block.prevs.remove(addr)
-                next_block.addrs.update(node.addrs)
-                next_block.prevs.update(node.prevs)
-                next_block.lines.update(node.lines)
+        for next_addr in node.nexts:
+            next_block = function_cfg.nodes[next_addr]
+            next_block.prevs.remove(addr)
+            next_block.addrs.update(node.addrs)
+            next_block.prevs.update(node.prevs)
+            next_block.lines.update(node.lines)
 
-            for prev_addr in node.prevs:
-                function_cfg.nodes[prev_addr].nexts.remove(addr)
-                function_cfg.nodes[prev_addr].nexts.update(node.nexts)
+        for prev_addr in node.prevs:
+            function_cfg.nodes[prev_addr].nexts.remove(addr)
+            function_cfg.nodes[prev_addr].nexts.update(node.nexts)
 
-            return True
-        return False
+        touched = set(node.prevs)
+        for next_addr in node.nexts:
+            touched.update(self.__neighbourhood(function_cfg, next_addr))
+        return touched
 
     def __merge_nodes(
         self,
@@ -420,71 +588,75 @@ class CFGWorker:
             function_cfg.tail.remove(node_to_delete)
             function_cfg.tail.add(node_to_keep)
 
-    def __reverse_traverse_cfg(self, function_cfg: FunctionCFG):
-        for tail in function_cfg.tail:
-            self.__reverse_traverse_cfg_helper(function_cfg, tail)
+    def __reverse_traverse_cfg(
+        self, tails: List[int], prevs: List[List[int]], instrumented: int
+    ) -> List[int]:
+        """Walk backwards from every tail through uninstrumented nodes. An
+        instrumented node reached this way gets the nodes visited so far from
+        that tail, as a bitset over node indices.
+        """
+        reachable_wo_instrumentation = [0] * len(prevs)
+        for tail in tails:
+            visited = 0
+            stack = [iter((tail,))]
+            while stack:
+                i = next(stack[-1], None)
+                if i is None:
+                    stack.pop()
+                    continue
+                bit = 1 << i
+                if visited & bit:
+                    continue
+                if instrumented & bit:
+                    reachable_wo_instrumentation[i] |= visited
+                    continue
+                visited |= bit
+                stack.append(iter(prevs[i]))
+        return reachable_wo_instrumentation
+
+    def __traverse_cfg(
+        self, nexts: List[List[int]], instrumented: int
+    ) -> List[int]:
+        """Bitset of the instrumented nodes reachable from each node, computed
+        for all nodes at once over the condensation of the CFG."""
+        components, num_components = _strongly_connected_components(nexts)
+        component_reachable = [0] * num_components
+        component_nodes: List[List[int]] = [[] for _ in range(num_components)]
+        for i, component in enumerate(components):
+            component_nodes[component].append(i)
+            component_reachable[component] |= instrumented & (1 << i)
+        # Components are numbered in reverse topological order, so every
+        # successor component is final by the time it is read.
+        for component in range(num_components):
+            reachable = component_reachable[component]
+            for i in component_nodes[component]:
+                for j in nexts[i]:
+                    reachable |= component_reachable[components[j]]
+            component_reachable[component] = reachable
+        return [component_reachable[component] for component in components]
+
+    def __traverse_function_cfg(self, function_cfg: FunctionCFG) -> None:
+        addrs = list(function_cfg.nodes)
+        index = {addr: i for i, addr in enumerate(addrs)}
+        nodes = list(function_cfg.nodes.values())
+        nexts = [[index[addr] for addr in node.nexts] for node in nodes]
+        prevs = [[index[addr] for addr in node.prevs] for node in nodes]
+        instrumented = 0
+        for i, node in enumerate(nodes):
+            if node.instrumented_addrs:
+                instrumented |= 1 << i
 
-    def __reverse_traverse_cfg_helper(self, function_cfg: FunctionCFG, tail: Node):
-        self.__reverse_traverse_cfg_helper_impl(
-            function_cfg,
-            tail,
-            set(),
+        reachable_wo_instrumentation = self.__reverse_traverse_cfg(
+            [index[tail.addr] for tail in function_cfg.tail], prevs, instrumented
         )
-
-    def __reverse_traverse_cfg_helper_impl(
-        self,
-        function_cfg: FunctionCFG,
-        current_node: Node,
-        visited_nodes: Set[int],
-    ):
-        if current_node.addr in visited_nodes:
-            return
-
-        if current_node.instrumented_addrs:
-            current_node.addrs_reachable_without_any_instrumentation.update(
-                visited_nodes
+        reachable = self.__traverse_cfg(nexts, instrumented)
+        for i in _iter_bits(instrumented):
+            node = nodes[i]
+            node.addrs_reachable_without_any_instrumentation.update(
+                addrs[j] for j in _iter_bits(reachable_wo_instrumentation[i])
             )
-            return
-
-        visited_nodes.add(current_node.addr)
-        for prev_addr in current_node.prevs:
-            prev_node = function_cfg.nodes[prev_addr]
-            self.__reverse_traverse_cfg_helper_impl(
-                function_cfg, prev_node, visited_nodes
-            )
-
-    def __traverse_cfg(self, function_cfg: FunctionCFG):
-        for _, node in function_cfg.nodes.items():
-            if node.instrumented_addrs:
-                self.__traverse_cfg_helper(function_cfg, node)
-
-    def __traverse_cfg_helper(self, function_cfg: FunctionCFG, instrumented_node: Node):
-        instrumented_visited: Set[int] = set()
-        self.__traverse_cfg_helper_impl(
-            function_cfg,
-            instrumented_node,
-            set(),
-            instrumented_visited,
-        )
-        instrumented_visited.remove(instrumented_node.addr)
-        instrumented_node.reachable_instrumented_addrs.update(instrumented_visited)
-
-    def __traverse_cfg_helper_impl(
-        self,
-        function_cfg: FunctionCFG,
-        current_node: Node,
-        visited_nodes: Set[int],
-        instrumented_visited: Set[int],
-    ):
-        if current_node.addr in visited_nodes:
-            return
-        if current_node.instrumented_addrs:
-            instrumented_visited.add(current_node.addr)
-        visited_nodes.add(current_node.addr)
-        for next_addr in current_node.nexts:
-            next_node = function_cfg.nodes[next_addr]
-            self.__traverse_cfg_helper_impl(
-                function_cfg, next_node, visited_nodes, instrumented_visited
+            node.reachable_instrumented_addrs.update(
+                addrs[j] for j in _iter_bits(reachable[i] & ~(1 << i))
             )
 
     def __create_data(
@@ -506,19 +678,18 @@ class CFGWorker:
             data[addr] = fallback_data[addr]
         return data
 
-    def create_data(self) -> Dict[int, Node]:
-        cfg = self.__run_objdump()
+    def create_data(
+        self,
+        regions: List[str],
+        lines: Optional[Dict[int, Optional[LineInfo]]] = None,
+    ) -> Dict[int, Node]:
+        cfg = self.__parse_regions(regions)
         if not cfg:
-            logging.warning(
-                f"[cfg_analyzer] Worker {self.worker_id}: objdump produced no "
-                f"instrumented functions for {self.harness} "
-                f"(markers: {SANCOV_MARKERS})"
-            )
             return {}
         if is_running_under_pytest():
             self.__verify_cfg(cfg)
 
-        self.__add_line_nums_to_function_by_instruction(cfg)
+        self.__add_line_nums_to_function_by_instruction(cfg, lines)
 
         fallback_data = self.__create_fallback_data(cfg)
         fallback_node_addrs: Set[int] = set()
@@ -537,25 +708,17 @@ class CFGWorker:
             try:
                 self.__simplify_cfg(function_cfg)
 
-                if len(function_cfg.nodes) > 1000:
-                    raise Exception(
-                        f"Too many nodes in {function_cfg.name}: {len(function_cfg.nodes)}"
-                    )
+                if is_running_under_pytest():
+                    self.__verify_function_cfg(function_cfg)
+
+                self.__traverse_function_cfg(function_cfg)
             except Exception as e:
                 fallback_node_addrs.update(instrumented_addrs)
                 simplify_failed_functions.add(function_cfg.name)
                 if is_running_under_pytest():
                     print(f"Failed to simplify {function_cfg.name}")
                     raise e
-
-        if is_running_under_pytest():
-            self.__verify_cfg(cfg)
-
-        for function_cfg in cfg:
-            if function_cfg.name in simplify_failed_functions:
                 continue
-            self.__reverse_traverse_cfg(function_cfg)
-            self.__traverse_cfg(function_cfg)
 
             for _, node in function_cfg.nodes.items():
                 if not node.instrumented_addrs:
@@ -569,34 +732,205 @@ class CFGWorker:
             cfg, fallback_data, fallback_node_addrs, simplify_failed_functions
         )
 
+    def create_cached_data(
+        self, regions: List[str]
+    ) -> Tuple[Dict[int, Node], List[Tuple[str, bytes]]]:
+        """Like `create_data`, but reuses cached results of unchanged functions.
+
+        Returns the data and the cache entries of the freshly analyzed ones.
+        """
+        assert self.cfg_cache is not None
+        functions = [FunctionRegion.parse(region) for region in regions]
+        addrs = [
+            addr
+            for function in functions
+            if function is not None
+            for addr, _ in function.instructions
+        ]
+        lines = dict(zip(addrs, self.__symbolize(addrs)))
+        keys = [
+            function.key(lines) if function is not None else None
+            for function in functions
+        ]
+        cached = self.cfg_cache.get_functions([key for key in keys if key])
+
+        data: Dict[int, Node] = {}
+        missed: List[Tuple[str, FunctionRegion]] = []
+        missed_regions: List[str] = []
+        for region, function, key in zip(regions, functions, keys):
+            if key is not None and key in cached:
+                data.update(decode_function_data(cached[key], function.start))
+                continue
+            missed_regions.append(region)
+            if key is not None:
+                missed.append((key, function))
+        if not missed_regions:
+            return data, []
+
+        new_data = self.create_data(missed_regions, lines)
+        data.update(new_data)
+
+        missed.sort(key=lambda entry: entry[1].start)
+        starts = [function.start for _, function in missed]
+        function_data: List[Dict[int, Node]] = [{} for _ in missed]
+        for addr, node in new_data.items():
+            idx = bisect.bisect_right(starts, addr) - 1
+            if idx >= 0 and addr < missed[idx][1].end:
+                function_data[idx][addr] = node
+        entries = [
+            (key, encode_function_data(function_data[idx], function.start))
+            for idx, (key, function) in enumerate(missed)
+        ]
+        return data, entries
+
+
+_cfg_worker: Optional[CFGWorker] = None
+
+
+def _init_cfg_worker(
+    harness: str,
+    llvm_symbolizer_path: str,
+    cache_dir: Optional[str],
+    pool_socket: str,
+) -> None:
+    global _cfg_worker
+    _cfg_worker = CFGWorker(harness, llvm_symbolizer_path, cache_dir, pool_socket)
+
+
+def _create_cfg_data(
+    regions: List[str],
+) -> Tuple[Dict[int, Node], List[Tuple[str, bytes]]]:
+    assert _cfg_worker is not None
+    if _cfg_worker.cfg_cache is None:
+        return _cfg_worker.create_data(regions), []
+    return _cfg_worker.create_cached_data(regions)
+
 
 class CFGAnalyzer:
     def __init__(
-        self, harness: str, llvm_symbolizer_path: str, redis_url: str, ncpu: int
+        self,
+        harness: str,
+        llvm_symbolizer_path: str,
+        redis_url: Optional[str],
+        ncpu: int,
+        cache_dir: Optional[str] = None,
+        num_symbolizers: int = DEFAULT_POOL_SIZE,
     ) -> None:
         self.harness = harness
         self.llvm_symbolizer_path = llvm_symbolizer_path
         self.redis_url = redis_url
         self.ncpu = ncpu
+        self.num_symbolizers = max(1, min(num_symbolizers, ncpu))
+        self.cache_dir = cache_dir
+        self.cfg_cache = CFGCache(cache_dir) if cache_dir else None
+        self.data: Dict[int, Node] = {}
+        # Serialized coverage map; only set when the result is cached.
+        self.coverage_map: Optional[bytes] = None
+        # Whether every function was analyzed; otherwise the map is partial.
+        self.completed = True
+
+        fingerprint = None
+        # Maps are cached per symbolization backend; llvm-symbolizer is the
+        # only one.
+        backend = "llvm_symbolizer"
+        if self.cfg_cache is not None:
+            fingerprint = build_fingerprint(self.harness)
+            self.coverage_map = self.cfg_cache.load_binary(fingerprint, backend)
+            if self.coverage_map is not None:
+                logging.info(
+                    f"[cfg_analyzer] Reusing cached coverage map for "
+                    f"{self.harness} ({fingerprint}, {backend})"
+                )
+                return
 
-        self.__create_data_in_parallel()
+        self.completed = self.__create_data_in_parallel()
+        if self.cfg_cache is not None and self.completed:
+            self.coverage_map = serialize_coverage_map(self.data)
+            self.cfg_cache.store_binary(fingerprint, backend, self.coverage_map)
 
-    def __create_data_in_parallel(self) -> None:
-        self.data: Dict[int, Node] = {}
+    def __create_data_in_parallel(self) -> bool:
+        cache_entries: List[Tuple[str, bytes]] = []
         try:
-            workers = [
-                CFGWorker(self.harness, self.llvm_symbolizer_path, i, self.ncpu)
-                for i in range(self.ncpu)
-            ]
-            with multiprocessing.Pool(self.ncpu) as pool:
-                result = pool.map_async(CFGWorker.create_data, workers)
-                data = result.get(timeout=900)  # timeout in seconds
-
-            for d in data:
-                self.data.update(d)
+            # A single objdump is streamed here and its regions are sharded
+            # over the pool, so no worker ever holds the whole disassembly.
+            deadline = time.monotonic() + 900  # timeout in seconds
+            num_chunks = 0
+            # The workers share num_symbolizers llvm-symbolizer processes, so
+            # the debug info is not loaded once per worker.
+            tmp_dir = tempfile.TemporaryDirectory()
+            pool_socket = os.path.join(tmp_dir.name, "llvm_symbolizer.sock")
+            server: Optional[LLVMSymbolizerServer] = None
+            try:
+                with multiprocessing.Pool(
+                    self.ncpu,
+                    initializer=_init_cfg_worker,
+                    initargs=(
+                        self.harness,
+                        self.llvm_symbolizer_path,
+                        self.cache_dir,
+                        pool_socket,
+                    ),
+                ) as pool:
+                    # Started once the workers are forked, so that they do not
+                    # inherit locks held by its threads.
+                    server = LLVMSymbolizerServer(
+                        pool_socket,
+                        LLVMSymbolizerPool(
+                            self.harness,
+                            self.llvm_symbolizer_path,
+                            self.num_symbolizers,
+                        ),
+                    )
+                    threading.Thread(target=server.serve_forever, daemon=True).start()
+                    chunks = chunk_regions(
+                        iter_objdump_regions(self.harness), REGION_CHUNK_SIZE
+                    )
+                    results = pool.imap_unordered(_create_cfg_data, chunks)
+                    while True:
+                        try:
+                            d, entries = results.next(
+                                timeout=deadline - time.monotonic()
+                            )
+                        except StopIteration:
+                            break
+                        self.data.update(d)
+                        cache_entries.extend(entries)
+                        num_chunks += 1
+            finally:
+                if server is not None:
+                    server.shutdown()
+                    server.server_close()
+                tmp_dir.cleanup()
+
+            if num_chunks == 0:
+                logging.warning(
+                    f"[cfg_analyzer] objdump produced no instrumented functions "
+                    f"for {self.harness} (markers: {SANCOV_MARKERS})"
+                )
+                return False
+            return True
         except Exception as e:
             logging.error(f"[cfg_analyzer] Failed to create data for {self.harness}: {e}")
             logging.error(traceback.format_exc())
+            return False
+        finally:
+            if self.cfg_cache is not None and cache_entries:
+                logging.info(
+                    f"[cfg_analyzer] Caching {len(cache_entries)} analyzed functions"
+                )
+                self.cfg_cache.put_functions(cache_entries)
+
+    def __serialize(self) -> bytes:
+        if self.coverage_map is not None:
+            serialized_data = self.coverage_map
+        else:
+            serialized_data = serialize_coverage_map(self.data)
+        if len(CoverageMap(serialized_data)) == 0:
+            logging.warning(
+                f"[cfg_analyzer] WARNING: Storing EMPTY data for {self.harness}. "
+                "Coverage symbolization will produce empty results."
+            )
+        return serialized_data
 
     def save_to_redis(self) -> None:
         parsed_url = urlparse(self.redis_url)
@@ -604,16 +938,20 @@ class CFGAnalyzer:
 
         redis_key = f"{self.harness}"
         logging.info(
-            f"[cfg_analyzer] Storing {len(self.data)} entries in Redis "
+            f"[cfg_analyzer] Storing coverage map in Redis "
             f"(key={redis_key}, host={parsed_url.scheme}, port={parsed_url.path})"
         )
-        if not self.data:
-            logging.warning(
-                f"[cfg_analyzer] WARNING: Storing EMPTY data for {self.harness}. "
-                "Coverage symbolization will produce empty results."
-            )
-        serialized_data = pickle.dumps(self.data)
-        redis_client.set(redis_key, serialized_data)
+        redis_client.set(redis_key, self.__serialize())
+
+    def save_to_file(self, coverage_map_path: str) -> None:
+        logging.info(f"[cfg_analyzer] Storing coverage map in {coverage_map_path}")
+        serialized_data = self.__serialize()
+        # Readers mmap this file, so it is replaced atomically rather than
+        # rewritten in place.
+        tmp_path = f"{coverage_map_path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(serialized_data)
+        os.replace(tmp_path, coverage_map_path)
 
 
 if __name__ == "__main__":
@@ -624,8 +962,12 @@ if __name__ == "__main__":
     parser.add_argument(
         "--harness", type=str, required=True, help="Harness (must have)"
     )
-    parser.add_argument(
-        "--redis_url", type=str, required=True, help="Redis URL (must have)"
+    storage = parser.add_mutually_exclusive_group(required=True)
+    storage.add_argument("--redis_url", type=str, help="Redis URL")
+    storage.add_argument(
+        "--coverage_map",
+        type=str,
+        help="File to write the coverage map to instead of Redis",
     )
     parser.add_argument(
         "--ncpu", type=int, required=True, help="Number of cores to use (must have)"
@@ -635,14 +977,41 @@ if __name__ == "__main__":
         default="/out/llvm-symbolizer",
         help="Path to the symbolizer (default: /out/llvm-symbolizer)",
     )
+    parser.add_argument(
+        "--cache_dir",
+        default=None,
+        help="Directory to reuse CFG analysis results from, keyed by the "
+        "harness build and by function (default: no cache)",
+    )
+    parser.add_argument(
+        "--llvm_symbolizers",
+        type=int,
+        default=DEFAULT_POOL_SIZE,
+        help="Number of llvm-symbolizer processes shared by the workers, at "
+        f"most ncpu (default: {DEFAULT_POOL_SIZE})",
+    )
 
     args = parser.parse_args()
     logging.info(
         f"[cfg_analyzer] harness={args.harness} "
         f"llvm_symbolizer={args.llvm_symbolizer} "
-        f"redis_url={args.redis_url} ncpu={args.ncpu}"
+        f"redis_url={args.redis_url} coverage_map={args.coverage_map} "
+        f"ncpu={args.ncpu} "
+        f"cache_dir={args.cache_dir} "
+        f"llvm_symbolizers={args.llvm_symbolizers}"
     )
     cfg_analyzer = CFGAnalyzer(
-        args.harness, args.llvm_symbolizer, args.redis_url, args.ncpu
+        args.harness,
+        args.llvm_symbolizer,
+        args.redis_url,
+        args.ncpu,
+        args.cache_dir,
+        args.llvm_symbolizers,
     )
-    cfg_analyzer.save_to_redis()
+    # A partial map is still stored, but the failure is reported so that the
+    # fuzzer can tell the symbolizers.
+    if args.coverage_map:
+        cfg_analyzer.save_to_file(args.coverage_map)
+    else:
+        cfg_analyzer.save_to_redis()
+    sys.exit(0 if cfg_analyzer.completed else 1)
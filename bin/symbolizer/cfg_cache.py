@@ -0,0 +1,216 @@
+import hashlib
+import logging
+import os
+import pickle
+import re
+import sqlite3
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from elftools.elf.elffile import ELFFile
+from elftools.elf.sections import NoteSection
+
+from cfg_dataclasses import LineInfo, Node
+from utils import is_running_under_pytest
+
+# Bump whenever the CFG analysis changes its output for the same input, so
+# stale results are never reused.
+CFG_CACHE_VERSION = 3
+
+_RIP_DISPLACEMENT = re.compile(r"-?0x[0-9a-f]+\(%rip\)")
+_ADDR_WITH_SYMBOL = re.compile(r"\b[0-9a-f]+ <([^>]*?)(\+0x[0-9a-f]+)?>")
+_SQLITE_MAX_PARAMS = 500
+
+
+def build_fingerprint(harness: str) -> str:
+    """ELF build-id of the harness, or a hash of its contents without one."""
+    try:
+        with open(harness, "rb") as f:
+            for section in ELFFile(f).iter_sections():
+                if not isinstance(section, NoteSection):
+                    continue
+                for note in section.iter_notes():
+                    if note["n_type"] == "NT_GNU_BUILD_ID":
+                        return f"v{CFG_CACHE_VERSION}-build-id-{note['n_desc']}"
+    except Exception as e:
+        if is_running_under_pytest():
+            raise e
+
+    digest = hashlib.sha256()
+    with open(harness, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return f"v{CFG_CACHE_VERSION}-sha256-{digest.hexdigest()}"
+
+
+@dataclass
+class FunctionRegion:
+    name: str
+    start: int
+    end: int
+    instructions: List[Tuple[int, str]]
+
+    @staticmethod
+    def parse(region: str) -> Optional["FunctionRegion"]:
+        lines = region.split("\n")
+        match = re.match(r"\s*([0-9a-f]+) <(.*?)>", lines[0])
+        if not match:
+            return None
+        instructions = []
+        for line in lines[1:]:
+            if line.count("\t") != 2:
+                continue
+            addr = int(line.split("\t")[0].strip()[:-1], 16)
+            instructions.append((addr, line.split("\t")[2].strip()))
+        start = int(match.group(1), 16)
+        end = instructions[-1][0] + 1 if instructions else start
+        return FunctionRegion(match.group(2), start, end, instructions)
+
+    def __normalize(self, instruction: str) -> str:
+        # Drop everything that only reflects where the function was linked:
+        # RIP-relative displacements and absolute addresses of other symbols.
+        # Targets inside the function stay as `<name+offset>`.
+        instruction = _RIP_DISPLACEMENT.sub("(%rip)", instruction)
+
+        def replace(match: re.Match) -> str:
+            if match.group(1) == self.name:
+                return f"<{self.name}{match.group(2) or ''}>"
+            return f"<{match.group(1)}>"
+
+        return _ADDR_WITH_SYMBOL.sub(replace, instruction)
+
+    def key(self, lines: Dict[int, Optional[LineInfo]]) -> str:
+        """Position-independent hash of everything the analysis reads: the
+        function's instructions and the source line of each of them."""
+        digest = hashlib.sha256(f"{CFG_CACHE_VERSION}\0{self.name}\0".encode())
+        for addr, instruction in self.instructions:
+            line = lines.get(addr)
+            line_key = (
+                (line.function_name, line.src_file, line.line_number)
+                if line is not None
+                else None
+            )
+            digest.update(
+                f"{addr - self.start}\t{self.__normalize(instruction)}\t"
+                f"{line_key}\n".encode("utf-8", "surrogateescape")
+            )
+        return digest.hexdigest()
+
+
+def encode_function_data(data: Dict[int, Node], start: int) -> bytes:
+    """Serialize the entries of one function relative to its start address."""
+    nodes: Dict[int, Tuple[Node, List[int]]] = {}
+    for addr, node in data.items():
+        nodes.setdefault(id(node), (node, []))[1].append(addr - start)
+    return pickle.dumps(
+        [
+            (
+                node.addr - start,
+                addrs,
+                [(l.function_name, l.src_file, l.line_number) for l in node.lines],
+                [addr - start for addr in node.reachable_instrumented_addrs],
+                [
+                    (l.function_name, l.src_file, l.line_number)
+                    for l in node.lines_from_addrs_reachable_wo_instrumentation
+                ],
+                node.fallback,
+            )
+            for node, addrs in nodes.values()
+        ]
+    )
+
+
+def decode_function_data(blob: bytes, start: int) -> Dict[int, Node]:
+    data: Dict[int, Node] = {}
+    for node_addr, addrs, lines, reachable, lines_wo, fallback in pickle.loads(blob):
+        node = Node(
+            addr=start + node_addr,
+            addrs=set(),
+            prevs=set(),
+            nexts=set(),
+            instrumented_addrs={start + addr for addr in addrs},
+            lines={LineInfo(*line) for line in lines},
+            reachable_instrumented_addrs={start + addr for addr in reachable},
+            addrs_reachable_without_any_instrumentation=set(),
+            lines_from_addrs_reachable_wo_instrumentation={
+                LineInfo(*line) for line in lines_wo
+            },
+            fallback=fallback,
+        )
+        for addr in addrs:
+            data[start + addr] = node
+    return data
+
+
+class CFGCache:
+    """Content-addressed store of CFG analysis results.
+
+    `<cache_dir>/<fingerprint>.<backend>.map` holds the finished coverage map
+    of a harness build made with a symbolization backend.
+    `<cache_dir>/functions.db` holds per-function results keyed
+    by `FunctionRegion.key`, so a rebuilt harness only re-analyzes the
+    functions that changed.
+    """
+
+    def __init__(self, cache_dir: str) -> None:
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.db_path = os.path.join(self.cache_dir, "functions.db")
+        self.__db: Optional[sqlite3.Connection] = None
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__db is None:
+            self.__db = sqlite3.connect(self.db_path, timeout=60)
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS functions "
+                "(key TEXT PRIMARY KEY, data BLOB NOT NULL)"
+            )
+        return self.__db
+
+    def __binary_path(self, fingerprint: str, backend: str) -> str:
+        return os.path.join(self.cache_dir, f"{fingerprint}.{backend}.map")
+
+    def load_binary(self, fingerprint: str, backend: str) -> Optional[bytes]:
+        try:
+            with open(self.__binary_path(fingerprint, backend), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def store_binary(self, fingerprint: str, backend: str, coverage_map: bytes) -> None:
+        path = self.__binary_path(fingerprint, backend)
+        tmp_path = f"{path}.tmp.{os.getpid()}"
+        with open(tmp_path, "wb") as f:
+            f.write(coverage_map)
+        os.replace(tmp_path, path)
+
+    def get_functions(self, keys: List[str]) -> Dict[str, bytes]:
+        found: Dict[str, bytes] = {}
+        try:
+            db = self.__connect()
+            for i in range(0, len(keys), _SQLITE_MAX_PARAMS):
+                batch = keys[i : i + _SQLITE_MAX_PARAMS]
+                rows = db.execute(
+                    "SELECT key, data FROM functions WHERE key IN "
+                    f"({','.join('?' * len(batch))})",
+                    batch,
+                )
+                found.update(rows)
+        except sqlite3.Error as e:
+            logging.warning(f"[cfg_cache] Failed to read {self.db_path}: {e}")
+            if is_running_under_pytest():
+                raise e
+        return found
+
+    def put_functions(self, entries: Iterable[Tuple[str, bytes]]) -> None:
+        try:
+            db = self.__connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO functions (key, data) VALUES (?, ?)",
+                    entries,
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"[cfg_cache] Failed to write {self.db_path}: {e}")
+            if is_running_under_pytest():
+                raise e
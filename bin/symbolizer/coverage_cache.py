@@ -0,0 +1,155 @@
+import hashlib
+import logging
+import os
+import shutil
+import sqlite3
+import time
+from typing import Optional
+
+import numpy as np
+
+from utils import is_running_under_pytest
+
+DEFAULT_COVERAGE_CACHE_SIZE = 1 << 30
+
+
+def _binary_id(binary: str) -> bytes:
+    st = os.stat(binary)
+    return f"{os.path.abspath(binary)}:{st.st_mtime_ns}:{st.st_size}\0".encode()
+
+
+def raw_coverage_key(binary: str, map_id: bytes, addrs: np.ndarray) -> str:
+    """Key of the line coverage the coverage map `map_id` of `binary` maps the
+    covered `addrs` to. The order and multiplicity of `addrs` do not matter."""
+    h = hashlib.sha256(_binary_id(binary))
+    h.update(len(map_id).to_bytes(8, "little") + map_id)
+    h.update(np.unique(addrs).astype(np.int64).tobytes())
+    return h.hexdigest()
+
+
+def input_key(binary: str, input_file: str) -> str:
+    """Key of the line coverage of running `binary` on `input_file`."""
+    h = hashlib.sha256(_binary_id(binary))
+    with open(input_file, "rb") as f:
+        while chunk := f.read(1 << 20):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class CoverageCache:
+    """Symbolized `.cov` files stored under `<cache_dir>` by content key, so
+    that inputs with the same coverage are only symbolized once.
+
+    A hit hard-links (or copies, across file systems) the stored file to the
+    output. Entries remember their size and mtime and are dropped if the file
+    was modified through such a link. The least recently used entries are
+    evicted once the stored files exceed `max_bytes`.
+    """
+
+    def __init__(
+        self, cache_dir: str, max_bytes: int = DEFAULT_COVERAGE_CACHE_SIZE
+    ) -> None:
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self.__db = sqlite3.connect(os.path.join(cache_dir, "index.db"), timeout=60)
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, "
+            "size INTEGER NOT NULL, mtime_ns INTEGER NOT NULL, last_used REAL NOT NULL)"
+        )
+        self.__db.execute(
+            "CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used)"
+        )
+        self.__db.commit()
+
+    def __entry_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def __link(self, src: str, dst: str) -> None:
+        tmp = f"{dst}.tmp.{os.getpid()}"
+        try:
+            os.link(src, tmp)
+        except OSError:
+            shutil.copyfile(src, tmp)
+        os.replace(tmp, dst)
+
+    def fetch(self, key: str, output_file: str) -> bool:
+        """Write the entry of `key` to `output_file`, if there is a valid one."""
+        try:
+            row = self.__db.execute(
+                "SELECT size, mtime_ns FROM entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return False
+            entry = self.__entry_path(key)
+            try:
+                st = os.stat(entry)
+                valid = (st.st_size, st.st_mtime_ns) == tuple(row)
+            except FileNotFoundError:
+                valid = False
+            with self.__db:
+                if not valid:
+                    self.__db.execute("DELETE FROM entries WHERE key = ?", (key,))
+                    return False
+                self.__db.execute(
+                    "UPDATE entries SET last_used = ? WHERE key = ?",
+                    (time.time(), key),
+                )
+            self.__link(entry, output_file)
+            return True
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"[coverage_cache] Failed to fetch {key}: {e}")
+            if is_running_under_pytest():
+                raise e
+            return False
+
+    def store(self, key: str, output_file: str) -> None:
+        try:
+            entry = self.__entry_path(key)
+            os.makedirs(os.path.dirname(entry), exist_ok=True)
+            self.__link(output_file, entry)
+            st = os.stat(entry)
+            with self.__db:
+                self.__db.execute(
+                    "INSERT OR REPLACE INTO entries (key, size, mtime_ns, last_used) "
+                    "VALUES (?, ?, ?, ?)",
+                    (key, st.st_size, st.st_mtime_ns, time.time()),
+                )
+            self.__evict()
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"[coverage_cache] Failed to store {key}: {e}")
+            if is_running_under_pytest():
+                raise e
+
+    def __evict(self) -> None:
+        (total,) = self.__db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+        evicted = []
+        for key, size in self.__db.execute(
+            "SELECT key, size FROM entries ORDER BY last_used"
+        ):
+            if total <= self.max_bytes:
+                break
+            evicted.append(key)
+            total -= size
+        with self.__db:
+            self.__db.executemany(
+                "DELETE FROM entries WHERE key = ?", [(key,) for key in evicted]
+            )
+        for key in evicted:
+            try:
+                os.unlink(self.__entry_path(key))
+            except FileNotFoundError:
+                pass
+
+
+def get_coverage_cache(conf: dict) -> Optional[CoverageCache]:
+    cache_dir = conf.get("coverage_cache_dir")
+    if not cache_dir:
+        return None
+    return CoverageCache(
+        cache_dir, conf.get("coverage_cache_size", DEFAULT_COVERAGE_CACHE_SIZE)
+    )
@@ -0,0 +1,270 @@
+import struct
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+
+from cfg_dataclasses import LineInfo, Node
+
+# Layout (all integers little-endian, every column 8-byte aligned):
+#   header:  magic (8s) | version (u32) | column count (u32)
+#   columns: (offset u64, item count u64) per entry of COLUMNS
+#   payload: the column arrays themselves
+# Nodes are stored once even when several instrumented addresses share them;
+# per-node lists are CSR encoded (`<name>_offsets[i]:<name>_offsets[i + 1]`).
+COVERAGE_MAP_MAGIC = b"UCOVMAP\0"
+COVERAGE_MAP_VERSION = 1
+
+COLUMNS: List[Tuple[str, str]] = [
+    ("addrs", "<u8"),  # sorted instrumented addresses
+    ("addr_nodes", "<u4"),  # node index of each address
+    ("node_fallback", "u1"),
+    ("node_lines_offsets", "<u8"),
+    ("node_lines", "<u4"),  # indices into the line table
+    ("node_lines_wo_offsets", "<u8"),
+    ("node_lines_wo", "<u4"),  # lines_from_addrs_reachable_wo_instrumentation
+    ("node_reachable_offsets", "<u8"),
+    ("node_reachable", "<u8"),  # sorted reachable_instrumented_addrs
+    ("line_functions", "<u4"),  # indices into the function string table
+    ("line_files", "<u4"),  # indices into the file string table
+    ("line_numbers", "<i8"),
+    ("function_offsets", "<u8"),
+    ("function_blob", "u1"),
+    ("file_offsets", "<u8"),
+    ("file_blob", "u1"),
+]
+
+_HEADER = struct.Struct("<8sII")
+_COLUMN_ENTRY = struct.Struct("<QQ")
+
+
+class _StringTable:
+    def __init__(self) -> None:
+        self.index: Dict[str, int] = {}
+
+    def intern(self, value: str) -> int:
+        return self.index.setdefault(value, len(self.index))
+
+    def encode(self) -> Tuple[np.ndarray, np.ndarray]:
+        encoded = [value.encode("utf-8", "surrogateescape") for value in self.index]
+        offsets = np.zeros(len(encoded) + 1, dtype="<u8")
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        blob = np.frombuffer(b"".join(encoded), dtype="u1")
+        return offsets, blob
+
+
+def _csr(rows: List[List[int]], dtype: str) -> Tuple[np.ndarray, np.ndarray]:
+    offsets = np.zeros(len(rows) + 1, dtype="<u8")
+    np.cumsum([len(row) for row in rows], out=offsets[1:])
+    values = np.fromiter(
+        (value for row in rows for value in row), dtype=dtype, count=int(offsets[-1])
+    )
+    return offsets, values
+
+
+def serialize_coverage_map(data: Dict[int, Node]) -> bytes:
+    functions = _StringTable()
+    files = _StringTable()
+    line_index: Dict[LineInfo, int] = {}
+    line_rows: List[Tuple[int, int, int]] = []
+
+    def intern_lines(lines) -> List[int]:
+        indices = []
+        for line in lines:
+            idx = line_index.get(line)
+            if idx is None:
+                idx = line_index[line] = len(line_rows)
+                line_rows.append(
+                    (
+                        functions.intern(line.function_name),
+                        files.intern(line.src_file),
+                        line.line_number,
+                    )
+                )
+            indices.append(idx)
+        return sorted(indices)
+
+    addrs = sorted(data)
+    node_ids: Dict[int, int] = {}
+    addr_nodes: List[int] = []
+    nodes: List[Node] = []
+    for addr in addrs:
+        node = data[addr]
+        node_id = node_ids.get(id(node))
+        if node_id is None:
+            node_id = node_ids[id(node)] = len(nodes)
+            nodes.append(node)
+        addr_nodes.append(node_id)
+
+    lines_offsets, lines = _csr([intern_lines(n.lines) for n in nodes], "<u4")
+    lines_wo_offsets, lines_wo = _csr(
+        [intern_lines(n.lines_from_addrs_reachable_wo_instrumentation) for n in nodes],
+        "<u4",
+    )
+    reachable_offsets, reachable = _csr(
+        [sorted(n.reachable_instrumented_addrs) for n in nodes], "<u8"
+    )
+    function_offsets, function_blob = functions.encode()
+    file_offsets, file_blob = files.encode()
+
+    columns = {
+        "addrs": np.array(addrs, dtype="<u8"),
+        "addr_nodes": np.array(addr_nodes, dtype="<u4"),
+        "node_fallback": np.array([n.fallback for n in nodes], dtype="u1"),
+        "node_lines_offsets": lines_offsets,
+        "node_lines": lines,
+        "node_lines_wo_offsets": lines_wo_offsets,
+        "node_lines_wo": lines_wo,
+        "node_reachable_offsets": reachable_offsets,
+        "node_reachable": reachable,
+        "line_functions": np.array([r[0] for r in line_rows], dtype="<u4"),
+        "line_files": np.array([r[1] for r in line_rows], dtype="<u4"),
+        "line_numbers": np.array([r[2] for r in line_rows], dtype="<i8"),
+        "function_offsets": function_offsets,
+        "function_blob": function_blob,
+        "file_offsets": file_offsets,
+        "file_blob": file_blob,
+    }
+
+    offset = _HEADER.size + _COLUMN_ENTRY.size * len(COLUMNS)
+    table = [_HEADER.pack(COVERAGE_MAP_MAGIC, COVERAGE_MAP_VERSION, len(COLUMNS))]
+    payload = []
+    for name, dtype in COLUMNS:
+        column = np.ascontiguousarray(columns[name], dtype=dtype)
+        padding = -offset % 8
+        payload.append(b"\0" * padding)
+        offset += padding
+        table.append(_COLUMN_ENTRY.pack(offset, len(column)))
+        payload.append(column.tobytes())
+        offset += column.nbytes
+    return b"".join(table + payload)
+
+
+def as_addr_array(addrs: Union[List[int], np.ndarray]) -> np.ndarray:
+    if isinstance(addrs, np.ndarray) and addrs.dtype == np.uint64:
+        return addrs
+    # Negative addresses (e.g. rebased below the load address) wrap to values
+    # above 2**63 that never match an address in the map.
+    return np.asarray(addrs, dtype=np.int64).view(np.uint64)
+
+
+class CoverageMap:
+    """Read-only view over a serialized CFG address map.
+
+    Columns are NumPy views into `buf` (bytes, memoryview or mmap); nothing
+    is copied, so many processes mapping the same buffer share its pages.
+    """
+
+    def __init__(self, buf: Union[bytes, bytearray, memoryview]) -> None:
+        self.buf = buf
+        if len(buf) < _HEADER.size:
+            raise ValueError("coverage map is truncated")
+        magic, version, count = _HEADER.unpack_from(buf, 0)
+        if magic != COVERAGE_MAP_MAGIC:
+            raise ValueError("not a coverage map")
+        if version != COVERAGE_MAP_VERSION or count != len(COLUMNS):
+            raise ValueError(
+                f"unsupported coverage map version {version} "
+                f"(expected {COVERAGE_MAP_VERSION})"
+            )
+
+        for i, (name, dtype) in enumerate(COLUMNS):
+            offset, length = _COLUMN_ENTRY.unpack_from(
+                buf, _HEADER.size + i * _COLUMN_ENTRY.size
+            )
+            setattr(
+                self,
+                name,
+                np.frombuffer(buf, dtype=dtype, count=length, offset=offset),
+            )
+
+        self.__functions: List[Optional[str]] = [None] * (len(self.function_offsets) - 1)
+        self.__files: List[Optional[str]] = [None] * (len(self.file_offsets) - 1)
+        self.__line_infos: List[Optional[LineInfo]] = [None] * len(self.line_numbers)
+
+    def __len__(self) -> int:
+        return len(self.addrs)
+
+    def lookup(self, addrs: Union[List[int], np.ndarray]) -> np.ndarray:
+        """Return the node index of every address, -1 where it is unknown."""
+        queries = as_addr_array(addrs)
+        if not len(self.addrs):
+            return np.full(len(queries), -1, dtype=np.int64)
+        pos = np.minimum(np.searchsorted(self.addrs, queries), len(self.addrs) - 1)
+        return np.where(
+            self.addrs[pos] == queries, self.addr_nodes[pos].astype(np.int64), -1
+        )
+
+    def is_fallback(self, node_id: int) -> bool:
+        return bool(self.node_fallback[node_id])
+
+    def lines(self, node_id: int) -> List[LineInfo]:
+        return self.__line_infos_of(self.node_lines_offsets, self.node_lines, node_id)
+
+    def lines_from_addrs_reachable_wo_instrumentation(
+        self, node_id: int
+    ) -> List[LineInfo]:
+        return self.__line_infos_of(
+            self.node_lines_wo_offsets, self.node_lines_wo, node_id
+        )
+
+    def reaches_any(self, node_ids: np.ndarray, addrs: np.ndarray) -> np.ndarray:
+        """For every node, whether one of its reachable instrumented addresses
+        is in `addrs` (sorted). Linear in the size of the nodes' reachable sets.
+        """
+        starts = self.node_reachable_offsets[node_ids].astype(np.int64)
+        lengths = self.node_reachable_offsets[node_ids + 1].astype(np.int64) - starts
+        total = int(lengths.sum())
+        if total == 0 or not len(addrs):
+            return np.zeros(len(node_ids), dtype=bool)
+
+        # Gather the CSR rows of `node_ids` into one flat array.
+        owners = np.repeat(np.arange(len(node_ids)), lengths)
+        row_starts = np.cumsum(lengths) - lengths
+        reachable = self.node_reachable[
+            np.arange(total) - row_starts[owners] + starts[owners]
+        ]
+        pos = np.minimum(np.searchsorted(addrs, reachable), len(addrs) - 1)
+        hits = owners[addrs[pos] == reachable]
+        return np.bincount(hits, minlength=len(node_ids)) > 0
+
+    def reachable_instrumented_addrs(self, node_id: int) -> np.ndarray:
+        start, end = self.node_reachable_offsets[node_id : node_id + 2]
+        return self.node_reachable[start:end]
+
+    def __line_infos_of(
+        self, offsets: np.ndarray, values: np.ndarray, node_id: int
+    ) -> List[LineInfo]:
+        start, end = offsets[node_id : node_id + 2]
+        return [self.__line_info(int(idx)) for idx in values[start:end]]
+
+    def __line_info(self, idx: int) -> LineInfo:
+        line_info = self.__line_infos[idx]
+        if line_info is None:
+            line_info = self.__line_infos[idx] = LineInfo(
+                self.__string(
+                    self.__functions,
+                    self.function_offsets,
+                    self.function_blob,
+                    int(self.line_functions[idx]),
+                ),
+                self.__string(
+                    self.__files,
+                    self.file_offsets,
+                    self.file_blob,
+                    int(self.line_files[idx]),
+                ),
+                int(self.line_numbers[idx]),
+            )
+        return line_info
+
+    @staticmethod
+    def __string(
+        cache: List[Optional[str]], offsets: np.ndarray, blob: np.ndarray, idx: int
+    ) -> str:
+        value = cache[idx]
+        if value is None:
+            start, end = offsets[idx : idx + 2]
+            value = cache[idx] = (
+                blob[start:end].tobytes().decode("utf-8", "surrogateescape")
+            )
+        return value
@@ -3,22 +3,83 @@
 import argparse
 import concurrent.futures
 import glob
+import importlib.util
 import json
 import os.path
-import re
+import shlex
 import shutil
+import signal
 import subprocess
 import time
 import traceback
+from dataclasses import dataclass
 from pathlib import Path
-from typing import Dict, List, Optional, Tuple
+from types import ModuleType
+from typing import Callable, Dict, List, Optional, Tuple
 
 import clang.cindex
-from symbolizer import BinSymbolizer
+from coverage_cache import get_coverage_cache, input_key
+from elftools.elf.elffile import ELFFile
+from line_function_index import LineFunctionIndex
+from llvm_cov import (
+    LLVM_COV_FORMATS,
+    LLVM_COV_SHOW,
+    llvm_cov_subcommand,
+    run_llvm_cov,
+)
+from symbolizer import BinSymbolizer, CoverageMapNotReady, defer_symbolization
 from utils import get_new_file_path, is_running_under_pytest, map_lines_to_functions
 
 clang.cindex.Config.set_library_file("/usr/lib/llvm-14/lib/libclang.so.1")
 
+BATCH_COMMAND = "BATCH"
+
+# Seconds one input may take to be reproduced, and again to be exported, and
+# that a whole batch may take. Inputs left over fall back to BinSymbolizer;
+# the batch stays well within the timeout of the main loop.
+INPUT_TIMEOUT = 5 * 60
+BATCH_TIMEOUT = 45 * 60
+
+
+@dataclass
+class HarnessMetadata:
+    """Everything about the coverage binary that does not depend on the input.
+    `stamp` is the (mtime, size, inode) of the binary it was computed for."""
+
+    stamp: Tuple[int, int, int]
+    prf_cnts: Optional[int]
+    prf_data: Optional[int]
+    llvm_cov_args: List[str]
+
+
+def _load_profraw_update() -> Optional[ModuleType]:
+    path = shutil.which("profraw_update.py")
+    if path is None:
+        return None
+    try:
+        spec = importlib.util.spec_from_file_location("profraw_update", path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+    except Exception:
+        return None
+
+
+def read_jobs(readline: Callable[[], str]) -> List[Tuple[str, str, str]]:
+    """Read one request: an input path followed by its raw coverage path, or
+    `BATCH <n>` followed by n such pairs. Each job is answered by writing
+    `<raw coverage path>.cov`, and the whole request by a single DONE."""
+    line = readline()
+    if line.startswith(f"{BATCH_COMMAND} "):
+        count = int(line[len(BATCH_COMMAND) + 1 :])
+        pairs = [(readline(), readline()) for _ in range(count)]
+    else:
+        pairs = [(line, readline())]
+    return [
+        (input_file, raw_cov_file, raw_cov_file + ".cov")
+        for input_file, raw_cov_file in pairs
+    ]
+
 
 class HarnessCoverageRunner:
     def __init__(
@@ -29,11 +90,13 @@ class HarnessCoverageRunner:
         out_dir: str,
         disable_fallback: bool,
         log_dir: Optional[str],
+        llvm_cov_format: str = LLVM_COV_SHOW,
     ):
         self.harness = harness
         self.work_dir = work_dir
         self.out_dir = out_dir
         self.disable_fallback = disable_fallback
+        self.llvm_cov_format = llvm_cov_format
         if log_dir:
             os.makedirs(log_dir, exist_ok=True)
         self.log_dir = log_dir
@@ -64,20 +127,26 @@ class HarnessCoverageRunner:
             f"{self.path_equivalence_args} -ignore-filename-regex=.*src/libfuzzer/.*"
         )
         self.branch_cov_args = "--show-branches=count --show-expansions"
-        self.time_out = "1h"
 
         self.cache: Dict[str, Dict[int, str]] = {}
         self.file_path_cache: Dict[str, str] = {}
+        self.metadata: Optional[HarnessMetadata] = None
+        self.profraw_update = _load_profraw_update()
 
         self.project_root = os.getenv("CP_PROJ_PATH", "/src")
         self.src_root = os.getenv("CP_SRC_PATH", "/src/repo")
 
-        self.bin_symbolizer = (
-            None
-            if self.disable_fallback
-            else BinSymbolizer(json.loads(Path(config).read_text()))
+        self.conf = conf = json.loads(Path(config).read_text())
+        line_function_index_path = conf.get("line_function_index_path")
+        self.line_function_index = (
+            LineFunctionIndex(line_function_index_path)
+            if line_function_index_path
+            else None
         )
 
+        self.coverage_cache = get_coverage_cache(conf)
+        self.bin_symbolizer = None if self.disable_fallback else BinSymbolizer(conf)
+
     def initialize_directories(self) -> None:
         for dir_path in [
             self.dumps_dir,
@@ -138,15 +207,7 @@ class HarnessCoverageRunner:
                     f.write(f"\n-----------------------\n")
                 f.write("\n\n\n\n")
 
-    def run_harness_coverage(self, input_file: str) -> Tuple[Optional[str], List[str]]:
-        self.initialize_directories()
-
-        harness = self.harness
-        target = self.target
-        profraw_file = os.path.join(self.dumps_dir, f"{target}.%1m.profraw")
-        profraw_file_mask = os.path.join(self.dumps_dir, f"{target}.*.profraw")
-        profdata_file = os.path.join(self.dumps_dir, f"{target}.profdata")
-
+    def _reproduce(self, input_file: str, profraw_file: str, timeout: float) -> None:
         env = os.environ.copy()
         env["LLVM_PROFILE_FILE"] = profraw_file
         env["OUT"] = str(self.out_dir)
@@ -162,56 +223,54 @@ class HarnessCoverageRunner:
         cmd = ["reproduce", harness_name, "-merge=1", "-timeout=100"]
 
         try:
-            subprocess.run(
+            # In its own session, so that a timeout also kills the fuzzer
+            # reproduce runs.
+            proc = subprocess.Popen(
                 cmd,
                 cwd=self.out_dir,
                 env=env,
                 shell=False,
-                timeout=int(self.time_out[:-1]) * 3600,  # Convert hours to seconds
-                capture_output=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
                 text=True,
-                check=True,
+                start_new_session=True,
             )
+            try:
+                stdout, stderr = proc.communicate(timeout=timeout)
+            except subprocess.TimeoutExpired:
+                os.killpg(proc.pid, signal.SIGKILL)
+                proc.communicate()
+                raise
+            if proc.returncode != 0:
+                raise subprocess.CalledProcessError(
+                    proc.returncode, cmd, stdout, stderr
+                )
         except Exception as e:
             self._error("Harness coverage run failed", input_file, e, [input_file])
 
-        profraw_files = glob.glob(profraw_file_mask)
-        if not profraw_files:
-            self._error("Profraw file was not produced", input_file, None, [input_file])
-            return None, []
-
-        # for raw in profraw_files:
-        #     try:
-        #         os.chown(raw, 0, 0)
-        #     except Exception as e:
-        #         self._error(f"Failed to chown {raw}", input_file, e, [raw])
-
-        if all(os.path.getsize(f) == 0 for f in profraw_files):
-            self._error(
-                "All profraw files are empty",
-                input_file,
-                None,
-                [input_file] + profraw_files,
-            )
-            return None, profraw_files
-
-        if "@" in target:
-            target = target.split("@")[0]
-
-        subprocess.run(
-            f"profraw_update.py {os.path.join(self.out_dir, target)} -i {profraw_file_mask}",
-            cwd=self.out_dir,
-            shell=True,
-            check=True,
-        )
-
-        subprocess.run(
-            f"llvm-profdata merge -j=1 -sparse {profraw_file_mask} -o {profdata_file}",
-            cwd=self.out_dir,
-            shell=True,
-            check=True,
-        )
-
+    def _object_name(self) -> str:
+        return self.target.split("@")[0]
+
+    def _get_metadata(self) -> HarnessMetadata:
+        binary = os.path.join(self.out_dir, self._object_name())
+        st = os.stat(binary)
+        stamp = (st.st_mtime_ns, st.st_size, st.st_ino)
+        if self.metadata is None or self.metadata.stamp != stamp:
+            self.metadata = self._compute_metadata(binary, stamp)
+        return self.metadata
+
+    def _compute_metadata(
+        self, binary: str, stamp: Tuple[int, int, int]
+    ) -> HarnessMetadata:
+        prf_cnts, prf_data = None, None
+        with open(binary, "rb") as f:
+            for section in ELFFile(f).iter_sections():
+                if section.name == "__llvm_prf_cnts":
+                    prf_cnts = section["sh_addr"]
+                elif section.name == "__llvm_prf_data":
+                    prf_data = section["sh_addr"]
+
+        target = self._object_name()
         shared_libs = subprocess.check_output(
             f"coverage_helper shared_libs -build-dir={self.out_dir} -object={target}",
             cwd=self.out_dir,
@@ -219,19 +278,154 @@ class HarnessCoverageRunner:
             text=True,
             stderr=subprocess.DEVNULL,
         ).strip()
+        llvm_cov_args = (
+            ["llvm-cov-custom"]
+            + llvm_cov_subcommand(
+                self.llvm_cov_format, shlex.split(self.branch_cov_args)
+            )
+            + [f"-object={target}"]
+            + shlex.split(shared_libs)
+            + shlex.split(self.llvm_cov_common_args)
+        )
+        return HarnessMetadata(stamp, prf_cnts, prf_data, llvm_cov_args)
+
+    def _update_profraw_files(
+        self, metadata: HarnessMetadata, profraw_files: List[str]
+    ) -> None:
+        if (
+            self.profraw_update is None
+            or metadata.prf_cnts is None
+            or metadata.prf_data is None
+        ):
+            subprocess.run(
+                [
+                    "profraw_update.py",
+                    os.path.join(self.out_dir, self._object_name()),
+                    "-i",
+                ]
+                + profraw_files,
+                cwd=self.out_dir,
+                check=True,
+            )
+            return
+        for profraw_file in profraw_files:
+            with open(profraw_file, "rb") as f:
+                data = bytearray(f.read())
+            data = self.profraw_update.upgrade(
+                data, metadata.prf_cnts, metadata.prf_data
+            )
+            with open(profraw_file, "wb") as f:
+                f.write(data)
+
+    def run_harness_coverage(
+        self, input_file: str
+    ) -> Tuple[Optional[Dict[str, List[int]]], List[str]]:
+        return self.run_harness_coverage_batch([input_file])[0]
+
+    def run_harness_coverage_batch(
+        self, input_files: List[str]
+    ) -> List[Tuple[Optional[Dict[str, List[int]]], List[str]]]:
+        """Collect the executed lines of each input, per source file. Every input
+        gets its own dump directory and LLVM_PROFILE_FILE, while the
+        directory setup and profraw upgrade are done once for the whole batch
+        and the harness metadata once per coverage binary.
+
+        Each input is reproduced and exported within INPUT_TIMEOUT, and the
+        whole batch within BATCH_TIMEOUT; inputs left without coverage then
+        get None, as for any other failure."""
+        deadline = time.monotonic() + BATCH_TIMEOUT
+        self.initialize_directories()
 
-        result = subprocess.run(
-            f"llvm-cov-custom show -instr-profile={profdata_file} -object={target} "
-            f"{shared_libs} {self.branch_cov_args} "
-            f"{self.llvm_cov_common_args}",
-            cwd=self.out_dir,
-            shell=True,
-            capture_output=True,
-            text=True,
-            check=True,
+        results: List[Tuple[Optional[Dict[str, List[int]]], List[str]]] = [
+            (None, []) for _ in input_files
+        ]
+        profraw_files: Dict[int, List[str]] = {}
+        for idx, input_file in enumerate(input_files):
+            timeout = min(INPUT_TIMEOUT, deadline - time.monotonic())
+            if timeout <= 0:
+                self._error("Batch timed out", input_file, None, [input_file])
+                continue
+            dump_dir = os.path.join(self.dumps_dir, str(idx))
+            os.makedirs(dump_dir, exist_ok=True)
+            self._reproduce(
+                input_file,
+                os.path.join(dump_dir, f"{self.target}.%1m.profraw"),
+                timeout,
+            )
+
+            files = glob.glob(os.path.join(dump_dir, f"{self.target}.*.profraw"))
+            if not files:
+                self._error(
+                    "Profraw file was not produced", input_file, None, [input_file]
+                )
+                continue
+
+            # for raw in files:
+            #     try:
+            #         os.chown(raw, 0, 0)
+            #     except Exception as e:
+            #         self._error(f"Failed to chown {raw}", input_file, e, [raw])
+
+            if all(os.path.getsize(f) == 0 for f in files):
+                self._error(
+                    "All profraw files are empty",
+                    input_file,
+                    None,
+                    [input_file] + files,
+                )
+                results[idx] = (None, files)
+                continue
+            profraw_files[idx] = files
+
+        if not profraw_files:
+            return results
+
+        metadata = self._get_metadata()
+        self._update_profraw_files(
+            metadata, [f for files in profraw_files.values() for f in files]
         )
 
-        return result.stdout, [profdata_file]
+        for idx, files in profraw_files.items():
+            profdata_file = os.path.join(
+                self.dumps_dir, str(idx), f"{self.target}.profdata"
+            )
+            input_deadline = min(time.monotonic() + INPUT_TIMEOUT, deadline)
+            if input_deadline <= time.monotonic():
+                self._error("Batch timed out", input_files[idx], None, files)
+                results[idx] = (None, files)
+                continue
+            try:
+                subprocess.run(
+                    ["llvm-profdata", "merge", "-j=1", "-sparse"]
+                    + files
+                    + ["-o", profdata_file],
+                    cwd=self.out_dir,
+                    check=True,
+                    timeout=input_deadline - time.monotonic(),
+                )
+
+                line_cov = run_llvm_cov(
+                    metadata.llvm_cov_args + [f"-instr-profile={profdata_file}"],
+                    self.out_dir,
+                    self.llvm_cov_format,
+                    input_deadline - time.monotonic(),
+                )
+            except Exception as e:
+                self._error("Coverage export failed", input_files[idx], e, files)
+                results[idx] = (None, files)
+                continue
+            results[idx] = (line_cov, [profdata_file])
+
+        return results
+
+    def _map_lines_to_functions(self, file_path: str) -> Dict[int, str]:
+        if self.line_function_index is None:
+            return map_lines_to_functions(file_path)
+        function_map = self.line_function_index.get(file_path)
+        if function_map is None:
+            function_map = map_lines_to_functions(file_path)
+            self.line_function_index.put(file_path, function_map)
+        return function_map
 
     def adjust_file_path(self, file_path: str) -> str:
         return f"{self.out_dir}{file_path}"
@@ -258,34 +452,68 @@ class HarnessCoverageRunner:
         self.file_path_cache[path_from_build] = path_from_build
         return path_from_build
 
+    def fall_back(self, input_file: str, raw_cov_file: str, output_file: str):
+        """Symbolize with BinSymbolizer, or defer to the symbolizer service if
+        the coverage map is not built yet."""
+        try:
+            self.bin_symbolizer.symbolize(raw_cov_file, output_file)
+        except CoverageMapNotReady:
+            if not defer_symbolization(self.conf, input_file, raw_cov_file):
+                self.bin_symbolizer.symbolize(raw_cov_file, output_file)
+
     def get_coverage(self, input_file: str, raw_cov_file: str, output_file: str):
-        text_cov, prof_files = self.run_harness_coverage(input_file)
-        if text_cov is None:
+        self.get_coverage_batch([(input_file, raw_cov_file, output_file)])
+
+    def get_coverage_batch(self, jobs: List[Tuple[str, str, str]]):
+        misses: List[Tuple[Tuple[str, str, str], Optional[str]]] = []
+        if self.coverage_cache:
+            binary = os.path.join(self.out_dir, self._object_name())
+            for job in jobs:
+                key = input_key(binary, job[0])
+                if not self.coverage_cache.fetch(key, job[2]):
+                    misses.append((job, key))
+        else:
+            misses = [(job, None) for job in jobs]
+        if not misses:
+            return
+
+        results = self.run_harness_coverage_batch([job[0] for job, _ in misses])
+        for (job, key), (line_cov, prof_files) in zip(misses, results):
+            input_file, raw_cov_file, output_file = job
+            written = self._write_coverage(
+                input_file, raw_cov_file, output_file, line_cov, prof_files
+            )
+            if key is not None and written:
+                self.coverage_cache.store(key, output_file)
+
+    def _write_coverage(
+        self,
+        input_file: str,
+        raw_cov_file: str,
+        output_file: str,
+        line_cov: Optional[Dict[str, List[int]]],
+        prof_files: List[str],
+    ) -> bool:
+        """Write the coverage of `input_file` to `output_file`. Returns whether
+        it was read from llvm-cov, rather than falling back or deferred."""
+        if line_cov is None:
             self._error(
-                "text_cov is None",
+                "line_cov is None",
                 input_file,
                 None,
                 files_to_dump=[input_file, raw_cov_file] + prof_files,
             )
         covs = {}
+        parsed = False
         try:
-            if text_cov:
-                for result in re.split(r"\n{2,}", text_cov):
-                    if result.strip() == "":
-                        continue
-                    lines = result.split("\n")
-
-                    if len(lines) != 2:
-                        continue
-
-                    file_path = lines[0].strip()[:-1]
+            if line_cov:
+                for file_path, line_numbers in line_cov.items():
                     file_path = self.adjust_file_path(file_path)
 
                     if file_path not in self.cache:
-                        self.cache[file_path] = map_lines_to_functions(file_path)
+                        self.cache[file_path] = self._map_lines_to_functions(file_path)
 
-                    for line_number_str in lines[1].strip().split():
-                        line_number = int(line_number_str)
+                    for line_number in line_numbers:
                         if line_number not in self.cache[file_path]:
                             if is_running_under_pytest():
                                 raise Exception(
@@ -305,6 +533,7 @@ class HarnessCoverageRunner:
 
             for func_name, data in covs.items():
                 data["lines"].sort()
+            parsed = line_cov is not None
         except Exception as e:
             self._error(
                 "Error in parsing",
@@ -332,11 +561,15 @@ class HarnessCoverageRunner:
             #                 prof_file,
             #                 f"/{os.path.basename(input_file)}/{os.path.basename(prof_file)}",
             #             )
-            if not covs and not text_cov and self.bin_symbolizer:
-                self.bin_symbolizer.symbolize(raw_cov_file, output_file)
+            fell_back = not covs and not line_cov and self.bin_symbolizer
+            if fell_back:
+                self.fall_back(input_file, raw_cov_file, output_file)
             else:
+                # The old output may be linked to a cache entry.
+                Path(output_file).unlink(missing_ok=True)
                 with open(output_file, "wt") as f:
                     f.write(json.dumps(covs))
+        return parsed and not fell_back
 
 
 if __name__ == "__main__":
@@ -376,6 +609,13 @@ if __name__ == "__main__":
         default=None,
         help="Path to the log dir (default: None).",
     )
+    parser.add_argument(
+        "--llvm_cov_format",
+        choices=LLVM_COV_FORMATS,
+        default=LLVM_COV_SHOW,
+        help="How to read coverage from llvm-cov-custom: the patched `show` "
+        "text or a streamed `export -format=lcov` (default: show).",
+    )
     args = parser.parse_args()
     harness = HarnessCoverageRunner(
         args.config,
@@ -384,6 +624,7 @@ if __name__ == "__main__":
         args.out_dir,
         args.disable_fallback,
         args.log_dir,
+        args.llvm_cov_format,
     )
 
     timeout_seconds = (
@@ -391,20 +632,21 @@ if __name__ == "__main__":
     )  # 9 minutes 30 seconds (30 seconds shorter than uniafl timeout)
 
     while True:
-        input_file = input()
-        raw_cov_file = input()
-        output_file = raw_cov_file + ".cov"
+        jobs = read_jobs(input)
+        for _, _, output_file in jobs:
+            Path(output_file).unlink(missing_ok=True)
         with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
             try:
-                future = executor.submit(
-                    harness.get_coverage, input_file, raw_cov_file, output_file
-                )
+                future = executor.submit(harness.get_coverage_batch, jobs)
                 future.result(timeout=timeout_seconds)
             except Exception as e:
-                if harness.bin_symbolizer:
-                    harness.bin_symbolizer.symbolize(raw_cov_file, output_file)
-                else:
-                    with open(output_file, "wt") as f:
-                        f.write(json.dumps({}))
+                for input_file, raw_cov_file, output_file in jobs:
+                    if os.path.exists(output_file):
+                        continue
+                    if harness.bin_symbolizer:
+                        harness.fall_back(input_file, raw_cov_file, output_file)
+                    else:
+                        with open(output_file, "wt") as f:
+                            f.write(json.dumps({}))
             finally:
                 print("DONE", flush=True)
@@ -0,0 +1,200 @@
+#!/usr/bin/env python3
+
+import argparse
+import fcntl
+import json
+import logging
+import multiprocessing
+import os
+import sqlite3
+import sys
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils import is_running_under_pytest, map_lines_to_functions
+
+DEFAULT_SOURCE_SUFFIXES = (".c", ".cc", ".cpp", ".cxx", ".c++")
+
+
+def source_stamp(src_file: str) -> str:
+    st = os.stat(src_file)
+    return f"{st.st_mtime_ns}:{st.st_size}"
+
+
+def to_intervals(function_map: Dict[int, str]) -> List[Tuple[int, int, str]]:
+    """Collapse a line -> function map into (first, last, function) runs."""
+    intervals: List[Tuple[int, int, str]] = []
+    for line in sorted(function_map):
+        name = function_map[line]
+        if intervals and intervals[-1][1] == line - 1 and intervals[-1][2] == name:
+            intervals[-1] = (intervals[-1][0], line, name)
+        else:
+            intervals.append((line, line, name))
+    return intervals
+
+
+def from_intervals(intervals: Iterable[Tuple[int, int, str]]) -> Dict[int, str]:
+    return {
+        line: name for first, last, name in intervals for line in range(first, last + 1)
+    }
+
+
+class LineFunctionIndex:
+    """`map_lines_to_functions` results of every source file of a target,
+    stored as line intervals in `<db_path>` and shared by all coverage runners.
+    An entry is only used while the source file keeps its mtime and size.
+    """
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        self.__db: Optional[sqlite3.Connection] = None
+
+    def __connect(self) -> sqlite3.Connection:
+        if self.__db is None:
+            os.makedirs(os.path.dirname(os.path.abspath(self.db_path)), exist_ok=True)
+            self.__db = sqlite3.connect(self.db_path, timeout=60)
+            self.__db.execute(
+                "CREATE TABLE IF NOT EXISTS files "
+                "(path TEXT PRIMARY KEY, stamp TEXT NOT NULL, intervals TEXT NOT NULL)"
+            )
+        return self.__db
+
+    def get(self, src_file: str) -> Optional[Dict[int, str]]:
+        try:
+            row = (
+                self.__connect()
+                .execute(
+                    "SELECT stamp, intervals FROM files WHERE path = ?", (src_file,)
+                )
+                .fetchone()
+            )
+            if row is None or row[0] != source_stamp(src_file):
+                return None
+            return from_intervals(json.loads(row[1]))
+        except (sqlite3.Error, OSError) as e:
+            logging.warning(f"[line_function_index] Failed to read {src_file}: {e}")
+            if is_running_under_pytest():
+                raise e
+            return None
+
+    def put(self, src_file: str, function_map: Dict[int, str]) -> None:
+        self.put_many([(src_file, source_stamp(src_file), function_map)])
+
+    def put_many(self, entries: Iterable[Tuple[str, str, Dict[int, str]]]) -> None:
+        try:
+            db = self.__connect()
+            with db:
+                db.executemany(
+                    "INSERT OR REPLACE INTO files (path, stamp, intervals) "
+                    "VALUES (?, ?, ?)",
+                    (
+                        (src_file, stamp, json.dumps(to_intervals(function_map)))
+                        for src_file, stamp, function_map in entries
+                    ),
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"[line_function_index] Failed to write {self.db_path}: {e}")
+            if is_running_under_pytest():
+                raise e
+
+    def stale(self, src_files: List[str]) -> List[str]:
+        stamps = dict(self.__connect().execute("SELECT path, stamp FROM files"))
+        return [
+            src_file
+            for src_file in src_files
+            if stamps.get(src_file) != source_stamp(src_file)
+        ]
+
+
+def _map_file(
+    job: Tuple[str, Callable[[str], Dict[int, str]]]
+) -> Optional[Tuple[str, str, Dict[int, str]]]:
+    src_file, mapper = job
+    try:
+        return src_file, source_stamp(src_file), mapper(src_file)
+    except Exception as e:
+        logging.warning(f"[line_function_index] Failed to index {src_file}: {e}")
+        return None
+
+
+def build_line_function_index(
+    db_path: str,
+    src_files: List[str],
+    ncpu: int,
+    mapper: Callable[[str], Dict[int, str]] = map_lines_to_functions,
+) -> int:
+    """Index every stale file of `src_files` over `ncpu` processes. Only one
+    builder runs per index; others return 0 right away."""
+    os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+    with open(f"{db_path}.lock", "w") as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            logging.info(f"[line_function_index] {db_path} is already being built")
+            return 0
+
+        index = LineFunctionIndex(db_path)
+        todo = index.stale(src_files)
+        logging.info(
+            f"[line_function_index] Indexing {len(todo)} of {len(src_files)} files"
+        )
+        num_indexed = 0
+        with multiprocessing.Pool(ncpu) as pool:
+            for result in pool.imap_unordered(
+                _map_file, [(src_file, mapper) for src_file in todo]
+            ):
+                if result is not None:
+                    index.put_many([result])
+                    num_indexed += 1
+        return num_indexed
+
+
+def compiled_sources(compile_commands_path: str, out_dir: str) -> List[str]:
+    """Translation units of `compile_commands.json`, as copied into `out_dir`."""
+    with open(compile_commands_path, "r") as f:
+        compile_commands = json.load(f)
+    src_files = set()
+    for entry in compile_commands:
+        src_file = os.path.abspath(
+            os.path.join(entry.get("directory", ""), entry.get("file", ""))
+        )
+        src_file = f"{out_dir}{src_file}"
+        if src_file.endswith(DEFAULT_SOURCE_SUFFIXES) and os.path.isfile(src_file):
+            src_files.add(src_file)
+    return sorted(src_files)
+
+
+if __name__ == "__main__":
+    import clang.cindex
+
+    clang.cindex.Config.set_library_file("/usr/lib/llvm-14/lib/libclang.so.1")
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Build the line -> function index of a target"
+    )
+    parser.add_argument(
+        "--index", type=str, required=True, help="Path to the index (must have)"
+    )
+    parser.add_argument(
+        "--compile_commands",
+        default="/src/repo/compile_commands.json",
+        help="compile_commands.json listing the files to index "
+        "(default: /src/repo/compile_commands.json)",
+    )
+    parser.add_argument(
+        "--out_dir",
+        default="/coverage-out",
+        help="Directory the coverage build copied the sources to "
+        "(default: /coverage-out)",
+    )
+    parser.add_argument(
+        "--ncpu", type=int, required=True, help="Number of cores to use (must have)"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.compile_commands):
+        logging.info(f"[line_function_index] No {args.compile_commands}")
+        sys.exit(0)
+    build_line_function_index(
+        args.index, compiled_sources(args.compile_commands, args.out_dir), args.ncpu
+    )
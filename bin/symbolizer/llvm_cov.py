@@ -0,0 +1,111 @@
+import re
+import subprocess
+import threading
+from typing import Dict, List, Optional, TextIO
+
+# `llvm-cov-custom show` prints each file as `<path>:` followed by a line with
+# its executed line numbers (see patch.diff). `lcov` is the stock
+# `llvm-cov export -format=lcov` output.
+LLVM_COV_SHOW = "show"
+LLVM_COV_LCOV = "lcov"
+LLVM_COV_FORMATS = [LLVM_COV_SHOW, LLVM_COV_LCOV]
+
+LCOV_BLOCK_SIZE = 1 << 20
+_LCOV_END_OF_RECORD = "end_of_record\n"
+# `DA:<line>,<count>` with a non-zero count.
+_LCOV_EXECUTED_LINE = re.compile(r"^DA:(\d+),[1-9]", re.M)
+
+
+def llvm_cov_subcommand(export_format: str, branch_cov_args: List[str]) -> List[str]:
+    if export_format == LLVM_COV_SHOW:
+        return ["show"] + branch_cov_args
+    if export_format == LLVM_COV_LCOV:
+        return ["export", "-format=lcov", "-skip-expansions", "-skip-functions"]
+    raise ValueError(f"Unknown llvm-cov format: {export_format}")
+
+
+def parse_show(text: str) -> Dict[str, List[int]]:
+    """Executed lines per source file from the patched `show` output."""
+    covered: Dict[str, List[int]] = {}
+    for result in re.split(r"\n{2,}", text):
+        if result.strip() == "":
+            continue
+        lines = result.split("\n")
+        if len(lines) != 2:
+            continue
+        line_numbers = [int(n) for n in lines[1].split()]
+        if line_numbers:
+            covered.setdefault(lines[0].strip()[:-1], []).extend(line_numbers)
+    return covered
+
+
+def parse_lcov(
+    stream: TextIO, block_size: int = LCOV_BLOCK_SIZE
+) -> Dict[str, List[int]]:
+    """Executed lines per source file from lcov records. The report is read
+    in blocks of whole records, so it never has to be held in memory."""
+    covered: Dict[str, List[int]] = {}
+    pending = ""
+    while True:
+        block = stream.read(block_size)
+        data = pending + block
+        end = len(data)
+        if block:
+            end = data.rfind(_LCOV_END_OF_RECORD)
+            if end < 0:
+                pending = data
+                continue
+            end += len(_LCOV_END_OF_RECORD)
+        pending = data[end:]
+        for record in data[:end].split(_LCOV_END_OF_RECORD):
+            start = record.find("SF:")
+            if start < 0:
+                continue
+            src_file = record[start + 3 : record.find("\n", start)]
+            line_numbers = _LCOV_EXECUTED_LINE.findall(record)
+            if line_numbers:
+                covered.setdefault(src_file, []).extend(map(int, line_numbers))
+        if not block:
+            return covered
+
+
+def run_llvm_cov(
+    args: List[str], cwd: str, export_format: str, timeout: Optional[float] = None
+) -> Dict[str, List[int]]:
+    if export_format == LLVM_COV_LCOV:
+        timed_out = threading.Event()
+        with subprocess.Popen(
+            args,
+            cwd=cwd,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ) as proc:
+
+            def kill() -> None:
+                timed_out.set()
+                proc.kill()
+
+            timer = threading.Timer(timeout, kill) if timeout is not None else None
+            if timer is not None:
+                timer.start()
+            try:
+                covered = parse_lcov(proc.stdout)
+            finally:
+                if timer is not None:
+                    timer.cancel()
+        if timed_out.is_set():
+            raise subprocess.TimeoutExpired(args, timeout)
+        if proc.returncode != 0:
+            raise subprocess.CalledProcessError(proc.returncode, args)
+        return covered
+
+    result = subprocess.run(
+        args,
+        cwd=cwd,
+        capture_output=True,
+        text=True,
+        check=True,
+        timeout=timeout,
+    )
+    return parse_show(result.stdout)
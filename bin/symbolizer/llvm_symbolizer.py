@@ -1,11 +1,33 @@
+import logging
 import os
+import selectors
 import subprocess
+import time
+from collections import deque
 from dataclasses import dataclass
 from pathlib import Path
-from typing import List
+from typing import Any, Deque, List, Optional
 
 from utils import get_new_file_path, is_running_under_pytest
 
+# Maximum number of addresses in flight on one llvm-symbolizer process when
+# pipelining. Small enough that the pending requests always fit in the pipe.
+PIPELINE_WINDOW = 256
+
+# Seconds llvm-symbolizer may go without replying while requests are pending.
+# The oldest pending request is then counted as failed and the process is
+# restarted.
+REQUEST_TIMEOUT = 30
+
+# Seconds a fresh llvm-symbolizer may take for its first reply, which waits for
+# the debug info of the binary to be loaded.
+STARTUP_TIMEOUT = 600
+
+# Failures after which an address is given up on instead of resent.
+MAX_ATTEMPTS = 2
+
+_READ_SIZE = 1 << 16
+
 
 def remove_args(name):
     idx = len(name) - 1
@@ -33,7 +55,7 @@ class LlvmSymbolizerResult:
     def __init__(
         self, function_name: str, src_file: str, line_number: int, error: bool
     ):
-        if function_name[-1] == ")":
+        if function_name.endswith(")"):
             function_name = remove_args(function_name)
         self.function_name = function_name
         self.src_file = src_file
@@ -42,42 +64,65 @@ class LlvmSymbolizerResult:
 
 
 class LLVMSymbolizer:
-    def __init__(self, harness: str, llvm_symbolizer_path: str):
+    def __init__(
+        self,
+        harness: str,
+        llvm_symbolizer_path: str,
+        pool: Optional[Any] = None,
+    ):
         self.harness = harness
         self.llvm_symbolizer_path = llvm_symbolizer_path
-        self.llvm_symbolizer_process = self._start_llvm_symbolizer()
+        # A shared LLVMSymbolizerPool or LLVMSymbolizerPoolClient (see
+        # llvm_symbolizer_pool.py) answers instead of an own process if given.
+        self.pool = pool
+        self.llvm_symbolizer_process = (
+            self._start_llvm_symbolizer() if pool is None else None
+        )
         self.path_fix_cache: dict[str, str] = {}
         self.src_exists: dict[str, bool] = {}
         self.project_root = os.getenv("CP_PROJ_PATH", "/src")
         self.src_root = os.getenv("CP_SRC_PATH", "/src/repo")
 
-    def _start_llvm_symbolizer(self) -> subprocess.Popen[str]:
+    def _start_llvm_symbolizer(self) -> subprocess.Popen[bytes]:
+        self.llvm_symbolizer_started = False
+        # Every reply starts with the address it answers and ends with a blank
+        # line, so replies can be checked against the requests.
         cmd: List[str] = [
             self.llvm_symbolizer_path,
             f"--obj={self.harness}",
             "--pretty-print",
+            "--print-address",
         ]
         process = subprocess.Popen(
             cmd,
             stdin=subprocess.PIPE,
             stdout=subprocess.PIPE,
             stderr=subprocess.DEVNULL,
-            text=True,
         )
-        if process.stdin:
-            os.set_blocking(process.stdin.fileno(), False)
+        os.set_blocking(process.stdin.fileno(), False)
+        os.set_blocking(process.stdout.fileno(), False)
         return process
 
     def _restart_llvm_symbolizer(self) -> None:
         if self.llvm_symbolizer_process.poll() is None:
-            try:
-                self.llvm_symbolizer_process.terminate()
-                self.llvm_symbolizer_process.wait(timeout=2)
-            except subprocess.TimeoutExpired:
-                self.llvm_symbolizer_process.kill()
-                self.llvm_symbolizer_process.wait()
+            # A wedged process is not given the chance to hang on terminate.
+            self.llvm_symbolizer_process.kill()
+        self.llvm_symbolizer_process.wait()
+        self.llvm_symbolizer_process.stdin.close()
+        self.llvm_symbolizer_process.stdout.close()
         self.llvm_symbolizer_process = self._start_llvm_symbolizer()
 
+    def close(self) -> None:
+        process = self.llvm_symbolizer_process
+        if process is None:
+            return
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        process.stdin.close()
+        process.stdout.close()
+        self.llvm_symbolizer_process = None
+
     def _health_check_symbolizer(self) -> None:
         if self.llvm_symbolizer_process.poll() != None:
             self.llvm_symbolizer_process = self._start_llvm_symbolizer()
@@ -104,79 +149,172 @@ class LLVMSymbolizer:
         self.path_fix_cache[path_from_build] = path_from_build
         return path_from_build
 
-    def run_llvm_symbolizer_addr(self, addr: int) -> LlvmSymbolizerResult:
-        self._health_check_symbolizer()
-        self.llvm_symbolizer_process.stdin.write(hex(addr) + "\n")
+    def _parse_reply(self, addr: int, frame: bytes) -> Optional[str]:
+        """The outermost frame of the reply, or None if the reply is not one
+        for `addr`."""
+        lines = frame.decode(errors="replace").split("\n")
+        echoed, sep, lines[0] = lines[0].partition(": ")
         try:
-            self.llvm_symbolizer_process.stdin.flush()
-        except BlockingIOError:
-            self._restart_llvm_symbolizer()
-            return self.run_llvm_symbolizer_addr(addr)
-        line = self.llvm_symbolizer_process.stdout.readline()
-        while True:
-            _ = self.llvm_symbolizer_process.stdout.readline()
-            if _ == "\n":
-                break
-            line = _.split("(inlined by)")[1].strip()
+            if not sep or int(echoed, 16) != addr:
+                return None
+        except ValueError:
+            return None
+        if "(inlined by)" in lines[-1]:
+            return lines[-1].split("(inlined by)")[1].strip()
+        return lines[0]
 
+    def _create_result(
+        self, func_name: str, path_from_build: str, src_line: int
+    ) -> LlvmSymbolizerResult:
+        src_path = self._fix_src_path(path_from_build)
+        if src_path not in self.src_exists:
+            self.src_exists[src_path] = Path(src_path).exists()
+        return LlvmSymbolizerResult(
+            func_name,
+            src_path,
+            src_line,
+            not (self.src_exists[src_path] and src_line != 0),
+        )
+
+    def _parse_llvm_symbolizer_output(self, line: str) -> LlvmSymbolizerResult:
         try:
             t = line.split(" at ")
-            func_name = t[0]
             l = t[1].split(":")
-            src_path = self._fix_src_path(l[0])
-            src_line = int(l[1])
-            if src_path not in self.src_exists:
-                self.src_exists[src_path] = Path(src_path).exists()
-            return LlvmSymbolizerResult(
-                func_name,
-                src_path,
-                src_line,
-                not (self.src_exists[src_path] and src_line != 0),
-            )
+            return self._create_result(t[0], l[0], int(l[1]))
         except Exception as e:
             if is_running_under_pytest():
                 raise e
             return LlvmSymbolizerResult("", "", -1, True)
 
-    def run_llvm_symbolizer_addrs(self, addr: List[int]) -> List[LlvmSymbolizerResult]:
-        num_addrs = len(addr)
-        results: List[LlvmSymbolizerResult] = []
+    def run_llvm_symbolizer_addr(self, addr: int) -> LlvmSymbolizerResult:
+        return self.run_llvm_symbolizer_addrs_pipelined([addr])[0]
+
+    def run_llvm_symbolizer_addrs_pipelined(
+        self, addrs: List[int]
+    ) -> List[LlvmSymbolizerResult]:
+        """Symbolize many addresses on the long-lived llvm-symbolizer process.
+
+        Up to PIPELINE_WINDOW requests are kept in flight and the replies are
+        matched to the addresses in order. An address the process hangs on,
+        crashes on or answers wrongly MAX_ATTEMPTS times gets an error result;
+        the other addresses are unaffected. The process stays alive for later
+        calls.
+        """
+        return [
+            (
+                self._parse_llvm_symbolizer_output(line)
+                if line is not None
+                else LlvmSymbolizerResult("", "", -1, True)
+            )
+            for line in self._run_llvm_symbolizer_pipelined(addrs)
+        ]
+
+    def _run_llvm_symbolizer_pipelined(self, addrs: List[int]) -> List[Optional[str]]:
+        if self.pool is not None:
+            return self.pool.symbolize(addrs)
+        results: List[Optional[str]] = [None] * len(addrs)
+        attempts = [0] * len(addrs)
+        unsent: Deque[int] = deque(range(len(addrs)))
+        in_flight: Deque[int] = deque()
+        out = bytearray()
+        buf = bytearray()
+        deadline = 0.0
 
         self._health_check_symbolizer()
-        input_data = "\n".join([hex(a) for a in addr]) + "\n"
-        stdout, _ = self.llvm_symbolizer_process.communicate(input_data)
+        selector = self.__register(selectors.DefaultSelector())
+        try:
+            while unsent or in_flight:
+                if not in_flight:
+                    deadline = time.monotonic() + self.__timeout()
+                while unsent and len(in_flight) < PIPELINE_WINDOW:
+                    idx = unsent.popleft()
+                    in_flight.append(idx)
+                    out += b"%#x\n" % addrs[idx]
 
-        symbolizer_results = stdout.split("\n\n")
-        if symbolizer_results[-1] == "":
-            symbolizer_results = symbolizer_results[:-1]
-        if is_running_under_pytest():
-            assert (
-                len(symbolizer_results) == num_addrs
-            ), f"Expected {num_addrs} results, got {len(symbolizer_results)}"
-
-        for result in symbolizer_results:
-            line = result.split("\n")[-1]
-            if "(inlined by)" in line:
-                line = line.split("(inlined by)")[1].strip()
-            try:
-                t = line.split(" at ")
-                func_name = t[0]
-                l = t[1].split(":")
-                src_path = self._fix_src_path(l[0])
-                src_line = int(l[1])
-                if src_path not in self.src_exists:
-                    self.src_exists[src_path] = Path(src_path).exists()
-                results.append(
-                    LlvmSymbolizerResult(
-                        func_name,
-                        src_path,
-                        src_line,
-                        not (self.src_exists[src_path] and src_line != 0),
-                    )
-                )
-            except Exception as e:
-                if is_running_under_pytest():
-                    raise e
-                results.append(LlvmSymbolizerResult("", "", -1, True))
+                failed = self.__exchange(selector, out, buf, deadline)
+                while not failed and (end := buf.find(b"\n\n")) >= 0:
+                    frame = bytes(buf[:end])
+                    del buf[: end + 2]
+                    if not in_flight:
+                        failed = True
+                        break
+                    reply = self._parse_reply(addrs[in_flight[0]], frame)
+                    if reply is None:
+                        failed = True
+                        break
+                    results[in_flight.popleft()] = reply
+                    self.llvm_symbolizer_started = True
+                    deadline = time.monotonic() + REQUEST_TIMEOUT
+                if not failed:
+                    continue
+
+                # Blame the oldest pending address and resend the others to a
+                # fresh process.
+                if in_flight:
+                    idx = in_flight.popleft()
+                    attempts[idx] += 1
+                    if attempts[idx] < MAX_ATTEMPTS:
+                        in_flight.appendleft(idx)
+                    else:
+                        logging.warning(
+                            f"[llvm_symbolizer] Giving up on {hex(addrs[idx])} "
+                            f"in {self.harness}"
+                        )
+                unsent.extendleft(reversed(in_flight))
+                in_flight.clear()
+                out.clear()
+                buf.clear()
+                selector.close()
+                self._restart_llvm_symbolizer()
+                selector = self.__register(selectors.DefaultSelector())
+        finally:
+            selector.close()
 
         return results
+
+    def __timeout(self) -> float:
+        return REQUEST_TIMEOUT if self.llvm_symbolizer_started else STARTUP_TIMEOUT
+
+    def __register(self, selector: selectors.BaseSelector) -> selectors.BaseSelector:
+        selector.register(self.llvm_symbolizer_process.stdout, selectors.EVENT_READ)
+        return selector
+
+    def __exchange(
+        self,
+        selector: selectors.BaseSelector,
+        out: bytearray,
+        buf: bytearray,
+        deadline: float,
+    ) -> bool:
+        """Write what stdin takes of `out` and read what stdout has into `buf`,
+        waiting until `deadline` for either. Returns whether the process
+        failed: it closed a pipe or let the deadline pass."""
+        process = self.llvm_symbolizer_process
+        if out:
+            selector.register(process.stdin, selectors.EVENT_WRITE)
+        try:
+            timeout = deadline - time.monotonic()
+            events = selector.select(timeout) if timeout > 0 else []
+        finally:
+            if out:
+                selector.unregister(process.stdin)
+        if not events:
+            return True
+        for key, _ in events:
+            try:
+                if key.fileobj is process.stdin:
+                    del out[: os.write(process.stdin.fileno(), out)]
+                else:
+                    data = os.read(process.stdout.fileno(), _READ_SIZE)
+                    if not data:
+                        return True
+                    buf += data
+            except BlockingIOError:
+                pass
+            except OSError:
+                return True
+        return False
+
+    def run_llvm_symbolizer_addrs(self, addr: List[int]) -> List[LlvmSymbolizerResult]:
+        return self.run_llvm_symbolizer_addrs_pipelined(addr)
+
@@ -0,0 +1,151 @@
+import logging
+import os
+import socket
+import socketserver
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from llvm_symbolizer import PIPELINE_WINDOW, LLVMSymbolizer
+
+# Each llvm-symbolizer process loads the debug info of the binary, so a pool
+# keeps only a few of them.
+DEFAULT_POOL_SIZE = 4
+
+# Replies kept by a pool, least recently used first out.
+CACHE_SIZE = 1 << 18
+
+
+class LLVMSymbolizerPool:
+    """Up to `size` long-lived llvm-symbolizer processes for one binary.
+
+    A batch of addresses is split over the processes, and replies are kept by
+    address so that every user of the pool gets a repeated address for free.
+    Thread safe; LLVMSymbolizerServer shares a pool with other processes.
+    """
+
+    def __init__(
+        self, harness: str, llvm_symbolizer_path: str, size: int = DEFAULT_POOL_SIZE
+    ) -> None:
+        self.harness = harness
+        self.llvm_symbolizer_path = llvm_symbolizer_path
+        self.size = size
+        self.__lock = threading.Lock()
+        self.__cache: OrderedDict[int, Optional[str]] = OrderedDict()
+        self.__local = threading.local()
+        self.__symbolizers: List[LLVMSymbolizer] = []
+        # One process per executor thread, started on its first batch.
+        self.__executor = ThreadPoolExecutor(size)
+
+    def __symbolizer(self) -> LLVMSymbolizer:
+        symbolizer = getattr(self.__local, "symbolizer", None)
+        if symbolizer is None:
+            symbolizer = LLVMSymbolizer(self.harness, self.llvm_symbolizer_path)
+            self.__local.symbolizer = symbolizer
+            with self.__lock:
+                self.__symbolizers.append(symbolizer)
+        return symbolizer
+
+    def __run(self, addrs: List[int]) -> List[Optional[str]]:
+        return self.__symbolizer()._run_llvm_symbolizer_pipelined(addrs)
+
+    def symbolize(self, addrs: List[int]) -> List[Optional[str]]:
+        """The outermost frame llvm-symbolizer replies for each address, or
+        None if it could not be symbolized."""
+        replies: Dict[int, Optional[str]] = {}
+        with self.__lock:
+            for addr in addrs:
+                if addr in self.__cache:
+                    self.__cache.move_to_end(addr)
+                    replies[addr] = self.__cache[addr]
+        todo = sorted({addr for addr in addrs if addr not in replies})
+        if todo:
+            step = max(PIPELINE_WINDOW, -(-len(todo) // self.size))
+            parts = [todo[i : i + step] for i in range(0, len(todo), step)]
+            for part, results in zip(parts, self.__executor.map(self.__run, parts)):
+                replies.update(zip(part, results))
+            with self.__lock:
+                self.__cache.update((addr, replies[addr]) for addr in todo)
+                while len(self.__cache) > CACHE_SIZE:
+                    self.__cache.popitem(last=False)
+        return [replies[addr] for addr in addrs]
+
+    def close(self) -> None:
+        self.__executor.shutdown()
+        for symbolizer in self.__symbolizers:
+            symbolizer.close()
+
+
+class LLVMSymbolizerPoolClient:
+    """Symbolizes through an LLVMSymbolizerServer, like a local
+    LLVMSymbolizerPool would."""
+
+    def __init__(self, socket_path: str) -> None:
+        self.socket_path = socket_path
+        self.__conn: Optional[socket.socket] = None
+
+    def symbolize(self, addrs: List[int]) -> List[Optional[str]]:
+        if not addrs:
+            return []
+        if self.__conn is None:
+            self.__conn = socket.socket(socket.AF_UNIX)
+            self.__conn.connect(self.socket_path)
+            self.__rfile = self.__conn.makefile("rb")
+        request = b"%d\n" % len(addrs) + b"".join(b"%x\n" % addr for addr in addrs)
+        self.__conn.sendall(request)
+        replies: List[Optional[str]] = []
+        for _ in addrs:
+            line = self.__rfile.readline()
+            if not line:
+                self.close()
+                raise EOFError(f"{self.socket_path} closed the connection")
+            replies.append(line.decode(errors="replace").rstrip("\n") or None)
+        return replies
+
+    def close(self) -> None:
+        if self.__conn is not None:
+            self.__rfile.close()
+            self.__conn.close()
+            self.__conn = None
+
+
+class _PoolRequestHandler(socketserver.StreamRequestHandler):
+    """A request is `<n>` followed by n hex addresses, one per line. It is
+    answered with one line per address: its reply, or an empty line if it
+    could not be symbolized."""
+
+    def handle(self) -> None:
+        while True:
+            header = self.rfile.readline()
+            if not header:
+                return
+            try:
+                count = int(header)
+                addrs = [int(self.rfile.readline(), 16) for _ in range(count)]
+            except ValueError:
+                logging.warning(f"[llvm_symbolizer_pool] Bad request: {header!r}")
+                return
+            replies = self.server.pool.symbolize(addrs)
+            self.wfile.write("".join(f"{r or ''}\n" for r in replies).encode())
+            self.wfile.flush()
+
+
+class LLVMSymbolizerServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """An LLVMSymbolizerPool shared with other processes through a Unix
+    socket, such as the cfg_analyzer workers of one binary."""
+
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, pool: LLVMSymbolizerPool) -> None:
+        self.socket_path = socket_path
+        self.pool = pool
+        Path(socket_path).unlink(missing_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        super().__init__(socket_path, _PoolRequestHandler)
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.pool.close()
+        Path(self.socket_path).unlink(missing_ok=True)
@@ -0,0 +1,154 @@
+import glob
+import hashlib
+import logging
+import os
+import pickle
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_SOURCE_INDEX_DIR = os.environ.get("SOURCE_INDEX_DIR", "/tmp/source_index")
+
+# Bumped when the pickled layout changes.
+_FORMAT = 2
+
+# A directory modified this shortly before the walk may change again within
+# the same mtime tick, so an index that saw it is not stored.
+_MTIME_SLACK_NS = 1_000_000_000
+
+
+def source_dirs() -> List[str]:
+    """The project directories under /src whose files JVM coverage may name."""
+    return [
+        path
+        for path in glob.glob("/src/*")
+        if path != "/src/src" and os.path.isdir(path)
+    ]
+
+
+class SourceIndex:
+    """Every file under `root` in a trie keyed by path components from the
+    basename upwards, so longest-suffix lookups cost O(path depth).
+
+    The trie is flat: `children` maps (node, component) to a node, and
+    `best[node]` is the shortest path below that node, the first one in walk
+    order on ties. Node 0 is the root.
+
+    The index is pickled to `<index_dir>` and reused by later processes as long
+    as no directory of the tree was replaced or modified, which takes a stat
+    per directory rather than a listing.
+    """
+
+    def __init__(self, root: str, index_dir: str = DEFAULT_SOURCE_INDEX_DIR) -> None:
+        self.root = root
+        self.index_path = os.path.join(
+            index_dir, hashlib.sha1(root.encode()).hexdigest() + ".pkl"
+        )
+        self.paths: List[str] = []
+        self.children: Dict[Tuple[int, str], int] = {}
+        self.best: List[int] = []
+        # (inode, mtime) of every directory walked, to tell whether the tree
+        # changed since.
+        self.dir_stamps: Dict[str, Tuple[int, int]] = {}
+        if not self.__load():
+            started_ns = time.time_ns()
+            self.__build()
+            if all(
+                mtime_ns < started_ns - _MTIME_SLACK_NS
+                for _, mtime_ns in self.dir_stamps.values()
+            ):
+                self.__store()
+
+    @staticmethod
+    def __stamp(path: str) -> Optional[Tuple[int, int]]:
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        return (st.st_ino, st.st_mtime_ns)
+
+    def __load(self) -> bool:
+        try:
+            with open(self.index_path, "rb") as f:
+                fmt, root, dir_stamps, paths, children, best = pickle.load(f)
+        except Exception:
+            return False
+        if fmt != _FORMAT or root != self.root or not dir_stamps:
+            return False
+        if any(self.__stamp(path) != stamp for path, stamp in dir_stamps.items()):
+            return False
+        self.paths, self.children, self.best = paths, children, best
+        self.dir_stamps = dir_stamps
+        return True
+
+    def __store(self) -> None:
+        try:
+            os.makedirs(os.path.dirname(self.index_path), exist_ok=True)
+            tmp_path = f"{self.index_path}.tmp.{os.getpid()}"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(
+                    (
+                        _FORMAT,
+                        self.root,
+                        self.dir_stamps,
+                        self.paths,
+                        self.children,
+                        self.best,
+                    ),
+                    f,
+                )
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logging.warning(f"[source_index] Failed to store {self.index_path}: {e}")
+
+    def __build(self) -> None:
+        num_parts: List[int] = []
+        best = [-1]
+        for root, _, files in os.walk(self.root):
+            # A change during the walk is newer than its start, so an index
+            # that may have missed it is not stored.
+            stamp = self.__stamp(root)
+            if stamp is not None:
+                self.dir_stamps[root] = stamp
+            for filename in files:
+                path = os.path.join(root, filename)
+                parts = path.split(os.sep)
+                path_idx = len(self.paths)
+                self.paths.append(path)
+                num_parts.append(len(parts))
+                node = 0
+                for part in reversed(parts):
+                    key = (node, sys.intern(part))
+                    node = self.children.get(key, -1)
+                    if node < 0:
+                        node = len(best)
+                        self.children[key] = node
+                        best.append(path_idx)
+                    elif len(parts) < num_parts[best[node]]:
+                        best[node] = path_idx
+        self.best = best
+
+    def __deepest(self, path: str) -> Tuple[int, int]:
+        depth, node = 0, 0
+        for part in reversed(path.split(os.sep)):
+            child = self.children.get((node, part))
+            if child is None:
+                break
+            depth, node = depth + 1, child
+        return depth, node
+
+    def longest_suffix_match(self, path: str) -> Optional[str]:
+        """The file sharing the most trailing path components with `path`,
+        preferring the shortest one; None if no file has its basename."""
+        depth, node = self.__deepest(path)
+        if depth == 0:
+            return None
+        return self.paths[self.best[node]]
+
+    def suffix_match(self, subpath: str) -> Optional[str]:
+        """The shortest file path that ends with all components of `subpath`."""
+        subpath = subpath.strip(os.sep)
+        depth, node = self.__deepest(subpath)
+        if depth == 0 or depth != len(subpath.split(os.sep)):
+            return None
+        return self.paths[self.best[node]]
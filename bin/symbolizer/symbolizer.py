@@ -2,15 +2,70 @@
 
 import argparse
 import concurrent.futures
-import glob
 import json
+import logging
+import os
 import subprocess
 import sys
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Any, List
+from typing import Any, List, Optional
 
 from addr_line_mapper import AddrLineMapper
+from coverage_cache import get_coverage_cache, raw_coverage_key
+from fuzzdb.raw_cov import PIE_BASE, read_raw_cov
+from source_index import SourceIndex, source_dirs
+from symbolizer_service import PRIORITY_SEED, Job, JobJournal
+
+
+# Timeout of the requests defer_until_ready symbolizes itself, the same as the
+# one of main().
+DEFERRED_TIMEOUT = 9 * 60 + 30
+
+
+class CoverageMapNotReady(Exception):
+    pass
+
+
+def coverage_map_ready(conf: Any) -> bool:
+    """Whether the build of the coverage map of the harness is over, which the
+    fuzzer signals by creating the `coverage_map_ready_path` marker, or the
+    `coverage_map_failed_path` one if the build failed."""
+    marker = conf.get("coverage_map_ready_path")
+    return not marker or os.path.exists(marker) or coverage_map_failed(conf)
+
+
+def coverage_map_failed(conf: Any) -> bool:
+    marker = conf.get("coverage_map_failed_path")
+    return bool(marker) and os.path.exists(marker)
+
+
+def report_failed_coverage_map(conf: Any) -> None:
+    if coverage_map_failed(conf):
+        logging.warning(
+            f"[symbolizer] The coverage map of {conf['harness_path']} failed to "
+            "build, coverage may be missing or partial"
+        )
+
+
+def defer_symbolization(conf: Any, input_file: str, raw_cov_file: str) -> bool:
+    """Leave the raw coverage to symbolizer_service.py instead of waiting for
+    the coverage map: it is journaled, and the service queues it once the map
+    is ready. The input stays without a `.cov` file until then.
+
+    Returns False if it was not deferred, as there is no journal or the map
+    became ready meanwhile; the caller then has to symbolize it."""
+    journal_path = conf.get("symbolizer_journal_path")
+    if not journal_path:
+        return False
+    journal = JobJournal(journal_path)
+    jobs = [Job(PRIORITY_SEED, input_file, raw_cov_file, raw_cov_file + ".cov")]
+    journal.add(jobs)
+    if coverage_map_ready(conf):
+        # The service may have collected the journal before the job was added.
+        journal.remove(jobs)
+        return False
+    return True
 
 
 class Symbolizer(ABC):
@@ -24,49 +79,62 @@ class BinSymbolizer(Symbolizer):
         self.conf = conf
         self.harness: str = self.conf["harness_path"]
         self.redis_url = conf["redis_url"]
-        self.addr_line_mapper = AddrLineMapper(self.harness, self.redis_url)
+        self.coverage_map_path = conf.get("coverage_map_path")
+        # Loaded on first use, as fuzzing starts before the map is built.
+        self.addr_line_mapper: Optional[AddrLineMapper] = None
+        self.coverage_cache = get_coverage_cache(conf)
 
     def symbolize(self, cov_path: str, output_path: str):
         covs = {}
-        with open(cov_path, "rb") as f:
-            addrs: List[int] = []
-            while True:
-                data = f.read(8)
-                if not data:
-                    break
-                addr = int.from_bytes(data, byteorder="little") - 0x555555554000
-                addrs.append(addr)
-
-            line_infos = self.addr_line_mapper.translate(addrs)
-            for line_info in line_infos:
-                func_name = line_info.function_name
-                src_name = line_info.src_file
-                src_line = line_info.line_number
-
-                if func_name not in covs:
-                    covs[func_name] = {"src": src_name, "lines": [src_line]}
-                else:
-                    if src_line not in covs[func_name]["lines"]:
-                        covs[func_name]["lines"].append(src_line)
+        addrs = read_raw_cov(cov_path, base=PIE_BASE)
+        if self.addr_line_mapper is None:
+            if not coverage_map_ready(self.conf):
+                raise CoverageMapNotReady()
+            report_failed_coverage_map(self.conf)
+            self.addr_line_mapper = AddrLineMapper(
+                self.harness, self.redis_url, self.coverage_map_path
+            )
+        key = None
+        # Without a map every input maps to nothing, which must not be cached.
+        if self.coverage_cache and self.addr_line_mapper.map_id is not None:
+            key = raw_coverage_key(self.harness, self.addr_line_mapper.map_id, addrs)
+            if self.coverage_cache.fetch(key, output_path):
+                return
+        line_infos = self.addr_line_mapper.translate(addrs)
+        for line_info in line_infos:
+            func_name = line_info.function_name
+            src_name = line_info.src_file
+            src_line = line_info.line_number
+
+            if func_name not in covs:
+                covs[func_name] = {"src": src_name, "lines": [src_line]}
+            else:
+                if src_line not in covs[func_name]["lines"]:
+                    covs[func_name]["lines"].append(src_line)
 
         for func_name, data in covs.items():
             data["lines"].sort()
 
+        # The old output may be linked to a cache entry.
+        Path(output_path).unlink(missing_ok=True)
         with open(output_path, "wt") as f:
             f.write(json.dumps(covs))
+        if key is not None:
+            self.coverage_cache.store(key, output_path)
 
 
 class JvmSymbolizer(Symbolizer):
     def __init__(self, conf: Any):
+        self.conf = conf
         self.harness = conf["harness_path"].split("/")[-1]
         self.redis_url = conf["redis_url"]
         self.adjust_cache = {}
         self.bases = ["/src/"]
-        self.dirs_in_src = []
-        for path in glob.glob("/src/*"):
-            if path != "/src/src" and Path(path).is_dir():
-                self.dirs_in_src.append(path)
-        self.proc = self.__run_symbolizer()
+        # Loaded on the first path that needs them; main.py stores them
+        # before the executors start.
+        self.source_indexes: Optional[List[SourceIndex]] = None
+        # Started on first use, once the coverage map is in Redis.
+        self.proc: Optional[subprocess.Popen] = None
 
     def __run_symbolizer(self):
         cmd = [
@@ -84,7 +152,12 @@ class JvmSymbolizer(Symbolizer):
         return process
 
     def __ensure_symbolizer(self):
-        if self.proc.poll() != None:
+        if self.proc == None:
+            if not coverage_map_ready(self.conf):
+                raise CoverageMapNotReady()
+            report_failed_coverage_map(self.conf)
+            self.proc = self.__run_symbolizer()
+        elif self.proc.poll() != None:
             self.proc.wait()
             self.proc = self.__run_symbolizer()
 
@@ -125,15 +198,11 @@ class JvmSymbolizer(Symbolizer):
             tmp = Path(f"{base}/{subpath}")
             if tmp.exists():
                 return str(tmp)
-        for dir in self.dirs_in_src:
-            path = f"{dir}/{subpath}"
-            if Path(path).exists():
-                ret = [path]
-            else:
-                ret = glob.glob(f"{dir}/**/{subpath}", recursive=True)
-            if len(ret) > 0:
-                ret = ret[0]
-                self.bases.append(ret[: -len(subpath)])
+        if self.source_indexes is None:
+            self.source_indexes = [SourceIndex(dir) for dir in source_dirs()]
+        for source_index in self.source_indexes:
+            ret = source_index.suffix_match(subpath)
+            if ret is not None:
                 return ret
         return None
 
@@ -145,9 +214,36 @@ def get_symbolizer(conf: Any) -> Symbolizer:
     return JvmSymbolizer(conf)
 
 
+def defer_until_ready(conf: Any, symbolizer: Symbolizer) -> None:
+    """Answer requests by deferring them to symbolizer_service.py (see
+    defer_symbolization) until the coverage map is ready, rather than
+    holding the executor back.
+
+    This departs from the protocol of main(): DONE is replied without a
+    `.cov` file, which the service writes later, as for the seeds it replies
+    QUEUED to. UniAFL reads a missing `.cov` as coverage not known yet.
+    Without a journal, nothing is deferred."""
+    if not conf.get("symbolizer_journal_path"):
+        return
+    while not coverage_map_ready(conf):
+        input_file = input()
+        cov_path = input()
+        output_path = cov_path + ".cov"
+        if not defer_symbolization(conf, input_file, cov_path):
+            with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+                future = executor.submit(symbolizer.symbolize, cov_path, output_path)
+                try:
+                    future.result(timeout=DEFERRED_TIMEOUT)
+                except Exception:
+                    with open(output_path, "wt") as f:
+                        f.write(json.dumps({}))
+        print("DONE", flush=True)
+
+
 def main(conf_file: str) -> int:
     conf = json.loads(Path(conf_file).read_text())
     symbolizer = get_symbolizer(conf)
+    defer_until_ready(conf, symbolizer)
     """
     DO NOT TOUCH THIS LOGIC.
     """
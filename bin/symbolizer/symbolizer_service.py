@@ -0,0 +1,546 @@
+#!/usr/bin/env python3
+
+import argparse
+import heapq
+import itertools
+import json
+import logging
+import os
+import select
+import signal
+import socketserver
+import sqlite3
+import subprocess
+import threading
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import List, Optional, Set, Tuple
+
+from utils import is_running_under_pytest
+
+# Lower is more urgent.
+PRIORITY_POV = 0
+PRIORITY_SEED = 1
+
+REPLY_QUEUED = b"QUEUED\n"
+REPLY_DONE = b"DONE\n"
+
+# Understood by harness_coverage_runner.py (see read_jobs there).
+BATCH_COMMAND = "BATCH"
+
+DEFAULT_QUEUE_SIZE = 1024
+DEFAULT_BATCH_SIZE = 16
+DEFAULT_TIMEOUT = 60 * 60
+DEFAULT_CPU_BUDGET = 1.0
+
+# Seconds between checks for the coverage map readiness marker.
+READY_POLL_INTERVAL = 1.0
+
+
+@dataclass
+class Job:
+    priority: int
+    input_file: str
+    raw_cov_file: str
+    output_file: str
+    done: threading.Event = field(default_factory=threading.Event)
+    journal_id: Optional[int] = None
+
+
+class JobJournal:
+    """Jobs that were queued but not symbolized yet, kept in a SQLite database
+    so that a restarted service resumes them instead of leaving their inputs
+    without a `.cov` file."""
+
+    def __init__(self, db_path: str) -> None:
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        self.__lock = threading.Lock()
+        self.__db = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.__db.execute("PRAGMA journal_mode=WAL")
+        self.__db.execute(
+            "CREATE TABLE IF NOT EXISTS jobs (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "priority INTEGER NOT NULL, input_file TEXT NOT NULL, "
+            "raw_cov_file TEXT NOT NULL)"
+        )
+        self.__db.commit()
+
+    def add(self, jobs: List[Job]) -> None:
+        try:
+            with self.__lock, self.__db:
+                for job in jobs:
+                    job.journal_id = self.__db.execute(
+                        "INSERT INTO jobs (priority, input_file, raw_cov_file) "
+                        "VALUES (?, ?, ?)",
+                        (job.priority, job.input_file, job.raw_cov_file),
+                    ).lastrowid
+        except sqlite3.Error as e:
+            logging.warning(f"[symbolizer_service] Failed to write {self.db_path}: {e}")
+            if is_running_under_pytest():
+                raise e
+
+    def remove(self, jobs: List[Job]) -> None:
+        try:
+            with self.__lock, self.__db:
+                self.__db.executemany(
+                    "DELETE FROM jobs WHERE id = ?",
+                    [(job.journal_id,) for job in jobs if job.journal_id is not None],
+                )
+        except sqlite3.Error as e:
+            logging.warning(f"[symbolizer_service] Failed to write {self.db_path}: {e}")
+            if is_running_under_pytest():
+                raise e
+
+    def pending(self) -> List[Job]:
+        with self.__lock:
+            rows = self.__db.execute(
+                "SELECT id, priority, input_file, raw_cov_file FROM jobs "
+                "ORDER BY priority, id"
+            ).fetchall()
+        jobs = []
+        for journal_id, priority, input_file, raw_cov_file in rows:
+            job = Job(priority, input_file, raw_cov_file, raw_cov_file + ".cov")
+            job.journal_id = journal_id
+            jobs.append(job)
+        return jobs
+
+
+class JobQueue:
+    """Priority queue shared by all workers of a harness. Once `max_size` jobs
+    are waiting, `put` blocks seed jobs until the workers catch up; POVs are
+    always admitted. With a `journal`, jobs are recorded as soon as they are
+    submitted and dropped from it once `done`, and pending ones are queued
+    again on start.
+
+    With a `ready_marker`, no job is handed out before that file or the
+    `failed_marker` exists, as the coverage map is still being built; until
+    then every job is admitted so that executors are not held back. Jobs that
+    executors journaled themselves in the meantime are queued once it
+    exists."""
+
+    def __init__(
+        self,
+        max_size: int = DEFAULT_QUEUE_SIZE,
+        journal: Optional[JobJournal] = None,
+        ready_marker: Optional[str] = None,
+        failed_marker: Optional[str] = None,
+    ) -> None:
+        self.max_size = max_size
+        self.journal = journal
+        self.ready_marker = ready_marker
+        self.failed_marker = failed_marker
+        self.__heap: List[Tuple[int, int, Job]] = []
+        self.__seq = itertools.count()
+        self.__cond = threading.Condition()
+        self.__closed = False
+        self.__ready = ready_marker is None
+        # Journal entries of this queue, as opposed to deferred ones.
+        self.__journaled: Set[int] = set()
+        if journal is not None:
+            for job in journal.pending():
+                self.__push(job)
+            if self.__heap:
+                logging.info(f"[symbolizer_service] Resuming {len(self.__heap)} jobs")
+
+    def __len__(self) -> int:
+        with self.__cond:
+            return len(self.__heap)
+
+    def __push(self, job: Job) -> None:
+        if job.journal_id is not None:
+            self.__journaled.add(job.journal_id)
+        heapq.heappush(self.__heap, (job.priority, next(self.__seq), job))
+
+    def put(self, jobs: List[Job]) -> None:
+        with self.__cond:
+            if self.journal is not None:
+                self.journal.add(jobs)
+                self.__journaled.update(
+                    job.journal_id for job in jobs if job.journal_id is not None
+                )
+            for job in jobs:
+                if job.priority != PRIORITY_POV:
+                    self.__cond.wait_for(
+                        lambda: len(self.__heap) < self.max_size
+                        or self.__closed
+                        or not self.__is_ready()
+                    )
+                heapq.heappush(self.__heap, (job.priority, next(self.__seq), job))
+                self.__cond.notify_all()
+
+    def get(self, max_jobs: int) -> List[Job]:
+        """Block until a job is available, then take up to `max_jobs` of the
+        most urgent priority. Returns [] once the queue is closed and empty."""
+        with self.__cond:
+            while not self.__closed and not (self.__heap and self.__is_ready()):
+                self.__cond.wait(None if self.__ready else READY_POLL_INTERVAL)
+            jobs: List[Job] = []
+            if not self.__is_ready():
+                # Closed early; the journal keeps the jobs for the next start.
+                return jobs
+            while self.__heap and len(jobs) < max_jobs:
+                if jobs and self.__heap[0][0] != jobs[0].priority:
+                    break
+                jobs.append(heapq.heappop(self.__heap)[2])
+            self.__cond.notify_all()
+            return jobs
+
+    def __is_ready(self) -> bool:
+        if self.__ready:
+            return True
+        if os.path.exists(self.ready_marker):
+            logging.info("[symbolizer_service] Coverage map is ready")
+        elif self.failed_marker and os.path.exists(self.failed_marker):
+            logging.warning(
+                "[symbolizer_service] Coverage map failed to build, "
+                "coverage may be missing or partial"
+            )
+        else:
+            return False
+        if self.journal is not None:
+            for job in self.journal.pending():
+                if job.journal_id not in self.__journaled:
+                    self.__push(job)
+        logging.info(f"[symbolizer_service] {len(self.__heap)} jobs queued")
+        self.__ready = True
+        return True
+
+    def done(self, jobs: List[Job]) -> None:
+        if self.journal is not None:
+            self.journal.remove(jobs)
+            with self.__cond:
+                self.__journaled.difference_update(job.journal_id for job in jobs)
+
+    def close(self) -> None:
+        with self.__cond:
+            self.__closed = True
+            self.__cond.notify_all()
+
+
+class SymbolizerWorker(threading.Thread):
+    """Feeds jobs from the queue to one symbolizer process, which speaks the
+    stdin protocol of symbolizer.py or harness_coverage_runner.py. A job whose
+    output is missing afterwards gets an empty coverage, like UniAFL does when
+    its own symbolizer fails.
+
+    With a `cpu_budget` below 1, the worker idles after each request so that it
+    is busy for at most that share of the time."""
+
+    def __init__(
+        self,
+        command: List[str],
+        queue: JobQueue,
+        batch_size: int,
+        timeout: float,
+        log_file: Optional[str] = None,
+        cpu_budget: float = DEFAULT_CPU_BUDGET,
+    ) -> None:
+        super().__init__(daemon=True)
+        self.command = command
+        self.queue = queue
+        self.batch_size = batch_size
+        self.timeout = timeout
+        self.log_file = log_file
+        self.cpu_budget = cpu_budget
+        self.proc: Optional[subprocess.Popen] = None
+
+    def run(self) -> None:
+        while True:
+            jobs = self.queue.get(self.batch_size)
+            if not jobs:
+                self.__stop()
+                return
+            for job in jobs:
+                Path(job.output_file).unlink(missing_ok=True)
+            start = time.monotonic()
+            try:
+                self.__request(jobs)
+            except Exception as e:
+                logging.warning(f"[symbolizer_service] {self.command[0]} failed: {e}")
+                self.__stop()
+            for job in jobs:
+                if not os.path.exists(job.output_file):
+                    with open(job.output_file, "wt") as f:
+                        f.write(json.dumps({}))
+            self.queue.done(jobs)
+            for job in jobs:
+                job.done.set()
+            if self.cpu_budget < 1:
+                busy = time.monotonic() - start
+                time.sleep(busy * (1 - self.cpu_budget) / self.cpu_budget)
+
+    def __start(self) -> subprocess.Popen:
+        if self.proc is None or self.proc.poll() is not None:
+            stderr = subprocess.DEVNULL
+            if self.log_file:
+                stderr = open(self.log_file, "ab")
+            self.proc = subprocess.Popen(
+                self.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=stderr,
+                start_new_session=True,
+            )
+            if self.log_file:
+                stderr.close()
+        return self.proc
+
+    def __stop(self) -> None:
+        if self.proc is None:
+            return
+        try:
+            os.killpg(self.proc.pid, signal.SIGKILL)
+        except OSError:
+            pass
+        self.proc.wait()
+        self.proc = None
+
+    def __request(self, jobs: List[Job]) -> None:
+        proc = self.__start()
+        request = ""
+        if len(jobs) > 1:
+            request += f"{BATCH_COMMAND} {len(jobs)}\n"
+        for job in jobs:
+            request += f"{job.input_file}\n{job.raw_cov_file}\n"
+        proc.stdin.write(request.encode())
+        proc.stdin.flush()
+
+        deadline = time.monotonic() + self.timeout
+        out = b""
+        fd = proc.stdout.fileno()
+        while b"DONE\n" not in out:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"no reply within {self.timeout}s")
+            ready, _, _ = select.select([fd], [], [], remaining)
+            if ready:
+                data = os.read(fd, 4096)
+                if not data:
+                    raise EOFError(f"exited with {proc.wait()}")
+                out += data
+
+
+class _RequestHandler(socketserver.StreamRequestHandler):
+    """A request is `<priority> <wait> <n>` followed by n pairs of input and
+    raw coverage paths, one per line. It is answered with QUEUED once all
+    jobs are queued, or with DONE once they are symbolized if `wait` is 1."""
+
+    def handle(self) -> None:
+        while True:
+            header = self.rfile.readline()
+            if not header:
+                return
+            try:
+                priority, wait, count = map(int, header.split())
+            except ValueError:
+                logging.warning(f"[symbolizer_service] Bad request: {header!r}")
+                return
+            jobs = []
+            for _ in range(count):
+                input_file = self.rfile.readline().decode().rstrip("\n")
+                raw_cov_file = self.rfile.readline().decode().rstrip("\n")
+                jobs.append(
+                    Job(priority, input_file, raw_cov_file, raw_cov_file + ".cov")
+                )
+            self.server.queue.put(jobs)
+            if wait:
+                for job in jobs:
+                    job.done.wait()
+            self.wfile.write(REPLY_DONE if wait else REPLY_QUEUED)
+            self.wfile.flush()
+
+
+class SymbolizerService(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """One pool of symbolizer processes per harness, shared by all executor
+    cores through a Unix socket."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        socket_path: str,
+        commands: List[List[str]],
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        queue_size: int = DEFAULT_QUEUE_SIZE,
+        timeout: float = DEFAULT_TIMEOUT,
+        log_dir: Optional[str] = None,
+        journal_path: Optional[str] = None,
+        cpu_budget: float = DEFAULT_CPU_BUDGET,
+        ready_marker: Optional[str] = None,
+        failed_marker: Optional[str] = None,
+    ) -> None:
+        self.socket_path = socket_path
+        self.queue = JobQueue(
+            queue_size,
+            JobJournal(journal_path) if journal_path else None,
+            ready_marker,
+            failed_marker,
+        )
+        self.workers = [
+            SymbolizerWorker(
+                command,
+                self.queue,
+                batch_size,
+                timeout,
+                os.path.join(log_dir, f"worker_{idx}.log") if log_dir else None,
+                cpu_budget,
+            )
+            for idx, command in enumerate(commands)
+        ]
+        Path(socket_path).unlink(missing_ok=True)
+        os.makedirs(os.path.dirname(os.path.abspath(socket_path)), exist_ok=True)
+        super().__init__(socket_path, _RequestHandler)
+        for worker in self.workers:
+            worker.start()
+
+    def server_close(self) -> None:
+        super().server_close()
+        self.queue.close()
+        for worker in self.workers:
+            worker.join()
+        Path(self.socket_path).unlink(missing_ok=True)
+
+
+def worker_commands(
+    config: str,
+    num_workers: int,
+    work_dir: str,
+    coverage_harness: Optional[str],
+    out_dir: str,
+    log_dir: Optional[str],
+) -> Tuple[List[List[str]], int]:
+    """The command of every worker, and how many jobs it takes per request.
+    Only harness_coverage_runner.py understands batches."""
+    if coverage_harness is None or not os.path.exists(coverage_harness):
+        return [["symbolizer.py", config] for _ in range(num_workers)], 1
+    commands = []
+    for idx in range(num_workers):
+        command = [
+            "harness_coverage_runner.py",
+            "--config",
+            config,
+            "--coverage_harness",
+            coverage_harness,
+            "--work_dir",
+            os.path.join(work_dir, f"worker_{idx}"),
+            "--out_dir",
+            out_dir,
+        ]
+        if log_dir:
+            command += ["--log_dir", log_dir]
+        commands.append(command)
+    return commands, DEFAULT_BATCH_SIZE
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+
+    parser = argparse.ArgumentParser(
+        description="Serve symbolization requests of every executor of a harness"
+    )
+    parser.add_argument(
+        "--config", type=str, required=True, help="Path to the config file (must have)"
+    )
+    parser.add_argument(
+        "--socket", type=str, required=True, help="Path to the Unix socket (must have)"
+    )
+    parser.add_argument(
+        "--work_dir",
+        type=str,
+        required=True,
+        help="Path to the work directory that only this process uses (must have)",
+    )
+    parser.add_argument(
+        "--workers", type=int, required=True, help="Number of symbolizers (must have)"
+    )
+    parser.add_argument(
+        "--coverage_harness",
+        type=str,
+        default=None,
+        help="Path to the coverage harness; symbolizer.py is used if it does not "
+        "exist (default: None)",
+    )
+    parser.add_argument(
+        "--out_dir",
+        default="/coverage-out",
+        help="Path to the out directory (default: /coverage-out)",
+    )
+    parser.add_argument(
+        "--queue_size",
+        type=int,
+        default=DEFAULT_QUEUE_SIZE,
+        help=f"Number of queued seeds before executors have to wait "
+        f"(default: {DEFAULT_QUEUE_SIZE})",
+    )
+    parser.add_argument(
+        "--timeout",
+        type=int,
+        default=DEFAULT_TIMEOUT,
+        help=f"Seconds a symbolizer may take per request (default: {DEFAULT_TIMEOUT})",
+    )
+    parser.add_argument(
+        "--log_dir",
+        type=str,
+        default=None,
+        help="Path to the log dir (default: None).",
+    )
+    parser.add_argument(
+        "--journal",
+        type=str,
+        default=None,
+        help="Path to the SQLite journal of pending jobs, resumed on restart "
+        "(default: None, jobs are only kept in memory)",
+    )
+    parser.add_argument(
+        "--cpu_budget",
+        type=float,
+        default=DEFAULT_CPU_BUDGET,
+        help=f"Share of the time each worker may spend symbolizing "
+        f"(default: {DEFAULT_CPU_BUDGET})",
+    )
+    parser.add_argument(
+        "--ready_marker",
+        type=str,
+        default=None,
+        help="Path to the file whose creation signals that the coverage map is "
+        "ready; jobs are only queued until then (default: None, always ready)",
+    )
+    parser.add_argument(
+        "--failed_marker",
+        type=str,
+        default=None,
+        help="Path to the file whose creation signals that the coverage map "
+        "failed to build; jobs are then symbolized with what there is "
+        "(default: None)",
+    )
+    args = parser.parse_args()
+    if not 0 < args.cpu_budget <= 1:
+        parser.error("--cpu_budget must be in (0, 1]")
+
+    if args.log_dir:
+        os.makedirs(args.log_dir, exist_ok=True)
+    commands, batch_size = worker_commands(
+        args.config,
+        args.workers,
+        args.work_dir,
+        args.coverage_harness,
+        args.out_dir,
+        args.log_dir,
+    )
+    with SymbolizerService(
+        args.socket,
+        commands,
+        batch_size=batch_size,
+        queue_size=args.queue_size,
+        timeout=args.timeout,
+        log_dir=args.log_dir,
+        journal_path=args.journal,
+        cpu_budget=args.cpu_budget,
+        ready_marker=args.ready_marker,
+        failed_marker=args.failed_marker,
+    ) as service:
+        logging.info(
+            f"[symbolizer_service] Serving {args.socket} with {len(commands)} workers"
+        )
+        service.serve_forever()
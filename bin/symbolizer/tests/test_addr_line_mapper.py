@@ -0,0 +1,97 @@
+import os
+import tempfile
+import time
+import unittest
+
+from symbolizer.addr_line_mapper import AddrLineMapper
+from symbolizer.cfg_dataclasses import LineInfo, Node
+from symbolizer.coverage_map import serialize_coverage_map
+
+BASE_ADDR = 0x10000
+FUNCTION_SIZE = 100
+REACHABLE_PER_NODE = 8
+
+
+def make_synthetic_map(num_pcs):
+    data = {}
+    for i in range(num_pcs):
+        addr = BASE_ADDR + i * 0x10
+        function_end = (i // FUNCTION_SIZE + 1) * FUNCTION_SIZE
+        reachable = {
+            BASE_ADDR + j * 0x10
+            for j in range(i + 1, min(i + 1 + REACHABLE_PER_NODE, function_end))
+        }
+        function_name = f"func_{i // FUNCTION_SIZE}"
+        data[addr] = Node(
+            addr=addr,
+            addrs={addr},
+            prevs=set(),
+            nexts=set(),
+            instrumented_addrs={addr},
+            lines={LineInfo(function_name, "/src/synthetic.c", 2 * i)},
+            reachable_instrumented_addrs=reachable,
+            addrs_reachable_without_any_instrumentation=set(),
+            lines_from_addrs_reachable_wo_instrumentation={
+                LineInfo(function_name, "/src/synthetic.c", 2 * i + 1)
+            },
+            fallback=False,
+        )
+    return data
+
+
+class TestAddrLineMapper(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def load_mapper(self, data):
+        coverage_map_path = os.path.join(self.tmp_dir.name, "coverage_map")
+        with open(coverage_map_path, "wb") as f:
+            f.write(serialize_coverage_map(data))
+        return AddrLineMapper(__file__, None, coverage_map_path)
+
+    def test_translate_matches_reference(self):
+        data = make_synthetic_map(3 * FUNCTION_SIZE)
+        mapper = self.load_mapper(data)
+        covered_sets = [
+            list(data),
+            list(data)[::7] + [0x0, -0x10],
+            [BASE_ADDR + (FUNCTION_SIZE - 1) * 0x10],
+        ]
+        for addrs in covered_sets:
+            expected = set()
+            for addr in addrs:
+                node = data.get(addr)
+                if node is None:
+                    continue
+                expected.update(node.lines)
+                if not node.reachable_instrumented_addrs & set(addrs):
+                    expected.update(node.lines_from_addrs_reachable_wo_instrumentation)
+            self.assertEqual(
+                {(line.src_file, line.line_number) for line in mapper.translate(addrs)},
+                {(line.src_file, line.line_number) for line in expected},
+            )
+
+    def test_translate_scales_linearly(self):
+        # A quadratic reachability check takes ~16x longer on 4x the input;
+        # linear translation stays close to 4x.
+        timings = {}
+        for num_pcs in [25_000, 100_000]:
+            mapper = self.load_mapper(make_synthetic_map(num_pcs))
+            addrs = [BASE_ADDR + i * 0x10 for i in range(num_pcs)]
+            best = float("inf")
+            for _ in range(3):
+                start = time.perf_counter()
+                line_infos = mapper.translate(addrs)
+                best = min(best, time.perf_counter() - start)
+            self.assertEqual(len(line_infos), num_pcs + num_pcs // FUNCTION_SIZE)
+            timings[num_pcs] = best
+            print(f"translate {num_pcs} PCs: {best * 1000:.1f} ms")
+
+        self.assertLess(timings[100_000], 8 * timings[25_000])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -2,13 +2,19 @@ import multiprocessing
 import os
 import shutil
 import subprocess
+import time
 import unittest
 from pathlib import Path
 
 import line_profiler
 
 from llvm_symbolizer import LLVMSymbolizer
-from symbolizer.cfg_analyzer import CFGAnalyzer
+from symbolizer.cfg_analyzer import (
+    SANCOV_MARKERS,
+    CFGAnalyzer,
+    CFGWorker,
+    iter_objdump_regions,
+)
 
 
 class TestCoverageTranslator(unittest.TestCase):
@@ -84,6 +90,63 @@ class TestCoverageTranslator(unittest.TestCase):
                     #     if function_cfg.name in ["ngx_hash_init"]:
                     #         function_cfg.print_graph(benchmark, harness)
 
+    def test_simplify_largest_functions(self):
+        test_dir = Path(__file__).parent.as_posix()
+        benchmark = "asc-nginx"
+        os.environ["CP_PROJ_PATH"] = os.path.join(
+            self.ossfuzz_repo_dir, "projects", "aixcc", "c", benchmark
+        )
+        os.environ["CP_SRC_PATH"] = os.path.join(self.workdir, benchmark)
+        llvm_symbolizer = os.path.join(
+            test_dir, "test_cases", benchmark, "llvm-symbolizer"
+        )
+        for harness in ["smtp_harness", "pov_harness", "mail_request_harness"]:
+            test_file = os.path.join(test_dir, "test_cases", benchmark, harness, harness)
+            regions = sorted(
+                iter_objdump_regions(test_file),
+                key=lambda region: region.count("\n"),
+                reverse=True,
+            )[:10]
+            worker = CFGWorker(test_file, llvm_symbolizer)
+            profiler = line_profiler.LineProfiler()
+            profiler.add_function(CFGWorker._CFGWorker__simplify_cfg)
+            profiler.enable()
+            start = time.perf_counter()
+            data = worker.create_data(regions)
+            elapsed = time.perf_counter() - start
+            profiler.disable()
+            print(
+                f"{benchmark} {harness}: {len(regions)} largest functions "
+                f"({sum(region.count(chr(10)) for region in regions)} instructions) "
+                f"analyzed in {elapsed:.2f}s"
+            )
+            profiler.print_stats()
+            self.assertFalse(any(node.fallback for node in data.values()))
+
+    def test_iter_objdump_regions(self):
+        test_dir = Path(__file__).parent.as_posix()
+        for _, test_benchmarks in self.harness_binaries.items():
+            for (benchmark, _), harnesses in test_benchmarks.items():
+                for harness in harnesses:
+                    test_file = os.path.join(
+                        test_dir, "test_cases", benchmark, harness, harness
+                    )
+                    output = subprocess.check_output(
+                        ["objdump", "-d", test_file], text=True
+                    )
+                    expected = [
+                        region.strip("\n")
+                        for region in output.split("\n\n")
+                        if any(marker in region for marker in SANCOV_MARKERS)
+                    ]
+                    regions = list(iter_objdump_regions(test_file))
+                    self.assertEqual(expected, regions)
+
+    def test_iter_objdump_regions_failure(self):
+        # A partial disassembly must not pass for a complete one.
+        with self.assertRaises(subprocess.CalledProcessError):
+            list(iter_objdump_regions(os.path.join(self.workdir, "missing")))
+
 
 if __name__ == "__main__":
     unittest.main()
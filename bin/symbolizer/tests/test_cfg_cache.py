@@ -0,0 +1,106 @@
+import tempfile
+import unittest
+
+from symbolizer.cfg_cache import (
+    CFGCache,
+    FunctionRegion,
+    decode_function_data,
+    encode_function_data,
+)
+from symbolizer.cfg_dataclasses import LineInfo, Node
+
+REGION = """0000000000001140 <foo>:
+    1140:\t80 05 f9 2e 00 00 01 \taddb   $0x1,0x2ef9(%rip)        # 4040 <__sancov_cntrs>
+    1147:\t85 ff                \ttest   %edi,%edi
+    1149:\t74 08                \tje     1153 <foo+0x13>
+    114b:\te8 e0 fe ff ff       \tcall   1030 <bar@plt>
+    1150:\tc3                   \tret"""
+
+# Same function linked 0x1000 bytes later with its counter at another offset.
+MOVED_REGION = """0000000000002140 <foo>:
+    2140:\t80 05 01 3f 00 00 01 \taddb   $0x1,0x3f01(%rip)        # 6048 <__sancov_cntrs+0x8>
+    2147:\t85 ff                \ttest   %edi,%edi
+    2149:\t74 08                \tje     2153 <foo+0x13>
+    214b:\te8 e0 ee ff ff       \tcall   1030 <bar@plt>
+    2150:\tc3                   \tret"""
+
+
+def line_table(function, offset=0):
+    return {
+        addr: LineInfo("foo", "/src/foo.c", 10 + i + offset)
+        for i, (addr, _) in enumerate(function.instructions)
+    }
+
+
+class TestCFGCache(unittest.TestCase):
+    def test_function_key_is_position_independent(self):
+        function = FunctionRegion.parse(REGION)
+        moved = FunctionRegion.parse(MOVED_REGION)
+        self.assertEqual((function.name, function.start), ("foo", 0x1140))
+        self.assertEqual(function.end, 0x1151)
+        self.assertEqual(
+            function.key(line_table(function)), moved.key(line_table(moved))
+        )
+
+        changed = FunctionRegion.parse(REGION.replace("je     1153", "jne    1153"))
+        self.assertNotEqual(
+            function.key(line_table(function)), changed.key(line_table(changed))
+        )
+        self.assertNotEqual(
+            function.key(line_table(function)), function.key(line_table(function, 1))
+        )
+
+    def test_function_data_round_trip(self):
+        node = Node(
+            addr=0x1140,
+            addrs={0x1140, 0x1147},
+            prevs=set(),
+            nexts=set(),
+            instrumented_addrs={0x1140},
+            lines={LineInfo("foo", "/src/foo.c", 10)},
+            reachable_instrumented_addrs={0x1153},
+            addrs_reachable_without_any_instrumentation=set(),
+            lines_from_addrs_reachable_wo_instrumentation={
+                LineInfo("foo", "/src/foo.c", 11)
+            },
+            fallback=False,
+        )
+        blob = encode_function_data({0x1140: node, 0x1149: node}, 0x1140)
+        data = decode_function_data(blob, 0x2140)
+
+        self.assertEqual(sorted(data), [0x2140, 0x2149])
+        self.assertIs(data[0x2140], data[0x2149])
+        moved = data[0x2140]
+        self.assertEqual(moved.reachable_instrumented_addrs, {0x2153})
+        self.assertEqual(
+            [(l.src_file, l.line_number) for l in moved.lines], [("/src/foo.c", 10)]
+        )
+        self.assertEqual(
+            [
+                (l.src_file, l.line_number)
+                for l in moved.lines_from_addrs_reachable_wo_instrumentation
+            ],
+            [("/src/foo.c", 11)],
+        )
+        self.assertFalse(moved.fallback)
+
+    def test_store(self):
+        with tempfile.TemporaryDirectory() as cache_dir:
+            cache = CFGCache(cache_dir)
+            fingerprint = "v1-build-id-abcd"
+            self.assertIsNone(cache.load_binary(fingerprint, "llvm_symbolizer"))
+            cache.store_binary(fingerprint, "llvm_symbolizer", b"coverage map")
+            self.assertEqual(
+                cache.load_binary(fingerprint, "llvm_symbolizer"), b"coverage map"
+            )
+            # Not served to a run with another symbolization backend.
+            self.assertIsNone(cache.load_binary(fingerprint, "other"))
+
+            keys = [f"{i:064x}" for i in range(1200)]
+            cache.put_functions((key, key.encode()) for key in keys[::2])
+            found = CFGCache(cache_dir).get_functions(keys)
+            self.assertEqual(found, {key: key.encode() for key in keys[::2]})
+
+
+if __name__ == "__main__":
+    unittest.main()
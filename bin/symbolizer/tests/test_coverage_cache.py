@@ -0,0 +1,86 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+
+from symbolizer.coverage_cache import CoverageCache, input_key, raw_coverage_key
+
+
+class TestCoverageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.cache_dir = os.path.join(self.tmp_dir.name, "cache")
+        self.binary = self.write("binary", "ELF")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "w") as f:
+            f.write(data)
+        return path
+
+    def read(self, path):
+        with open(path) as f:
+            return f.read()
+
+    def test_keys(self):
+        key = raw_coverage_key(self.binary, b"map", np.array([3, 1, 2]))
+        self.assertEqual(
+            key, raw_coverage_key(self.binary, b"map", np.array([1, 2, 3, 3]))
+        )
+        self.assertNotEqual(
+            key, raw_coverage_key(self.binary, b"map", np.array([1, 2]))
+        )
+        # So does a rebuilt coverage map.
+        self.assertNotEqual(
+            key, raw_coverage_key(self.binary, b"new_map", np.array([1, 2, 3]))
+        )
+
+        input_file = self.write("input", "AAAA")
+        key = input_key(self.binary, input_file)
+        self.assertEqual(key, input_key(self.binary, input_file))
+        # A rebuilt binary invalidates every key.
+        other_binary = self.write("other_binary", "ELF!")
+        self.assertNotEqual(key, input_key(other_binary, input_file))
+
+    def test_fetch_and_store(self):
+        cache = CoverageCache(self.cache_dir)
+        output = os.path.join(self.tmp_dir.name, "a.cov")
+        self.assertFalse(cache.fetch("k", output))
+        self.assertFalse(os.path.exists(output))
+
+        self.write("a.cov", '{"f": 1}')
+        cache.store("k", output)
+        other_output = os.path.join(self.tmp_dir.name, "b.cov")
+        self.assertTrue(CoverageCache(self.cache_dir).fetch("k", other_output))
+        self.assertEqual(self.read(other_output), '{"f": 1}')
+        self.assertEqual(os.stat(output).st_ino, os.stat(other_output).st_ino)
+
+    def test_modified_entry(self):
+        cache = CoverageCache(self.cache_dir)
+        output = self.write("a.cov", '{"f": 1}')
+        cache.store("k", output)
+        # Writing through a hard link changes the entry too.
+        with open(output, "w") as f:
+            f.write("{}")
+        self.assertFalse(cache.fetch("k", os.path.join(self.tmp_dir.name, "b.cov")))
+
+    def test_eviction(self):
+        cache = CoverageCache(self.cache_dir, max_bytes=20)
+        for name in ["a", "b"]:
+            cache.store(name, self.write(f"{name}.cov", "x" * 8))
+        output = os.path.join(self.tmp_dir.name, "out.cov")
+        self.assertTrue(cache.fetch("a", output))
+        cache.store("c", self.write("c.cov", "x" * 8))
+
+        # "b" was the least recently used one.
+        self.assertFalse(cache.fetch("b", output))
+        self.assertTrue(cache.fetch("a", output))
+        self.assertTrue(cache.fetch("c", output))
+
+
+if __name__ == "__main__":
+    unittest.main()
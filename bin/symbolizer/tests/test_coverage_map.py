@@ -0,0 +1,111 @@
+import os
+import tempfile
+import unittest
+
+from symbolizer.addr_line_mapper import AddrLineMapper
+from symbolizer.cfg_dataclasses import LineInfo, Node
+from symbolizer.coverage_map import CoverageMap, serialize_coverage_map
+
+
+def make_node(addr, instrumented_addrs, lines, reachable, lines_wo, fallback=False):
+    return Node(
+        addr=addr,
+        addrs={addr},
+        prevs=set(),
+        nexts=set(),
+        instrumented_addrs=set(instrumented_addrs),
+        lines=set(lines),
+        reachable_instrumented_addrs=set(reachable),
+        addrs_reachable_without_any_instrumentation=set(),
+        lines_from_addrs_reachable_wo_instrumentation=set(lines_wo),
+        fallback=fallback,
+    )
+
+
+def as_tuples(lines):
+    return {(line.function_name, line.src_file, line.line_number) for line in lines}
+
+
+class TestCoverageMap(unittest.TestCase):
+    def setUp(self):
+        foo_1 = LineInfo("foo", "/src/foo.c", 1)
+        foo_2 = LineInfo("foo", "/src/foo.c", 2)
+        bar_7 = LineInfo("bar(int)", "/src/bär.cc", 7)
+        shared = make_node(0x1010, [0x1010, 0x1018], [foo_1], [0x1030], [foo_2])
+        self.data = {
+            0x1010: shared,
+            0x1018: shared,
+            0x1030: make_node(0x1030, [0x1030], [foo_2], [], []),
+            0x2000: make_node(0x2000, [0x2000], [bar_7], [0x2000], [], True),
+        }
+
+    def test_round_trip(self):
+        coverage_map = CoverageMap(serialize_coverage_map(self.data))
+        self.assertEqual(len(coverage_map), len(self.data))
+
+        node_ids = coverage_map.lookup(list(self.data) + [0x0, 0x1011, 0x3000])
+        self.assertEqual(node_ids[0], node_ids[1])
+        self.assertEqual(list(node_ids[-3:]), [-1, -1, -1])
+        for node_id, node in zip(node_ids, self.data.values()):
+            self.assertEqual(
+                as_tuples(coverage_map.lines(node_id)), as_tuples(node.lines)
+            )
+            self.assertEqual(
+                as_tuples(
+                    coverage_map.lines_from_addrs_reachable_wo_instrumentation(node_id)
+                ),
+                as_tuples(node.lines_from_addrs_reachable_wo_instrumentation),
+            )
+            self.assertEqual(
+                set(coverage_map.reachable_instrumented_addrs(node_id).tolist()),
+                node.reachable_instrumented_addrs,
+            )
+            self.assertEqual(coverage_map.is_fallback(node_id), node.fallback)
+
+    def test_zero_copy_from_memoryview(self):
+        buf = memoryview(serialize_coverage_map(self.data))
+        coverage_map = CoverageMap(buf)
+        self.assertFalse(coverage_map.addrs.flags.owndata)
+        self.assertEqual(list(coverage_map.addrs), sorted(self.data))
+
+    def test_addr_line_mapper_from_file(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            coverage_map_path = os.path.join(tmp_dir, "coverage_map")
+            with open(coverage_map_path, "wb") as f:
+                f.write(serialize_coverage_map(self.data))
+
+            mapper = AddrLineMapper(__file__, None, coverage_map_path)
+            self.assertEqual(
+                as_tuples(mapper.translate([0x1018, 0x2000, 0x4000])),
+                {
+                    ("foo", "/src/foo.c", 1),
+                    ("foo", "/src/foo.c", 2),
+                    ("bar(int)", "/src/bär.cc", 7),
+                },
+            )
+            self.assertEqual(
+                as_tuples(mapper.translate([0x1010, 0x1030])),
+                {("foo", "/src/foo.c", 1), ("foo", "/src/foo.c", 2)},
+            )
+            del mapper
+
+            missing = AddrLineMapper(__file__, None, coverage_map_path + ".missing")
+            self.assertIsNone(missing.data)
+            self.assertEqual(missing.translate([0x1010]), set())
+
+    def test_empty(self):
+        coverage_map = CoverageMap(serialize_coverage_map({}))
+        self.assertEqual(len(coverage_map), 0)
+        self.assertEqual(list(coverage_map.lookup([0x1010])), [-1])
+
+    def test_rejects_unknown_format(self):
+        blob = bytearray(serialize_coverage_map(self.data))
+        with self.assertRaises(ValueError):
+            CoverageMap(b"\x80\x04pickle")
+        blob[8] += 1
+        with self.assertRaises(ValueError):
+            CoverageMap(bytes(blob))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import tempfile
+import time
+import unittest
+
+from symbolizer.line_function_index import (
+    LineFunctionIndex,
+    build_line_function_index,
+    from_intervals,
+    to_intervals,
+)
+
+FUNCTION_MAP = {1: "foo", 2: "foo", 3: "foo", 5: "bar", 6: "Baz::qux", 7: "bar"}
+
+
+def fake_mapper(src_file):
+    if src_file.endswith("broken.c"):
+        raise ValueError("cannot parse")
+    return {1: os.path.basename(src_file), 2: os.path.basename(src_file)}
+
+
+class TestLineFunctionIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.tmp_dir.name, "index", "lines.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data=""):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "wt") as f:
+            f.write(data)
+        return path
+
+    def test_intervals(self):
+        self.assertEqual(
+            to_intervals(FUNCTION_MAP),
+            [(1, 3, "foo"), (5, 5, "bar"), (6, 6, "Baz::qux"), (7, 7, "bar")],
+        )
+        self.assertEqual(from_intervals(to_intervals(FUNCTION_MAP)), FUNCTION_MAP)
+
+    def test_get_put(self):
+        src_file = self.write("a.c", "int foo;")
+        index = LineFunctionIndex(self.db_path)
+        self.assertIsNone(index.get(src_file))
+        index.put(src_file, FUNCTION_MAP)
+        self.assertEqual(LineFunctionIndex(self.db_path).get(src_file), FUNCTION_MAP)
+
+        # A modified source file invalidates its entry.
+        time.sleep(0.01)
+        self.write("a.c", "int foo, bar;")
+        self.assertIsNone(index.get(src_file))
+
+    def test_build(self):
+        src_files = [self.write(name) for name in ["a.c", "b.cc", "broken.c"]]
+        self.assertEqual(
+            build_line_function_index(self.db_path, src_files, 2, fake_mapper), 2
+        )
+        index = LineFunctionIndex(self.db_path)
+        self.assertEqual(index.get(src_files[1]), {1: "b.cc", 2: "b.cc"})
+        self.assertIsNone(index.get(src_files[2]))
+        # Up-to-date files are not indexed again.
+        self.assertEqual(
+            build_line_function_index(self.db_path, src_files, 2, fake_mapper), 0
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,118 @@
+import io
+import os
+import subprocess
+import tempfile
+import time
+import tracemalloc
+import unittest
+
+from symbolizer.llvm_cov import (
+    LLVM_COV_LCOV,
+    LLVM_COV_SHOW,
+    parse_lcov,
+    parse_show,
+    run_llvm_cov,
+)
+
+SHOW_OUTPUT = """/src/foo.c:
+3 4 7 
+
+/src/bar.c:
+
+
+/src/baz.h:
+10 """
+
+LCOV_OUTPUT = """SF:/src/foo.c
+DA:3,1
+DA:4,12
+DA:5,0
+DA:7,1
+BRDA:4,0,0,1
+LF:4
+LH:3
+end_of_record
+SF:/src/bar.c
+DA:1,0
+end_of_record
+SF:/src/baz.h
+DA:10,3
+end_of_record
+"""
+
+EXPECTED = {"/src/foo.c": [3, 4, 7], "/src/baz.h": [10]}
+
+
+def make_reports(num_files, lines_per_file):
+    show, lcov = [], []
+    for i in range(num_files):
+        src_file = f"/src/project/dir_{i % 50}/file_{i}.cc"
+        covered = range(1, lines_per_file + 1, 2)
+        show.append(f"{src_file}:\n{' '.join(map(str, covered))} ")
+        lcov.append(f"SF:{src_file}\n")
+        for line in range(1, lines_per_file + 1):
+            lcov.append(f"DA:{line},{line % 2}\n")
+        lcov.append("end_of_record\n")
+    return "\n\n".join(show), "".join(lcov)
+
+
+class TestLlvmCov(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "wt") as f:
+            f.write(data)
+        return path
+
+    def test_parse(self):
+        self.assertEqual(parse_show(SHOW_OUTPUT), EXPECTED)
+        self.assertEqual(parse_lcov(io.StringIO(LCOV_OUTPUT)), EXPECTED)
+        for block_size in [1, 7, 16]:
+            self.assertEqual(
+                parse_lcov(io.StringIO(LCOV_OUTPUT), block_size), EXPECTED
+            )
+
+    def test_run_llvm_cov(self):
+        show_path = self.write("show", SHOW_OUTPUT)
+        lcov_path = self.write("lcov", LCOV_OUTPUT)
+        cwd = self.tmp_dir.name
+        self.assertEqual(run_llvm_cov(["cat", show_path], cwd, LLVM_COV_SHOW), EXPECTED)
+        self.assertEqual(run_llvm_cov(["cat", lcov_path], cwd, LLVM_COV_LCOV), EXPECTED)
+        with self.assertRaises(subprocess.CalledProcessError):
+            run_llvm_cov(["false"], cwd, LLVM_COV_LCOV)
+
+    def test_benchmark_parse(self):
+        # A large C++ target: 2000 files of 1000 lines, half of them executed.
+        show, lcov = make_reports(2000, 1000)
+        show_path = self.write("show", show)
+        lcov_path = self.write("lcov", lcov)
+        del show, lcov
+        cwd = self.tmp_dir.name
+
+        def measure(path, export_format):
+            start = time.perf_counter()
+            covered = run_llvm_cov(["cat", path], cwd, export_format)
+            elapsed = time.perf_counter() - start
+            tracemalloc.start()
+            run_llvm_cov(["cat", path], cwd, export_format)
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            return covered, elapsed, peak
+
+        show_covered, show_time, show_peak = measure(show_path, LLVM_COV_SHOW)
+        lcov_covered, lcov_time, lcov_peak = measure(lcov_path, LLVM_COV_LCOV)
+        print(
+            f"show: {show_time:.2f}s peak {show_peak >> 20}MiB, "
+            f"lcov: {lcov_time:.2f}s peak {lcov_peak >> 20}MiB"
+        )
+        self.assertEqual(show_covered, lcov_covered)
+        self.assertLess(lcov_peak, show_peak)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -41,6 +41,26 @@ class TestLLVMSymbolizer(unittest.TestCase):
             if env_key in os.environ:
                 del os.environ[env_key]
 
+    def one_shot_replies(self, llvm_symbolizer, harness_file, addrs):
+        """The outermost frame of each address, from a single llvm-symbolizer
+        run that gets all addresses at once."""
+        output = subprocess.run(
+            [llvm_symbolizer, f"--obj={harness_file}", "--pretty-print"],
+            input="".join(f"{hex(addr)}\n" for addr in addrs),
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout
+        replies = []
+        for frame in output.rstrip("\n").split("\n\n"):
+            lines = frame.split("\n")
+            if "(inlined by)" in lines[-1]:
+                replies.append(lines[-1].split("(inlined by)")[1].strip())
+            else:
+                replies.append(lines[0])
+        self.assertEqual(len(replies), len(addrs))
+        return replies
+
     def test_run_llvm_symbolizer_addr(self):
         test_dir = Path(__file__).parent.as_posix()
         for language, test_benchmarks in self.harness_binaries.items():
@@ -116,6 +136,44 @@ class TestLLVMSymbolizer(unittest.TestCase):
                     )
                     profiler.print_stats()
 
+    def test_run_llvm_symbolizer_addrs_pipelined(self):
+        test_dir = Path(__file__).parent.as_posix()
+        for language, test_benchmarks in self.harness_binaries.items():
+            for (benchmark, _), harnesses in test_benchmarks.items():
+                repo_dir = os.path.join(self.workdir, benchmark)
+                os.environ["CP_PROJ_PATH"] = os.path.join(
+                    self.ossfuzz_repo_dir, "projects", "aixcc", language, benchmark
+                )
+                os.environ["CP_SRC_PATH"] = repo_dir
+                for harness in harnesses:
+                    harness_file = os.path.join(
+                        test_dir, "test_cases", benchmark, harness, harness
+                    )
+                    llvm_symbolizer = os.path.join(
+                        test_dir, "test_cases", benchmark, "llvm-symbolizer"
+                    )
+                    input_file = os.path.join(
+                        test_dir, "test_cases", benchmark, harness, f"{harness}.txt"
+                    )
+                    addrs = []
+                    with open(input_file, "rt") as f:
+                        addrs = [
+                            int(line.strip(), 16)
+                            for line in f.readlines()
+                            if line != "\n"
+                        ]
+                    expected = self.one_shot_replies(
+                        llvm_symbolizer, harness_file, addrs
+                    )
+                    llvm_symbolizer = LLVMSymbolizer(harness_file, llvm_symbolizer)
+                    self.assertEqual(
+                        expected, llvm_symbolizer._run_llvm_symbolizer_pipelined(addrs)
+                    )
+                    # The process is kept alive for further batches.
+                    self.assertEqual(
+                        expected, llvm_symbolizer._run_llvm_symbolizer_pipelined(addrs)
+                    )
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,149 @@
+import os
+import shutil
+import stat
+import tempfile
+import threading
+import unittest
+
+from symbolizer import llvm_symbolizer
+from symbolizer.llvm_symbolizer import PIPELINE_WINDOW, LLVMSymbolizer
+from symbolizer.llvm_symbolizer_pool import (
+    LLVMSymbolizerPool,
+    LLVMSymbolizerPoolClient,
+    LLVMSymbolizerServer,
+)
+
+# Replies like `llvm-symbolizer --pretty-print --print-address` and logs which
+# process was asked for which address. Address 666 hangs the process, 667
+# kills it and 668 gets the reply for another address. The first reply takes
+# FAKE_LLVM_SYMBOLIZER_STARTUP seconds, like loading the debug info.
+FAKE_LLVM_SYMBOLIZER = """#!/usr/bin/env python3
+import os, sys, time
+log = open(os.environ["FAKE_LLVM_SYMBOLIZER_LOG"], "a")
+startup = float(os.environ.get("FAKE_LLVM_SYMBOLIZER_STARTUP", "0"))
+for line in sys.stdin:
+    time.sleep(startup)
+    startup = 0
+    addr = int(line, 16)
+    log.write(f"{os.getpid()} {addr}\\n")
+    log.flush()
+    if addr == 666:
+        time.sleep(60)
+    if addr == 667:
+        sys.exit(1)
+    if addr == 668:
+        addr = 1
+    print(f"0x{addr:X}: func_{addr} at /src/file.c:{addr}\\n", flush=True)
+"""
+
+
+def reply(addr):
+    return f"func_{addr} at /src/file.c:{addr}"
+
+
+class TestLLVMSymbolizerPipeline(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.llvm_symbolizer = os.path.join(self.tmp_dir.name, "llvm-symbolizer")
+        with open(self.llvm_symbolizer, "w") as f:
+            f.write(FAKE_LLVM_SYMBOLIZER)
+        os.chmod(self.llvm_symbolizer, stat.S_IRWXU)
+        self.log = os.path.join(self.tmp_dir.name, "log")
+        os.environ["FAKE_LLVM_SYMBOLIZER_LOG"] = self.log
+        self.harness = shutil.which("true")
+
+    def tearDown(self):
+        del os.environ["FAKE_LLVM_SYMBOLIZER_LOG"]
+        os.environ.pop("FAKE_LLVM_SYMBOLIZER_STARTUP", None)
+        self.tmp_dir.cleanup()
+
+    def set_timeouts(self, request_timeout, startup_timeout):
+        for name, value in [
+            ("REQUEST_TIMEOUT", request_timeout),
+            ("STARTUP_TIMEOUT", startup_timeout),
+        ]:
+            default = getattr(llvm_symbolizer, name)
+            self.addCleanup(setattr, llvm_symbolizer, name, default)
+            setattr(llvm_symbolizer, name, value)
+
+    def requests(self):
+        if not os.path.exists(self.log):
+            return []
+        with open(self.log) as f:
+            return [tuple(map(int, line.split())) for line in f]
+
+    def test_replies_in_order(self):
+        symbolizer = LLVMSymbolizer(self.harness, self.llvm_symbolizer)
+        addrs = list(range(1, 2 * PIPELINE_WINDOW + 10))
+        self.assertEqual(
+            symbolizer._run_llvm_symbolizer_pipelined(addrs),
+            [reply(addr) for addr in addrs],
+        )
+        # One long-lived process answers every address.
+        self.assertEqual(len({pid for pid, _ in self.requests()}), 1)
+
+    def test_slow_startup(self):
+        self.set_timeouts(0.2, 5)
+        os.environ["FAKE_LLVM_SYMBOLIZER_STARTUP"] = "1"
+        symbolizer = LLVMSymbolizer(self.harness, self.llvm_symbolizer)
+        self.assertEqual(
+            symbolizer._run_llvm_symbolizer_pipelined([1, 2, 3]),
+            [reply(1), reply(2), reply(3)],
+        )
+        self.assertEqual(len(self.requests()), 3)
+
+    def test_failing_address(self):
+        self.set_timeouts(0.5, 1)
+        symbolizer = LLVMSymbolizer(self.harness, self.llvm_symbolizer)
+        for bad in [666, 667, 668]:
+            with self.subTest(bad=bad):
+                num_requests = len(self.requests())
+                self.assertEqual(
+                    symbolizer._run_llvm_symbolizer_pipelined([10, 11, bad, 12, 13]),
+                    [reply(10), reply(11), None, reply(12), reply(13)],
+                )
+                requests = self.requests()[num_requests:]
+                attempts = [addr for _, addr in requests].count(bad)
+                self.assertEqual(attempts, llvm_symbolizer.MAX_ATTEMPTS)
+
+    def test_pool(self):
+        pool = LLVMSymbolizerPool(self.harness, self.llvm_symbolizer, 2)
+        self.addCleanup(pool.close)
+        addrs = list(range(1000, 1000 + 4 * PIPELINE_WINDOW))
+        self.assertEqual(pool.symbolize(addrs), [reply(addr) for addr in addrs])
+        # The batch was split over both processes.
+        self.assertEqual(len({pid for pid, _ in self.requests()}), 2)
+
+        num_requests = len(self.requests())
+        repeated = [addrs[2], addrs[1], addrs[2], addrs[0]]
+        self.assertEqual(pool.symbolize(repeated), [reply(addr) for addr in repeated])
+        self.assertEqual(len(self.requests()), num_requests)
+
+    def test_server(self):
+        socket_path = os.path.join(self.tmp_dir.name, "pool.sock")
+        server = LLVMSymbolizerServer(
+            socket_path, LLVMSymbolizerPool(self.harness, self.llvm_symbolizer, 2)
+        )
+        thread = threading.Thread(target=server.serve_forever, daemon=True)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.set_timeouts(0.5, 1)
+        clients = [LLVMSymbolizerPoolClient(socket_path) for _ in range(2)]
+        for client in clients:
+            self.addCleanup(client.close)
+            symbolizer = LLVMSymbolizer(self.harness, self.llvm_symbolizer, pool=client)
+            self.assertEqual(
+                symbolizer._run_llvm_symbolizer_pipelined([1, 667, 2]),
+                [reply(1), None, reply(2)],
+            )
+        # The second client was answered from the cache of the first one.
+        addrs = [addr for _, addr in self.requests()]
+        self.assertEqual(addrs.count(1), 1)
+        self.assertEqual(addrs.count(667), llvm_symbolizer.MAX_ATTEMPTS)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import os
+import struct
+import tempfile
+import unittest
+
+from fuzzdb.raw_cov import (
+    PIE_BASE,
+    RAW_COV_V1,
+    iter_raw_cov,
+    read_raw_cov,
+)
+
+
+class TestRawCov(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.pcs = [PIE_BASE + 0x1234, PIE_BASE + 0x10, 0x400000]
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def write(self, name, data):
+        path = os.path.join(self.tmp_dir.name, name)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_read_rebased(self):
+        path = self.write("cov", struct.pack(f"<{len(self.pcs)}Q", *self.pcs))
+        self.assertEqual(read_raw_cov(path).tolist(), self.pcs)
+        self.assertEqual(
+            read_raw_cov(path, base=PIE_BASE).tolist(),
+            [pc - PIE_BASE for pc in self.pcs],
+        )
+
+    def test_versioned_record_width(self):
+        path = self.write("cov", struct.pack("<3I", 1, 2, 3))
+        self.assertEqual(read_raw_cov(path, version=RAW_COV_V1).tolist(), [1, 2, 3])
+        with self.assertRaises(ValueError):
+            read_raw_cov(path, version=99)
+
+    def test_chunked_and_truncated(self):
+        pcs = list(range(PIE_BASE, PIE_BASE + 1000))
+        path = self.write("cov", struct.pack("<1000Q", *pcs) + b"\x01\x02\x03")
+        chunks = list(iter_raw_cov(path, chunk_records=300))
+        self.assertEqual([len(chunk) for chunk in chunks], [300, 300, 300, 100])
+        self.assertEqual(read_raw_cov(path, chunk_records=300).tolist(), pcs)
+
+    def test_empty(self):
+        path = self.write("cov", b"")
+        self.assertEqual(read_raw_cov(path).tolist(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+import os
+import tempfile
+import unittest
+
+from symbolizer.source_index import SourceIndex
+
+
+class TestSourceIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.root = os.path.join(self.tmp_dir.name, "src")
+        self.index_dir = os.path.join(self.tmp_dir.name, "index")
+        for relative_path in [
+            "project/lib/a/util.c",
+            "project/lib/b/util.c",
+            "project/util.c",
+            "project/include/util.h",
+            "third_party/x/include/util.h",
+            "java/com/example/Foo.java",
+        ]:
+            self.create(relative_path)
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def create(self, relative_path):
+        path = os.path.join(self.root, relative_path)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        open(path, "w").close()
+        return path
+
+    def path(self, relative_path):
+        return os.path.join(self.root, relative_path)
+
+    def test_longest_suffix_match(self):
+        index = SourceIndex(self.root, self.index_dir)
+        self.assertEqual(
+            index.longest_suffix_match("/build/lib/b/util.c"),
+            self.path("project/lib/b/util.c"),
+        )
+        # The shortest candidate wins when nothing but the basename matches.
+        self.assertEqual(
+            index.longest_suffix_match("/build/other/util.c"),
+            self.path("project/util.c"),
+        )
+        self.assertEqual(
+            index.longest_suffix_match("/build/x/include/util.h"),
+            self.path("third_party/x/include/util.h"),
+        )
+        self.assertIsNone(index.longest_suffix_match("/build/missing.c"))
+
+    def test_suffix_match(self):
+        index = SourceIndex(self.root, self.index_dir)
+        self.assertEqual(
+            index.suffix_match("com/example/Foo.java"),
+            self.path("java/com/example/Foo.java"),
+        )
+        self.assertIsNone(index.suffix_match("org/example/Foo.java"))
+
+    def age(self):
+        # An index of a tree modified in the last second is not stored.
+        for root, _, _ in os.walk(self.root):
+            os.utime(root, ns=(0, os.stat(root).st_mtime_ns - 10**10))
+
+    def test_reuse_and_invalidate(self):
+        self.age()
+        SourceIndex(self.root, self.index_dir)
+        (index_file,) = os.listdir(self.index_dir)
+        index_path = os.path.join(self.index_dir, index_file)
+        index_ino = os.stat(index_path).st_ino
+
+        # Reused while nothing changed...
+        SourceIndex(self.root, self.index_dir)
+        self.assertEqual(os.stat(index_path).st_ino, index_ino)
+
+        # ...and rebuilt once a file shows up deep in the tree.
+        self.create("project/lib/a/new.c")
+        self.assertEqual(
+            SourceIndex(self.root, self.index_dir).longest_suffix_match("/x/a/new.c"),
+            self.path("project/lib/a/new.c"),
+        )
+
+    def test_recent_tree_not_stored(self):
+        SourceIndex(self.root, self.index_dir)
+        self.assertFalse(os.path.exists(self.index_dir) and os.listdir(self.index_dir))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,244 @@
+import json
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import unittest
+
+from symbolizer.symbolizer_service import (
+    PRIORITY_POV,
+    PRIORITY_SEED,
+    Job,
+    JobJournal,
+    JobQueue,
+    SymbolizerService,
+)
+from symbolizer.symbolizer import defer_symbolization
+
+# Answers the stdin protocol of harness_coverage_runner.py by writing the
+# input path into each output.
+FAKE_SYMBOLIZER = """
+import json, os, sys
+while True:
+    line = sys.stdin.readline().rstrip("\\n")
+    if not line:
+        break
+    if line.startswith("BATCH "):
+        pairs = [(sys.stdin.readline(), sys.stdin.readline()) for _ in range(int(line[6:]))]
+    else:
+        pairs = [(line, sys.stdin.readline())]
+    for input_file, raw_cov_file in pairs:
+        output_file = raw_cov_file.strip() + ".cov"
+        with open(output_file + ".tmp", "w") as f:
+            json.dump({"input": input_file.strip(), "batch": len(pairs)}, f)
+        os.replace(output_file + ".tmp", output_file)
+    print("DONE", flush=True)
+"""
+
+HANGING_SYMBOLIZER = "import time; time.sleep(60)"
+
+
+def job(priority, name):
+    return Job(priority, name, name, name + ".cov")
+
+
+class TestJobQueue(unittest.TestCase):
+    def test_priority_order(self):
+        queue = JobQueue(max_size=8)
+        queue.put([job(PRIORITY_SEED, "seed_0"), job(PRIORITY_SEED, "seed_1")])
+        queue.put([job(PRIORITY_POV, "pov_0")])
+        queue.put([job(PRIORITY_SEED, "seed_2")])
+
+        self.assertEqual([j.input_file for j in queue.get(4)], ["pov_0"])
+        self.assertEqual([j.input_file for j in queue.get(2)], ["seed_0", "seed_1"])
+        self.assertEqual([j.input_file for j in queue.get(2)], ["seed_2"])
+
+    def test_backpressure(self):
+        queue = JobQueue(max_size=2)
+        queue.put([job(PRIORITY_SEED, "seed_0"), job(PRIORITY_SEED, "seed_1")])
+        # POVs are never held back.
+        queue.put([job(PRIORITY_POV, "pov_0")])
+        self.assertEqual(len(queue), 3)
+
+        blocked = threading.Thread(
+            target=queue.put, args=([job(PRIORITY_SEED, "seed_2")],)
+        )
+        blocked.start()
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+
+        self.assertEqual([j.input_file for j in queue.get(4)], ["pov_0"])
+        blocked.join(0.2)
+        self.assertTrue(blocked.is_alive())
+
+        self.assertEqual([j.input_file for j in queue.get(1)], ["seed_0"])
+        blocked.join(5)
+        self.assertFalse(blocked.is_alive())
+        self.assertEqual(len(queue), 2)
+
+    def test_close(self):
+        queue = JobQueue()
+        queue.close()
+        self.assertEqual(queue.get(4), [])
+
+    def test_ready_marker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            marker = os.path.join(tmp_dir, "coverage_map.ready")
+            queue = JobQueue(max_size=1, ready_marker=marker)
+            # Nothing is held back before the coverage map is ready.
+            queue.put([job(PRIORITY_SEED, f"seed_{i}") for i in range(3)])
+            self.assertEqual(len(queue), 3)
+
+            got = []
+            getter = threading.Thread(target=lambda: got.append(queue.get(4)))
+            getter.start()
+            getter.join(0.5)
+            self.assertTrue(getter.is_alive())
+
+            open(marker, "w").close()
+            getter.join(5)
+            self.assertFalse(getter.is_alive())
+            self.assertEqual(
+                [j.input_file for j in got[0]], ["seed_0", "seed_1", "seed_2"]
+            )
+
+    def test_failed_marker(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            queue = JobQueue(
+                ready_marker=os.path.join(tmp_dir, "coverage_map.ready"),
+                failed_marker=os.path.join(tmp_dir, "coverage_map.failed"),
+            )
+            queue.put([job(PRIORITY_SEED, "seed_0")])
+            # A failed build also releases the jobs.
+            open(os.path.join(tmp_dir, "coverage_map.failed"), "w").close()
+            self.assertEqual([j.input_file for j in queue.get(4)], ["seed_0"])
+
+    def test_close_before_ready(self):
+        queue = JobQueue(ready_marker="/nonexistent/coverage_map.ready")
+        queue.put([job(PRIORITY_SEED, "seed_0")])
+        queue.close()
+        self.assertEqual(queue.get(4), [])
+
+
+class TestJobJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.journal_path = os.path.join(self.tmp_dir.name, "journal.db")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_resume(self):
+        queue = JobQueue(journal=JobJournal(self.journal_path))
+        queue.put([job(PRIORITY_SEED, "seed_0"), job(PRIORITY_SEED, "seed_1")])
+        queue.put([job(PRIORITY_POV, "pov_0")])
+        queue.done(queue.get(1))
+
+        # A new queue picks up what the old one did not finish.
+        queue = JobQueue(journal=JobJournal(self.journal_path))
+        self.assertEqual(len(queue), 2)
+        jobs = queue.get(4)
+        self.assertEqual([j.input_file for j in jobs], ["seed_0", "seed_1"])
+        self.assertEqual(jobs[0].output_file, "seed_0.cov")
+        queue.done(jobs)
+
+        self.assertEqual(JobJournal(self.journal_path).pending(), [])
+
+    def test_deferred_until_ready(self):
+        marker = os.path.join(self.tmp_dir.name, "coverage_map.ready")
+        queue = JobQueue(journal=JobJournal(self.journal_path), ready_marker=marker)
+        queue.put([job(PRIORITY_SEED, "seed_0")])
+        # Journaled by an executor that could not reach the service.
+        JobJournal(self.journal_path).add([job(PRIORITY_SEED, "seed_1")])
+
+        open(marker, "w").close()
+        jobs = queue.get(4)
+        self.assertEqual([j.input_file for j in jobs], ["seed_0", "seed_1"])
+        queue.done(jobs)
+        self.assertEqual(JobJournal(self.journal_path).pending(), [])
+
+    def test_defer_symbolization(self):
+        marker = os.path.join(self.tmp_dir.name, "coverage_map.ready")
+        conf = {
+            "coverage_map_ready_path": marker,
+            "symbolizer_journal_path": self.journal_path,
+        }
+        self.assertTrue(defer_symbolization(conf, "seed_0", "seed_0.raw_cov"))
+        self.assertEqual(
+            [j.input_file for j in JobJournal(self.journal_path).pending()],
+            ["seed_0"],
+        )
+        # Once the map is ready, the service may not look at the journal again.
+        open(marker, "w").close()
+        self.assertFalse(defer_symbolization(conf, "seed_1", "seed_1.raw_cov"))
+        self.assertEqual(
+            [j.input_file for j in JobJournal(self.journal_path).pending()],
+            ["seed_0"],
+        )
+
+
+class TestSymbolizerService(unittest.TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        self.socket_path = os.path.join(self.tmp_dir.name, "symbolizer.sock")
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def serve(self, commands, **kwargs):
+        service = SymbolizerService(self.socket_path, commands, **kwargs)
+        thread = threading.Thread(target=service.serve_forever, daemon=True)
+        thread.start()
+
+        def stop():
+            service.shutdown()
+            service.server_close()
+            thread.join()
+
+        self.addCleanup(stop)
+        return service
+
+    def request(self, conn, priority, wait, names):
+        request = f"{priority} {wait} {len(names)}\n"
+        for name in names:
+            request += f"input_{name}\n{os.path.join(self.tmp_dir.name, name)}\n"
+        conn.sendall(request.encode())
+        return conn.makefile("rb").readline()
+
+    def read_output(self, name):
+        with open(os.path.join(self.tmp_dir.name, name + ".cov")) as f:
+            return json.load(f)
+
+    def test_wait_and_queue(self):
+        self.serve([[sys.executable, "-c", FAKE_SYMBOLIZER]] * 2, batch_size=4)
+        with socket.socket(socket.AF_UNIX) as conn:
+            conn.connect(self.socket_path)
+            self.assertEqual(self.request(conn, PRIORITY_POV, 1, ["a"]), b"DONE\n")
+            self.assertEqual(self.read_output("a"), {"input": "input_a", "batch": 1})
+
+            names = [f"seed_{i}" for i in range(10)]
+            self.assertEqual(self.request(conn, PRIORITY_SEED, 0, names), b"QUEUED\n")
+            deadline = time.monotonic() + 10
+            while not all(
+                os.path.exists(os.path.join(self.tmp_dir.name, f"{name}.cov"))
+                for name in names
+            ):
+                self.assertLess(time.monotonic(), deadline)
+                time.sleep(0.05)
+        for name in names:
+            output = self.read_output(name)
+            self.assertEqual(output["input"], f"input_{name}")
+            self.assertLessEqual(output["batch"], 4)
+
+    def test_timeout(self):
+        self.serve([[sys.executable, "-c", HANGING_SYMBOLIZER]], timeout=0.5)
+        with socket.socket(socket.AF_UNIX) as conn:
+            conn.connect(self.socket_path)
+            self.assertEqual(self.request(conn, PRIORITY_POV, 1, ["a"]), b"DONE\n")
+        self.assertEqual(self.read_output("a"), {})
+
+
+if __name__ == "__main__":
+    unittest.main()
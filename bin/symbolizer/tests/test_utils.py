@@ -1,3 +1,4 @@
+import json
 import os
 import shutil
 import unittest
@@ -9,6 +10,7 @@ import clang.cindex
 clang.cindex.Config.set_library_file("/usr/lib/llvm-18/lib/libclang.so")
 
 from symbolizer.utils import (
+    extract_clang_args,
     get_new_file_path,
     is_running_under_pytest,
     map_lines_to_functions,
@@ -55,6 +57,46 @@ class TestUtils(unittest.TestCase):
             )
             self.assertEqual(result, test_case["expected"])
 
+    def test_extract_clang_args(self):
+        compile_commands = [
+            {
+                "directory": "/src/project/build",
+                "file": "../module_a/submodule_a/source.c",
+                "arguments": ["clang", "-I../module_a/include", "-I/usr/include/x"],
+            },
+            {
+                "directory": "/src/project",
+                "file": "module_b/submodule_b/source.c",
+                "arguments": ["clang", "-Imodule_b/include"],
+            },
+        ]
+        compile_commands_path = os.path.join(
+            self.test_directory_root, "compile_commands.json"
+        )
+        with open(compile_commands_path, "w") as f:
+            json.dump(compile_commands, f)
+
+        src_file = os.path.join(
+            self.test_directory_root, "module_a/submodule_a/source.c"
+        )
+        self.assertEqual(
+            extract_clang_args(src_file, compile_commands_path),
+            [
+                f"-I{self.test_directory_root}/module_a/include",
+                "-I/usr/include/x",
+            ],
+        )
+        src_file = os.path.join(
+            self.test_directory_root, "module_b/submodule_b/source.c"
+        )
+        self.assertEqual(
+            extract_clang_args(src_file, compile_commands_path),
+            [f"-I{self.test_directory_root}/module_b/include"],
+        )
+        self.assertEqual(
+            extract_clang_args("/elsewhere/other.c", compile_commands_path), []
+        )
+
     def test_is_running_under_pytest(self):
         self.assertTrue(is_running_under_pytest())
 
@@ -1,65 +1,25 @@
 import functools
 import json
 import os
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 
 import clang.cindex
 
+from source_index import SourceIndex
+
 
 @functools.lru_cache(maxsize=1)
 def is_running_under_pytest():
     return "PYTEST_CURRENT_TEST" in os.environ
 
-@functools.lru_cache(maxsize=4)
-def _walk_directory(root_dir: str) -> Dict[str, List[str]]:
-    filename_to_path_dict : Dict[str, List[str]]= {}
 
-    for root, _, files in os.walk(root_dir):
-        for filename in files:
-            if filename not in filename_to_path_dict:
-                filename_to_path_dict[filename] = []
-            filename_to_path_dict[filename].append(os.path.join(root, filename))
-    
-    return filename_to_path_dict
+@functools.lru_cache(maxsize=4)
+def _source_index(root_dir: str) -> SourceIndex:
+    return SourceIndex(root_dir)
 
 
 def get_new_file_path(old_file_path: str, new_project_root: str) -> Optional[str]:
-    filename = os.path.basename(old_file_path)
-    candidate_paths = _walk_directory(new_project_root).get(filename, [])
-
-    if not candidate_paths:
-        return None
-
-    if len(candidate_paths) == 1:
-        return candidate_paths[0]
-
-    old_parts = old_file_path.split(os.sep)
-    old_parts.reverse()
-    best_match = None
-    longest_match_length = 0
-    longest_match_candidate_parts_count = 0
-
-    for candidate_path in candidate_paths:
-        candidate_parts = candidate_path.split(os.sep)
-        candidate_parts.reverse()
-
-        match_length = 0
-        while (
-            match_length < len(old_parts)
-            and match_length < len(candidate_parts)
-            and old_parts[match_length] == candidate_parts[match_length]
-        ):
-            match_length += 1
-
-        if match_length > longest_match_length or (
-            match_length == longest_match_length
-            and len(candidate_parts) < longest_match_candidate_parts_count
-        ):
-            longest_match_length = match_length
-            best_match = candidate_path
-            longest_match_candidate_parts_count = len(candidate_parts)
-
-    return best_match
+    return _source_index(new_project_root).longest_suffix_match(old_file_path)
 
 
 def common_path_suffix(path1, path2):
@@ -80,6 +40,29 @@ def common_path_suffix(path1, path2):
     return os.sep.join(common_parts)
 
 
+@functools.lru_cache(maxsize=4)
+def _index_compile_commands(
+    compile_commands_path: str, mtime_ns: int
+) -> Dict[str, List[Tuple[dict, str, str]]]:
+    """Entries of compile_commands.json by the basename of their source file.
+    `mtime_ns` only keys the cache, so an updated file is re-read."""
+    with open(compile_commands_path, "r") as f:
+        compile_commands = json.load(f)
+
+    basename_to_entries: Dict[str, List[Tuple[dict, str, str]]] = {}
+    for entry in compile_commands:
+        try:
+            entry_dir = entry.get("directory", "")
+            entry_file = entry.get("file", "")
+            full_entry_path = os.path.abspath(os.path.join(entry_dir, entry_file))
+        except Exception:
+            continue
+        basename_to_entries.setdefault(os.path.basename(full_entry_path), []).append(
+            (entry, entry_dir, full_entry_path)
+        )
+    return basename_to_entries
+
+
 def extract_clang_args(
     src_file: str, compile_commands_path: str = "/src/repo/compile_commands.json"
 ) -> List[str]:
@@ -87,29 +70,21 @@ def extract_clang_args(
         if not os.path.isfile(compile_commands_path):
             return []
 
-        with open(compile_commands_path, "r") as f:
-            compile_commands = json.load(f)
+        entries = _index_compile_commands(
+            compile_commands_path, os.stat(compile_commands_path).st_mtime_ns
+        )
 
         src_file_abs = os.path.abspath(src_file)
         best_match = None
         longest_suffix = ""
 
-        for entry in compile_commands:
-            try:
-                entry_dir = entry.get("directory", "")
-                entry_file = entry.get("file", "")
-                full_entry_path = os.path.abspath(os.path.join(entry_dir, entry_file))
-
-                if os.path.basename(src_file_abs) != os.path.basename(full_entry_path):
-                    continue
-
-                suffix = common_path_suffix(src_file_abs, full_entry_path)
-                if len(suffix) > len(longest_suffix):
-                    best_match = (entry, entry_dir, full_entry_path, suffix)
-                    longest_suffix = suffix
-
-            except Exception:
-                continue
+        for entry, entry_dir, full_entry_path in entries.get(
+            os.path.basename(src_file_abs), []
+        ):
+            suffix = common_path_suffix(src_file_abs, full_entry_path)
+            if len(suffix) > len(longest_suffix):
+                best_match = (entry, entry_dir, full_entry_path, suffix)
+                longest_suffix = suffix
 
         if best_match is None:
             return []
@@ -1,11 +1,28 @@
 #!/usr/bin/env python3
 
 import argparse
+import glob
+import http.server
+import json
 import logging
 import os
+import sqlite3
 import subprocess
+import threading
 import time
+from contextlib import closing
 from pathlib import Path
+from typing import Dict, Optional, Set, Tuple
+
+# symbolizer_service.py's priority of POVs.
+SYMBOLIZER_PRIORITY_POV = 0
+
+# Seeds without coverage named in the log; the rest are only counted.
+MAX_LOGGED_MISSING = 10
+
+# A directory modified this recently may still change within the same mtime
+# tick, so its listing is not trusted to be up to date.
+MTIME_SLACK_NS = 1_000_000_000
 
 
 
@@ -20,57 +37,247 @@ def setup_file_log_for_test(logfile: str) -> None:
     logger.addHandler(file_handler)
 
 
-def log_corpus_status(corpus_dir: str):
-    seeds = [
-        f
-        for f in os.listdir(corpus_dir)
-        if os.path.isfile(os.path.join(corpus_dir, f)) and not f.startswith(".")
-    ]
-    num_seeds = len(seeds)
-    logging.info(f"[Corpus] '{corpus_dir}' contains {num_seeds} seeds")
+def read_symbolizer_queue(journal: Optional[str]) -> Dict[str, int]:
+    """Raw coverage files queued in symbolizer_service.py's journal, with
+    their priority."""
+    if journal is None or not os.path.isfile(journal):
+        return {}
+    try:
+        with closing(sqlite3.connect(journal, timeout=60)) as db:
+            return dict(db.execute("SELECT raw_cov_file, priority FROM jobs"))
+    except sqlite3.Error as e:
+        logging.warning(f"[Symbolizer] Failed to read {journal}: {e}")
+        return {}
 
 
-def log_coverage_status(cov_dir: str):
-    seeds = [
-        f
-        for f in os.listdir(cov_dir)
-        if os.path.isfile(os.path.join(cov_dir, f))
-        and not f.startswith(".")
-        and not f.endswith(".cov")
-    ]
+class DirState:
+    """Names of the regular, non-hidden files in a directory. The directory
+    is only listed again when its mtime changes, and file types come from the
+    directory entries rather than a stat per file."""
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.names: Set[str] = set()
+        self.__mtime_ns: Optional[int] = None
+
+    def update(self) -> Tuple[Set[str], Set[str]]:
+        """Refresh the listing and return the added and removed names."""
+        try:
+            mtime_ns = os.stat(self.path).st_mtime_ns
+            if mtime_ns == self.__mtime_ns:
+                return set(), set()
+            with os.scandir(self.path) as it:
+                names = {
+                    entry.name
+                    for entry in it
+                    if not entry.name.startswith(".") and entry.is_file()
+                }
+        except FileNotFoundError:
+            mtime_ns, names = None, set()
+        recent = mtime_ns is not None and time.time_ns() - mtime_ns < MTIME_SLACK_NS
+        self.__mtime_ns = None if recent else mtime_ns
+        added, removed = names - self.names, self.names - names
+        self.names = names
+        return added, removed
+
+
+class CoverageState:
+    """Inputs in the coverage dir and which of them have a `.cov` file, kept
+    up to date from the changes of the listing."""
+
+    def __init__(self, cov_dir: str) -> None:
+        self.cov_dir = cov_dir
+        self.dir = DirState(cov_dir)
+        self.inputs: Set[str] = set()
+        self.covered: Set[str] = set()
+
+    def update(self) -> None:
+        added, removed = self.dir.update()
+        for name in removed:
+            if name.endswith(".cov"):
+                self.covered.discard(name[: -len(".cov")])
+            else:
+                self.inputs.discard(name)
+        for name in added:
+            if name.endswith(".cov"):
+                self.covered.add(name[: -len(".cov")])
+            else:
+                self.inputs.add(name)
+
+    def missing(self) -> Set[str]:
+        return self.inputs - self.covered
+
+
+def read_exec_count(workdir: str) -> Optional[int]:
+    """Executions so far over all UniAFL workers, from the counters they
+    dump to `<workdir>/stats`."""
+    total = None
+    for path in glob.glob(os.path.join(workdir, "stats", "worker_*.json")):
+        try:
+            with open(path) as f:
+                total = (total or 0) + json.load(f)["execs"]
+        except (OSError, ValueError, KeyError):
+            continue
+    return total
+
+
+class Watchdog:
+    """Status of one harness's fuzzing, updated incrementally every round.
+    Rates are taken over the time since the previous round."""
+
+    def __init__(
+        self,
+        harness_name: str,
+        workdir: str,
+        corpus_dir: str,
+        cov_dir: str,
+        pov_dir: str,
+        symbolizer_journal: Optional[str] = None,
+    ) -> None:
+        self.harness_name = harness_name
+        self.workdir = workdir
+        self.corpus = DirState(corpus_dir)
+        self.coverage = CoverageState(cov_dir)
+        self.povs = DirState(pov_dir)
+        self.symbolizer_journal = symbolizer_journal
+        self.snapshot: Optional[Dict] = None
+
+    def update(self) -> Dict:
+        now = time.time()
+        prev = self.snapshot
+        self.corpus.update()
+        self.coverage.update()
+        self.povs.update()
+        queued = read_symbolizer_queue(self.symbolizer_journal)
+        execs = read_exec_count(self.workdir)
+
+        missing = self.coverage.missing()
+        queued_missing = {
+            name
+            for name in missing
+            if os.path.join(self.coverage.cov_dir, name) in queued
+        }
+        num_queued_povs = sum(
+            1 for priority in queued.values() if priority == SYMBOLIZER_PRIORITY_POV
+        )
+
+        corpus_per_hour = None
+        execs_per_sec = None
+        if prev is not None and now > prev["time"]:
+            elapsed = now - prev["time"]
+            corpus_per_hour = (len(self.corpus.names) - prev["corpus"]["seeds"]) * (
+                3600 / elapsed
+            )
+            # The counters restart with UniAFL.
+            if execs is not None and prev["execs"] is not None:
+                if prev["execs"] <= execs:
+                    execs_per_sec = (execs - prev["execs"]) / elapsed
 
-    missing_cov = []
-    for seed in seeds:
-        cov_file = os.path.join(cov_dir, seed + ".cov")
-        if not os.path.isfile(cov_file):
-            missing_cov.append(seed)
-
-    logging.info(f"[Coverage] Total seeds + pov: {len(seeds)}")
-    logging.info(f"[Coverage] Seeds or POVs missing .cov files: {len(missing_cov)}")
-    if missing_cov:
-        logging.info("[Coverage] List of seeds or POVs without .cov files:")
-        for seed in missing_cov:
-            logging.info(f"[Coverage]   - {seed}")
-
-
-def log_pov_status(pov_dir: str):
-    povs = [
-        f
-        for f in os.listdir(pov_dir)
-        if os.path.isfile(os.path.join(pov_dir, f)) and not f.startswith(".")
+        self.snapshot = {
+            "harness": self.harness_name,
+            "time": now,
+            "execs": execs,
+            "execs_per_sec": execs_per_sec,
+            "corpus": {
+                "seeds": len(self.corpus.names),
+                "growth_per_hour": corpus_per_hour,
+            },
+            "coverage": {
+                "inputs": len(self.coverage.inputs),
+                "missing": len(missing) - len(queued_missing),
+                "queued": len(queued_missing),
+            },
+            "symbolizer": {
+                "queued": len(queued),
+                "queued_povs": num_queued_povs,
+            },
+            "povs": len(self.povs.names),
+        }
+        self.__missing = sorted(missing - queued_missing)
+        return self.snapshot
+
+    def log_status(self) -> None:
+        status = self.snapshot
+        logging.info("=" * 100)
+        logging.info(
+            f"[Corpus] '{self.corpus.path}' contains {status['corpus']['seeds']} seeds"
+            + (
+                f" ({status['corpus']['growth_per_hour']:+.1f}/h)"
+                if status["corpus"]["growth_per_hour"] is not None
+                else ""
+            )
+        )
+        coverage = status["coverage"]
+        logging.info(f"[Coverage] Total seeds + pov: {coverage['inputs']}")
+        logging.info(
+            f"[Coverage] Seeds or POVs missing .cov files: "
+            f"{coverage['missing'] + coverage['queued']}"
+            f" ({coverage['queued']} queued for symbolization)"
+        )
+        if self.__missing:
+            shown = ", ".join(self.__missing[:MAX_LOGGED_MISSING])
+            more = len(self.__missing) - MAX_LOGGED_MISSING
+            logging.info(
+                f"[Coverage] Without .cov files: {shown}"
+                + (f" and {more} more" if more > 0 else "")
+            )
+        if self.symbolizer_journal is not None:
+            symbolizer = status["symbolizer"]
+            logging.info(
+                f"[Symbolizer] Queue depth: {symbolizer['queued']} "
+                f"({symbolizer['queued_povs']} POVs, "
+                f"{symbolizer['queued'] - symbolizer['queued_povs']} seeds)"
+            )
+        logging.info(f"[POV] '{self.povs.path}' contains {status['povs']} povs")
+        if status["execs_per_sec"] is not None:
+            logging.info(f"[Exec] {status['execs_per_sec']:.1f} execs/s")
+        logging.info("=" * 100)
+
+
+def write_status(path: str, status: Dict) -> None:
+    tmp = f"{path}.tmp.{os.getpid()}"
+    with open(tmp, "wt") as f:
+        json.dump(status, f)
+    os.replace(tmp, path)
+
+
+def prometheus_metrics(status: Dict) -> str:
+    label = f'harness="{status["harness"]}"'
+    metrics = [
+        ("uniafl_execs_total", status["execs"]),
+        ("uniafl_execs_per_second", status["execs_per_sec"]),
+        ("uniafl_corpus_seeds", status["corpus"]["seeds"]),
+        ("uniafl_corpus_growth_per_hour", status["corpus"]["growth_per_hour"]),
+        ("uniafl_coverage_inputs", status["coverage"]["inputs"]),
+        ("uniafl_coverage_missing", status["coverage"]["missing"]),
+        ("uniafl_symbolizer_queued", status["symbolizer"]["queued"]),
+        ("uniafl_symbolizer_queued_povs", status["symbolizer"]["queued_povs"]),
+        ("uniafl_povs", status["povs"]),
     ]
-    num_pov = len(povs)
-    logging.info(f"[POV] '{pov_dir}' contains {num_pov} povs")
+    return "".join(
+        f"{name}{{{label}}} {value}\n" for name, value in metrics if value is not None
+    )
+
+
+def serve_prometheus(port: int, watchdog: Watchdog) -> None:
+    """Serve the latest status of `watchdog` in the Prometheus text format
+    from a background thread."""
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def do_GET(self):
+            status = watchdog.snapshot
+            body = prometheus_metrics(status).encode() if status else b""
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
 
+        def log_message(self, format, *args):
+            pass
 
-def log_uniafl_status(
-    harness_name: str, workdir: str, corpus_dir: str, cov_dir: str, pov_dir: str
-):
-    logging.info("=" * 100)
-    log_corpus_status(corpus_dir)
-    log_coverage_status(cov_dir)
-    log_pov_status(pov_dir)
-    logging.info("=" * 100)
+    server = http.server.ThreadingHTTPServer(("", port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
 
 
 def copy_corpus_to_shared(harness_name: str, corpus_dir: str):
@@ -118,14 +325,54 @@ def main():
         required=True,
         help="Logging interval in seconds",
     )
+    parser.add_argument(
+        "--symbolizer-journal",
+        dest="symbolizer_journal",
+        default=None,
+        help="Journal of symbolizer_service.py to report the queue depth of",
+    )
+    parser.add_argument(
+        "--status-file",
+        dest="status_file",
+        default=None,
+        help="Path of the JSON status snapshot (default: <workdir>/status.json)",
+    )
+    parser.add_argument(
+        "--prometheus-port",
+        dest="prometheus_port",
+        type=int,
+        default=None,
+        help="Port to serve the status on in the Prometheus text format "
+        "(default: None, not served)",
+    )
     args = parser.parse_args()
 
     logging.basicConfig(level=logging.INFO)
 
+    watchdog = Watchdog(
+        args.harness_name,
+        args.workdir,
+        args.corpus_dir,
+        args.cov_dir,
+        args.pov_dir,
+        args.symbolizer_journal,
+    )
+    status_file = args.status_file or os.path.join(args.workdir, "status.json")
+    if args.prometheus_port is not None:
+        try:
+            serve_prometheus(args.prometheus_port, watchdog)
+        except OSError as e:
+            logging.warning(
+                f"[Watchdog] Failed to serve on port {args.prometheus_port}: {e}"
+            )
+
     while True:
-        log_uniafl_status(
-            args.harness_name, args.workdir, args.corpus_dir, args.cov_dir, args.pov_dir
-        )
+        status = watchdog.update()
+        watchdog.log_status()
+        try:
+            write_status(status_file, status)
+        except OSError as e:
+            logging.warning(f"[Watchdog] Failed to write {status_file}: {e}")
         if os.environ.get('TEST_ROUND', 'False') == 'True':
             copy_corpus_to_shared(args.harness_name, args.corpus_dir)
         time.sleep(args.interval)
@@ -1 +1,2 @@
 from .pyfuzzdb import *
+from .raw_cov import *
@@ -1,12 +1,13 @@
 import html
 import json
 import os
-import struct
 import sys
 from dataclasses import dataclass
 from pathlib import Path
 from typing import List
 
+from .raw_cov import read_raw_cov
+
 
 class CovInfo:
     def __init__(self, func_name, src, lines):
@@ -122,15 +123,7 @@ class FuzzDB:
         cov_name = self.cov_dir / seed_name
         if not cov_name.exists():
             return []
-        ret = []
-        with open(cov_name, "rb") as f:
-            while True:
-                tmp = f.read(4)
-                if len(tmp) != 4:
-                    break
-                tmp = struct.unpack("<I", tmp)[0]
-                ret.append(tmp)
-        return ret
+        return read_raw_cov(cov_name).tolist()
 
     def check(self):
         for seed in self.list_seeds_new():
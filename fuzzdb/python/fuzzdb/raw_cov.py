@@ -0,0 +1,77 @@
+"""Reader for the raw coverage files UniAFL writes next to each seed.
+
+A raw coverage file is a headerless array of little-endian PCs; the record
+width is fixed per format version rather than guessed from the file.
+"""
+
+from pathlib import Path
+from typing import Iterator, Union
+
+import numpy as np
+
+__all__ = [
+    "RAW_COV_V1",
+    "RAW_COV_V2",
+    "RAW_COV_VERSION",
+    "RAW_COV_DTYPES",
+    "PIE_BASE",
+    "iter_raw_cov",
+    "read_raw_cov",
+]
+
+RAW_COV_V1 = 1  # 32-bit PCs
+RAW_COV_V2 = 2  # 64-bit PCs (uniafl `CovAddr = u64`)
+RAW_COV_VERSION = RAW_COV_V2
+RAW_COV_DTYPES = {
+    RAW_COV_V1: np.dtype("<u4"),
+    RAW_COV_V2: np.dtype("<u8"),
+}
+
+# Load address of PIE harnesses under the (ASLR-disabled) fuzzing runtime.
+PIE_BASE = 0x555555554000
+DEFAULT_CHUNK_RECORDS = 1 << 20
+
+
+def _record_dtype(version: int) -> np.dtype:
+    if version not in RAW_COV_DTYPES:
+        raise ValueError(f"Unknown raw coverage version: {version}")
+    return RAW_COV_DTYPES[version]
+
+
+def iter_raw_cov(
+    path: Union[str, Path],
+    base: int = 0,
+    version: int = RAW_COV_VERSION,
+    chunk_records: int = DEFAULT_CHUNK_RECORDS,
+) -> Iterator[np.ndarray]:
+    """Yield the PCs of `path` in chunks of at most `chunk_records`, as int64
+    arrays with `base` subtracted (PCs below `base` become negative).
+    A truncated trailing record is ignored."""
+    dtype = _record_dtype(version)
+    chunk_size = chunk_records * dtype.itemsize
+    with open(path, "rb") as f:
+        while True:
+            data = f.read(chunk_size)
+            count = len(data) // dtype.itemsize
+            if count == 0:
+                break
+            pcs = np.frombuffer(data, dtype=dtype, count=count).astype(np.int64)
+            if base:
+                pcs -= base
+            yield pcs
+            if len(data) < chunk_size:
+                break
+
+
+def read_raw_cov(
+    path: Union[str, Path],
+    base: int = 0,
+    version: int = RAW_COV_VERSION,
+    chunk_records: int = DEFAULT_CHUNK_RECORDS,
+) -> np.ndarray:
+    chunks = list(iter_raw_cov(path, base, version, chunk_records))
+    if not chunks:
+        return np.empty(0, dtype=np.int64)
+    if len(chunks) == 1:
+        return chunks[0]
+    return np.concatenate(chunks)
@@ -6,11 +6,13 @@ use std::ffi::OsStr;
 use std::fs;
 use std::fs::File;
 use std::io::{Read, Write};
+use std::os::unix::net::UnixStream;
 use std::os::unix::process::CommandExt;
 use std::path::Path;
 use std::path::PathBuf;
 use std::process::{Child, Command, Stdio};
 use std::sync::Arc;
+use std::time::Instant;
 use tokio::runtime::Handle;
 use tokio::time::{timeout, Duration};
 use walkdir::WalkDir;
@@ -30,11 +32,17 @@ pub struct ExecutorConf {
     pub harness_path: String,
     pub redis_url: String,
     pub language: String,
+    #[serde(default)]
+    pub symbolizer_socket: Option<String>,
 }
 
+/// How often a worker's counters are written out for watchdog.py.
+const STATS_DUMP_INTERVAL: Duration = Duration::from_secs(10);
+
 pub struct ExecStats {
     pub num_crashed_inputs: usize,
     pub num_normal_inputs: usize,
+    dumped_at: Option<Instant>,
 }
 
 impl ExecStats {
@@ -42,12 +50,34 @@ impl ExecStats {
         Self {
             num_crashed_inputs: 0,
             num_normal_inputs: 0,
+            dumped_at: None,
         }
     }
 
     pub fn total(&self) -> usize {
         self.num_crashed_inputs + self.num_normal_inputs
     }
+
+    /// Write the counters to `path` as JSON, unless that was done less than
+    /// STATS_DUMP_INTERVAL ago.
+    pub fn dump_if_due(&mut self, path: &Path) {
+        if self
+            .dumped_at
+            .map_or(false, |t| t.elapsed() < STATS_DUMP_INTERVAL)
+        {
+            return;
+        }
+        self.dumped_at = Some(Instant::now());
+        let data = format!(
+            "{{\"execs\":{},\"crashes\":{}}}",
+            self.total(),
+            self.num_crashed_inputs
+        );
+        let tmp = path.with_extension("tmp");
+        if fs::write(&tmp, data).is_ok() {
+            fs::rename(&tmp, path).ok();
+        }
+    }
 }
 
 pub struct Executor {
@@ -57,7 +87,10 @@ pub struct Executor {
     executor_dir: String,
     pub msa_mgr: MsaManager,
     symbolizer: Option<Child>,
+    symbolizer_socket: Option<PathBuf>,
+    symbolizer_conn: Option<UnixStream>,
     pub stats: ExecStats,
+    stats_path: PathBuf,
     pub rand: StdRand,
     pub coverage_harness_path: String,
     pub coverage_binary_ready: bool,
@@ -73,6 +106,13 @@ macro_rules! get_subarr {
 const DEFAULT_TIMEOUT_LOG: &[u8] = b"EMPTY TIMEOUT LOG";
 const EMPTY_CRASH_CALLSTACK: &[u8] = b"EMPTY_CRASH_CALLSTACK";
 
+/// Priorities understood by symbolizer_service.py; lower is more urgent.
+#[derive(Clone, Copy)]
+enum SymbolizePriority {
+    Pov = 0,
+    Seed = 1,
+}
+
 impl Executor {
     pub fn new(
         config_path: &PathBuf,
@@ -100,6 +140,8 @@ impl Executor {
         let coverage_binary_ready = Path::new(&coverage_harness_path).exists();
         let tmp_dir = msa_mgr.workdir.join("executor_tmp");
         std::fs::create_dir(&tmp_dir).ok();
+        let stats_dir = msa_mgr.workdir.join("stats");
+        std::fs::create_dir(&stats_dir).ok();
         Self {
             worker_idx,
             tmp_fname: tmp_dir
@@ -110,7 +152,10 @@ impl Executor {
             msa_mgr: msa_mgr.clone(),
             executor_dir: executor_dir.clone(),
             symbolizer: None,
+            symbolizer_socket: conf.symbolizer_socket.map(PathBuf::from),
+            symbolizer_conn: None,
             stats: ExecStats::new(),
+            stats_path: stats_dir.join(format!("worker_{}.json", worker_idx)),
             rand: StdRand::with_seed(current_nanos()),
             coverage_harness_path,
             coverage_binary_ready,
@@ -197,6 +242,7 @@ impl Executor {
         }
         self.stats.num_normal_inputs += ok_inputs.len();
         self.stats.num_crashed_inputs += crash_inputs.len();
+        self.stats.dump_if_due(&self.stats_path);
         state.add_if_interesting_seed(stage_name, self, ok_inputs, is_testlang_stage);
         state.add_if_interesting_crash(stage_name, self, crash_inputs);
         Ok(())
@@ -212,13 +258,40 @@ impl Executor {
         self.process_results(stage_name, state, is_testlang_stage)
     }
 
+    /// Save and symbolize the coverage of `fpath`, waiting for the result.
     pub fn save_coverage(&mut self, fpath: &PathBuf, cov: &[CovAddr]) {
+        self.save_coverage_with(fpath, cov, SymbolizePriority::Pov, true);
+    }
+
+    /// Like `save_coverage`, but may return before the coverage is symbolized.
+    pub fn save_pov_coverage(&mut self, fpath: &PathBuf, cov: &[CovAddr]) {
+        self.save_coverage_with(fpath, cov, SymbolizePriority::Pov, false);
+    }
+
+    fn save_coverage_with(
+        &mut self,
+        fpath: &PathBuf,
+        cov: &[CovAddr],
+        priority: SymbolizePriority,
+        wait: bool,
+    ) {
         let fname = fpath.file_name().unwrap().to_str().unwrap().to_string();
         if let Some(cov_path) = self.msa_mgr.save_coverage(&fname, cov) {
-            self.symbolize_coverage(&fpath.display().to_string(), cov, &cov_path);
+            self.symbolize_coverage(&fpath.display().to_string(), cov, &cov_path, priority, wait);
         }
     }
 
+    pub fn save_coverages(&mut self, seeds: &[(PathBuf, &[CovAddr])]) {
+        let mut batch = Vec::new();
+        for (fpath, cov) in seeds {
+            let fname = fpath.file_name().unwrap().to_str().unwrap().to_string();
+            if let Some(cov_path) = self.msa_mgr.save_coverage(&fname, cov) {
+                batch.push((fpath.display().to_string(), cov_path));
+            }
+        }
+        self.run_symbolizer_batch(&batch);
+    }
+
     pub fn save_crash_log(&self, fpath: &PathBuf, crash_log: &[u8]) {
         if let Some(fname) = fpath.file_name().and_then(|n| n.to_str()) {
             let crash_log_fname = format!(".{}.crash_log", fname);
@@ -321,22 +394,129 @@ impl Executor {
         Ok(data)
     }
 
-    fn symbolize_coverage(&mut self, fpath: &String, _cov: &[CovAddr], cov_path: &PathBuf) {
+    fn symbolize_coverage(
+        &mut self,
+        fpath: &String,
+        _cov: &[CovAddr],
+        cov_path: &PathBuf,
+        priority: SymbolizePriority,
+        wait: bool,
+    ) {
         match self.msa_mgr.language {
             Language::C | Language::Cpp | Language::Rust | Language::Go => {
-                self.run_symbolizer(fpath, cov_path)
+                self.run_symbolizer(fpath, cov_path, priority, wait)
             }
-            Language::Jvm => self.run_symbolizer(fpath, cov_path),
+            Language::Jvm => self.run_symbolizer(fpath, cov_path, priority, wait),
             _ => todo!(),
         };
     }
 
-    fn run_symbolizer(&mut self, fpath: &String, cov_path: &PathBuf) {
+    fn run_symbolizer(
+        &mut self,
+        fpath: &String,
+        cov_path: &PathBuf,
+        priority: SymbolizePriority,
+        wait: bool,
+    ) {
         #[cfg(feature = "log")]
         self.log(format!(
             "run_symbolizer: fpath {:?} cov_path {:?}",
             fpath, cov_path
         ));
+        let batch = [(fpath.clone(), cov_path.clone())];
+        if !self.request_symbolizer_service(&batch, priority, wait) {
+            self.run_local_symbolizer(fpath, cov_path);
+        }
+    }
+
+    fn run_local_symbolizer(&mut self, fpath: &String, cov_path: &PathBuf) {
+        let request = format!("{}\n{}\n", fpath, cov_path.to_str().unwrap());
+        if let Err(_reason) = self.request_symbolizer(request.as_bytes()) {
+            #[cfg(feature = "log")]
+            self.log(format!("Symbolizer failed: {}", _reason));
+            self.write_empty_cov(cov_path);
+        }
+        #[cfg(feature = "log")]
+        self.log(format!("run_symbolizer"));
+    }
+
+    /// Symbolize several inputs with one request. Only harness_coverage_runner.py
+    /// understands `BATCH <n>`, so other symbolizers get one request per input.
+    fn run_symbolizer_batch(&mut self, batch: &[(String, PathBuf)]) {
+        if batch.is_empty()
+            || self.request_symbolizer_service(batch, SymbolizePriority::Seed, false)
+        {
+            return;
+        }
+        if !self.coverage_binary_ready || batch.len() < 2 {
+            for (fpath, cov_path) in batch {
+                self.run_local_symbolizer(fpath, cov_path);
+            }
+            return;
+        }
+        #[cfg(feature = "log")]
+        self.log(format!("run_symbolizer_batch: {} inputs", batch.len()));
+        let mut request = format!("BATCH {}\n", batch.len());
+        for (fpath, cov_path) in batch {
+            request.push_str(&format!("{}\n{}\n", fpath, cov_path.to_str().unwrap()));
+        }
+        if let Err(_reason) = self.request_symbolizer(request.as_bytes()) {
+            #[cfg(feature = "log")]
+            self.log(format!("Symbolizer failed: {}", _reason));
+            for (_, cov_path) in batch {
+                self.write_empty_cov(cov_path);
+            }
+        }
+    }
+
+    /// Hand `batch` to the harness-wide symbolizer_service.py if it is up.
+    /// Unless `wait`, this returns as soon as the service has queued the batch.
+    /// Returns false if the batch could not be sent, and the executor has to
+    /// symbolize it itself.
+    fn request_symbolizer_service(
+        &mut self,
+        batch: &[(String, PathBuf)],
+        priority: SymbolizePriority,
+        wait: bool,
+    ) -> bool {
+        let socket_path = match self.symbolizer_socket.as_ref() {
+            Some(socket_path) => socket_path,
+            None => return false,
+        };
+        if self.symbolizer_conn.is_none() {
+            match UnixStream::connect(socket_path) {
+                Ok(conn) => {
+                    conn.set_read_timeout(Some(Duration::from_secs(3600))).ok();
+                    self.symbolizer_conn = Some(conn);
+                }
+                Err(_) => return false,
+            }
+        }
+        let mut request = format!("{} {} {}\n", priority as u8, wait as u8, batch.len());
+        for (fpath, cov_path) in batch {
+            request.push_str(&format!("{}\n{}\n", fpath, cov_path.display()));
+        }
+        let expected: &[u8] = if wait { b"DONE\n" } else { b"QUEUED\n" };
+        let mut reply = vec![0; expected.len()];
+        let conn = self.symbolizer_conn.as_mut().unwrap();
+        if conn.write_all(request.as_bytes()).is_err() {
+            #[cfg(feature = "log")]
+            self.log(format!("Symbolizer service failed"));
+            self.symbolizer_conn = None;
+            return false;
+        }
+        // Once written, the batch may already be queued and journaled, so it is
+        // left to the service even without a proper reply: symbolizing it here
+        // as well would race with the service on the same `.cov`.
+        if conn.read_exact(&mut reply).is_err() || reply != expected {
+            #[cfg(feature = "log")]
+            self.log(format!("Symbolizer service did not reply"));
+            self.symbolizer_conn = None;
+        }
+        true
+    }
+
+    fn request_symbolizer(&mut self, request: &[u8]) -> Result<(), &'static str> {
         self.ensure_running_symbolizer();
         let child = self.symbolizer.as_mut().unwrap();
         let stdin = child.stdin.as_mut().expect("Fail to get symbolizer stdin");
@@ -344,10 +524,7 @@ impl Executor {
             .stdout
             .as_mut()
             .expect("Fail to get symbolizer stdout");
-        stdin.write_all(fpath.as_bytes()).ok();
-        stdin.write_all(b"\n").ok();
-        stdin.write_all(cov_path.to_str().unwrap().as_bytes()).ok();
-        stdin.write_all(b"\n").ok();
+        stdin.write_all(request).ok();
         stdin.flush().ok();
 
         let rt = tokio::runtime::Runtime::new().unwrap();
@@ -365,15 +542,7 @@ impl Executor {
                 Err(_) => Err("timeout"),
             }
         };
-        let result = rt.block_on(fut);
-
-        if let Err(reason) = result {
-            #[cfg(feature = "log")]
-            self.log(format!("Symbolizer failed: {}", reason));
-            self.write_empty_cov(cov_path);
-        }
-        #[cfg(feature = "log")]
-        self.log(format!("run_symbolizer"));
+        rt.block_on(fut)
     }
 
     fn write_empty_cov(&self, cov_path: &PathBuf) {
@@ -9,6 +9,9 @@ use std::fs::File;
 use std::io::{Read, Write};
 use std::os::raw::c_char;
 use std::path::PathBuf;
+use std::sync::atomic::{AtomicU32, AtomicU64, Ordering};
+use std::sync::Arc;
+use std::time::{SystemTime, UNIX_EPOCH};
 
 #[cfg(feature = "log")]
 use {fs2::FileExt, std::fs::OpenOptions};
@@ -36,6 +39,61 @@ pub struct MsaConfigJson {
     ms_per_exec: u32,
     max_len: usize,
     allow_timeout_bug: bool,
+    #[serde(default)]
+    exec_calibration_path: Option<String>,
+}
+
+/// Seconds between checks of the exec-speed calibration file.
+const CALIBRATION_REFRESH_SECS: u64 = 60;
+
+#[derive(Deserialize)]
+struct ExecCalibrationJson {
+    ms_per_exec: u32,
+}
+
+/// Batch size from the latest result of exec_calibrator.py, which keeps
+/// re-measuring the exec speed during the run.
+struct ExecCalibration {
+    path: PathBuf,
+    batch_size: AtomicU32,
+    checked_at: AtomicU64,
+}
+
+impl ExecCalibration {
+    fn new(path: PathBuf, batch_size: u32) -> Self {
+        Self {
+            path,
+            batch_size: AtomicU32::new(batch_size),
+            checked_at: AtomicU64::new(0),
+        }
+    }
+
+    fn batch_size(&self, capacity: u32) -> u32 {
+        let now = SystemTime::now()
+            .duration_since(UNIX_EPOCH)
+            .map(|d| d.as_secs())
+            .unwrap_or(0);
+        let checked_at = self.checked_at.load(Ordering::Relaxed);
+        if now >= checked_at + CALIBRATION_REFRESH_SECS
+            && self
+                .checked_at
+                .compare_exchange(checked_at, now, Ordering::Relaxed, Ordering::Relaxed)
+                .is_ok()
+        {
+            if let Some(ms_per_exec) = self.read_ms_per_exec() {
+                let batch_size = MsaManager::calculate_input_per_worker(ms_per_exec).min(capacity);
+                self.batch_size.store(batch_size, Ordering::Relaxed);
+            }
+        }
+        self.batch_size.load(Ordering::Relaxed)
+    }
+
+    fn read_ms_per_exec(&self) -> Option<u32> {
+        let data = std::fs::read(&self.path).ok()?;
+        serde_json::from_slice::<ExecCalibrationJson>(&data)
+            .ok()
+            .map(|calibration| calibration.ms_per_exec)
+    }
 }
 
 #[repr(C)]
@@ -92,6 +150,7 @@ pub struct MsaManager {
     pub config_path: PathBuf,
     pub max_len: usize,
     pub allow_timeout_bug: bool,
+    exec_calibration: Option<Arc<ExecCalibration>>,
 }
 unsafe impl Send for MsaManager {}
 
@@ -193,6 +252,19 @@ impl MsaManager {
             harness_name: config.harness_name,
             max_len: config.max_len,
             allow_timeout_bug: config.allow_timeout_bug,
+            exec_calibration: config
+                .exec_calibration_path
+                .map(|path| Arc::new(ExecCalibration::new(PathBuf::from(path), input_per_worker))),
+        }
+    }
+
+    /// Number of inputs a worker runs per batch. The shared memory holds
+    /// `input_per_worker` inputs per worker, so re-calibration can only lower
+    /// the batch size from there when executions turn out to be slower.
+    pub fn batch_size(&self) -> u32 {
+        match &self.exec_calibration {
+            Some(calibration) => calibration.batch_size(self.input_per_worker),
+            None => self.input_per_worker,
         }
     }
 
@@ -53,9 +53,10 @@ impl MsaStage for GivenFuzzerStage {
         #[cfg(feature = "log")]
         msa_mgr.log(self.name(), worker_idx, "Let fuzzer go".to_string());
         msa_mgr.set_mode(worker_idx, ExecMode::RunFuzzer, false);
-        msa_mgr.set_iter_cnt(worker_idx, msa_mgr.input_per_worker);
+        let batch_size = msa_mgr.batch_size();
+        msa_mgr.set_iter_cnt(worker_idx, batch_size);
         executor.execute_loaded_inputs(self.name(), state, false)?;
-        executor.stats.num_normal_inputs += msa_mgr.input_per_worker as usize;
+        executor.stats.num_normal_inputs += batch_size as usize;
         Ok(true)
     }
 }
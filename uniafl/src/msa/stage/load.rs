@@ -100,7 +100,7 @@ impl LoadStage {
         while idx < seeds.len() {
             msa_mgr.set_mode(worker_idx, ExecMode::ExecuteInput, false);
             let (loaded, next) =
-                self.load(msa_mgr, msa_mgr.input_per_worker, worker_idx, &seeds[idx..]);
+                self.load(msa_mgr, msa_mgr.batch_size(), worker_idx, &seeds[idx..]);
             idx += next;
             if loaded {
                 if let Err(e) = executor.execute_loaded_inputs(self.name(), state, false) {
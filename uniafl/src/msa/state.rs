@@ -235,10 +235,13 @@ impl UniState {
             }
         }
 
-        for (corpus_id, fpath, cov, is_new) in for_saving {
-            if is_new {
-                executor.save_coverage(&fpath, cov);
-            }
+        let new_seeds: Vec<_> = for_saving
+            .iter()
+            .filter(|(_, _, _, is_new)| *is_new)
+            .map(|(_, fpath, cov, _)| (fpath.clone(), *cov))
+            .collect();
+        executor.save_coverages(&new_seeds);
+        for (corpus_id, fpath, cov, _) in for_saving {
             let fname = fpath.file_name().unwrap().to_str().unwrap().to_string();
             {
                 self.scheduler
@@ -314,7 +317,7 @@ impl UniState {
                 corpus.has_filename(&path)
             };
             if !in_corpus {
-                executor.save_coverage(&path, cov);
+                executor.save_pov_coverage(&path, cov);
             }
             executor.save_crash_log(&path, &raw_log);
             executor.save_call_stack(&path, &raw_log);